@@ -0,0 +1,410 @@
+import json
+import time
+import uuid
+from typing import Literal, Optional
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+
+import db
+import sse
+import batch
+import jobs
+import users
+import repair
+import settings
+import versions
+import transfer
+import services
+import semantic
+
+router = APIRouter(prefix="/api/v1", tags=["api"])
+
+
+class SessionRequest(BaseModel):
+	name: str = Field("Anonymous", min_length=1, max_length=100)
+
+
+class CreateSnippetRequest(BaseModel):
+	name: str = "New Code Snippet"
+
+
+class GenerateRequest(BaseModel):
+	prompt: str
+
+
+class FeedbackRequest(BaseModel):
+	feedback: str
+
+
+class RepairRequest(BaseModel):
+	iterations: int = Field(settings.REPAIR_MAX_ITERATIONS, ge=1, le=10)
+	max_tokens: int = Field(settings.REPAIR_MAX_TOKENS, ge=1)
+	max_seconds: float = Field(settings.REPAIR_MAX_SECONDS, gt=0, le=600)
+
+
+class JobRequest(BaseModel):
+	action: str
+	input: Optional[str] = None
+
+
+# Compact JSON representation of a snippet row
+def snippet_json(snippet):
+	return {
+		"id": snippet["id"],
+		"name": snippet["name"],
+		"coding_language": snippet["coding_language"],
+		"communication_language": snippet["communication_language"],
+		"code": snippet["code"],
+		"tests": snippet["tests"],
+		"has_code": bool(snippet["code_value"]),
+		"has_tests": bool(snippet["tests_value"]),
+	}
+
+
+def job_json(job):
+	return {
+		"id": job["id"],
+		"snippet_id": job["snippet_id"],
+		"action": job["action"],
+		"inputs": json.loads(job["inputs"]),
+		"status": job["status"],
+		"inline": bool(job["inline"]),
+		"error": job["error"],
+		"created_at": job["created_at"],
+		"started_at": job["started_at"],
+		"finished_at": job["finished_at"],
+	}
+
+
+# Snippets of other users are reported as missing rather than forbidden, so their ids stay private
+def get_snippet_or_404(snippet_id):
+	snippet = db.get_snippet(snippet_id)
+	if snippet is None or not users.can_access(snippet):
+		raise HTTPException(status_code=404, detail="Snippet not found")
+	return snippet
+
+
+def session_json(user_id):
+	user = db.get_user(user_id)
+	return {"user": {"id": user["id"], "name": user["name"]}, "quota": users.quotas.status(user_id)}
+
+
+# Start a session for a new user. The token authenticates later requests as a bearer token or,
+# for browsers, through the session cookie set here
+@router.post("/sessions", status_code=201)
+async def create_session(request: Request, response: Response, body: SessionRequest = SessionRequest()):
+	token, user_id = users.start_session(request.client.host if request.client else "unknown", body.name)
+	response.headers["Set-Cookie"] = users.cookie_header(token)
+	return {"token": token, **session_json(user_id)}
+
+
+# The user of the request's session and what is left of their quotas
+@router.get("/session")
+async def get_session():
+	if users.current().startswith("address:"):
+		raise HTTPException(status_code=401, detail="No session")
+	return session_json(users.current())
+
+
+@router.delete("/session", status_code=204)
+async def delete_session(request: Request):
+	token = users.request_token(request.headers)
+	if token:
+		users.end_session(token)
+	response = Response(status_code=204)
+	response.delete_cookie(users.COOKIE)
+	return response
+
+
+# One page of snippets; pass the returned next cursor as after to fetch the following page
+@router.get("/snippets")
+async def list_snippets(
+	after: int = 0,
+	limit: int = Query(settings.SNIPPETS_PAGE_SIZE, ge=1, le=500),
+	q: str = "",
+	coding_language: str = "",
+	communication_language: str = "",
+):
+	snippets, next_cursor = db.list_snippets(
+		after, limit, q, coding_language, communication_language, owner=users.current()
+	)
+	return {
+		"items": [
+			{
+				"id": snippet["id"],
+				"name": snippet["name"],
+				"coding_language": snippet["coding_language"],
+				"communication_language": snippet["communication_language"],
+			}
+			for snippet in snippets
+		],
+		"next": next_cursor,
+	}
+
+
+@router.post("/snippets", status_code=201)
+async def create_snippet(body: CreateSnippetRequest = CreateSnippetRequest()):
+	snippet_id = str(uuid.uuid4())
+	db.create_snippet(snippet_id, body.name, users.current())
+	return snippet_json(db.get_snippet(snippet_id))
+
+
+@router.get("/snippets/{snippet_id}")
+async def get_snippet(snippet_id: str):
+	return snippet_json(get_snippet_or_404(snippet_id))
+
+
+@router.delete("/snippets/{snippet_id}", status_code=204)
+async def delete_snippet(snippet_id: str):
+	get_snippet_or_404(snippet_id)
+	services.delete_snippet(snippet_id)
+	return Response(status_code=204)
+
+
+@router.post("/snippets/{snippet_id}/generate")
+async def generate_code(snippet_id: str, body: GenerateRequest):
+	get_snippet_or_404(snippet_id)
+	return snippet_json(await jobs.job_queue.run("generate_code", snippet_id, body.prompt))
+
+
+@router.post("/snippets/{snippet_id}/improve")
+async def improve_code(snippet_id: str, body: FeedbackRequest):
+	get_snippet_or_404(snippet_id)
+	return snippet_json(await jobs.job_queue.run("improve_code", snippet_id, body.feedback))
+
+
+@router.post("/snippets/{snippet_id}/tests")
+async def generate_test_cases(snippet_id: str):
+	get_snippet_or_404(snippet_id)
+	return snippet_json(await jobs.job_queue.run("generate_test_cases", snippet_id))
+
+
+@router.post("/snippets/{snippet_id}/tests/improve")
+async def improve_test_cases(snippet_id: str, body: FeedbackRequest):
+	get_snippet_or_404(snippet_id)
+	return snippet_json(await jobs.job_queue.run("improve_test_cases", snippet_id, body.feedback))
+
+
+@router.post("/snippets/{snippet_id}/run")
+async def run_test_code(snippet_id: str):
+	get_snippet_or_404(snippet_id)
+	async with jobs.job_queue.lane("run_test_code", snippet_id):
+		snippet, status, test_run = await services.run_tests(snippet_id)
+	return {"id": snippet["id"], "status": bool(status), "test_run": test_run}
+
+
+@router.post("/snippets/{snippet_id}/regenerate")
+async def regenerate_code(snippet_id: str):
+	get_snippet_or_404(snippet_id)
+	return snippet_json(await jobs.job_queue.run("regenerate_code", snippet_id))
+
+
+# Generate tests if needed, then run them and regenerate the code until they pass or a limit is hit
+@router.post("/snippets/{snippet_id}/repair")
+async def repair_code(snippet_id: str, body: RepairRequest = RepairRequest()):
+	get_snippet_or_404(snippet_id)
+	async with jobs.job_queue.lane("repair_code", snippet_id):
+		result = await repair.repair(snippet_id, body.iterations, body.max_tokens, body.max_seconds)
+	return {"id": snippet_id, **result, "snippet": snippet_json(db.get_snippet(snippet_id))}
+
+
+@router.get("/snippets/{snippet_id}/repairs")
+async def list_repairs(snippet_id: str, limit: int = Query(20, ge=1, le=100)):
+	get_snippet_or_404(snippet_id)
+	return [
+		{
+			"id": run["id"],
+			"created_at": run["created_at"],
+			"status": bool(run["status"]),
+			"stop_reason": run["stop_reason"],
+			"iterations": run["iterations"],
+			"duration_ms": run["duration_ms"],
+			"total_tokens": run["total_tokens"],
+			"history": json.loads(run["history"]),
+		}
+		for run in db.list_repair_runs(snippet_id, limit)
+	]
+
+
+# Queue a model backed action and return straight away; identical queued or running jobs are shared
+@router.post("/snippets/{snippet_id}/jobs", status_code=202)
+async def submit_job(snippet_id: str, body: JobRequest, response: Response):
+	get_snippet_or_404(snippet_id)
+	if body.action not in services.ACTIONS:
+		raise HTTPException(status_code=422, detail=f"Unknown action {body.action}")
+	inputs = []
+	if services.ACTION_INPUTS[body.action] is not None:
+		if not body.input:
+			raise HTTPException(status_code=422, detail=f"Action {body.action} needs an input")
+		inputs.append(body.input)
+
+	job, created = jobs.job_queue.submit(body.action, snippet_id, *inputs)
+	if not created:
+		response.status_code = 200
+	response.headers["Location"] = f"{router.prefix}/jobs/{job['id']}"
+	return job_json(job)
+
+
+@router.get("/snippets/{snippet_id}/jobs")
+async def list_jobs(snippet_id: str, limit: int = Query(20, ge=1, le=100)):
+	get_snippet_or_404(snippet_id)
+	return [job_json(job) for job in db.list_jobs(snippet_id, limit)]
+
+
+def get_job_or_404(job_id):
+	job = db.get_job(job_id)
+	if job is None or not users.can_access(job):
+		raise HTTPException(status_code=404, detail="Job not found")
+	return job
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+	return job_json(get_job_or_404(job_id))
+
+
+# Server-Sent Events with a status event whenever the job changes, ending once it finishes
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+	get_job_or_404(job_id)
+
+	async def events():
+		async for job in jobs.job_queue.watch(job_id):
+			if job is not None:
+				yield sse.sse_event("status", job_json(job))
+
+	return sse.event_stream(events())
+
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+	get_job_or_404(job_id)
+	return job_json(jobs.job_queue.cancel(job_id))
+
+
+def version_json(version):
+	return {
+		"version": version["version"],
+		"created_at": version["created_at"],
+		"source": version["source"],
+		"prompt_tokens": version["prompt_tokens"],
+		"completion_tokens": version["completion_tokens"],
+		"stored_bytes": version["size"],
+		"snapshot": bool(version["full"]),
+	}
+
+
+def get_version_or_404(snippet_id, version):
+	get_snippet_or_404(snippet_id)
+	row = db.get_version(snippet_id, version)
+	if row is None:
+		raise HTTPException(status_code=404, detail="Version not found")
+	return row
+
+
+# Code and tests revisions of a snippet, newest first, without their bodies
+@router.get("/snippets/{snippet_id}/versions")
+async def list_versions(snippet_id: str, limit: int = Query(50, ge=1, le=500)):
+	get_snippet_or_404(snippet_id)
+	return [version_json(version) for version in db.list_versions(snippet_id, limit)]
+
+
+@router.get("/snippets/{snippet_id}/versions/{version}")
+async def get_version(snippet_id: str, version: int):
+	row = get_version_or_404(snippet_id, version)
+	return {**version_json(row), "code": row["code"], "tests": row["tests"]}
+
+
+# Unified diff of a version's code and tests against another version, by default the one before it
+@router.get("/snippets/{snippet_id}/versions/{version}/diff")
+async def diff_version(snippet_id: str, version: int, against: Optional[int] = None):
+	new = get_version_or_404(snippet_id, version)
+	if against is None:
+		against = version - 1
+	old = get_version_or_404(snippet_id, against) if against > 0 else {"code": "", "tests": ""}
+	return {"version": version, "against": against, **versions.unified(old, new, against, version)}
+
+
+@router.post("/snippets/{snippet_id}/versions/{version}/restore")
+async def restore_version(snippet_id: str, version: int):
+	get_version_or_404(snippet_id, version)
+	db.restore_version(snippet_id, version)
+	return snippet_json(db.get_snippet(snippet_id))
+
+
+# Create and generate many snippets at once from a JSON list, a JSONL body or an uploaded JSONL file.
+# Streams one JSON line per snippet as results are committed, then a summary line
+@router.post("/batches")
+async def create_batch(request: Request):
+	content_type = request.headers.get("content-type", "")
+	if content_type.startswith("multipart/form-data"):
+		form = await request.form()
+		upload = form.get("file")
+		if upload is None or isinstance(upload, str):
+			raise HTTPException(status_code=422, detail="Upload the prompts as a file field")
+		text = (await upload.read()).decode("utf-8")
+		jsonl = not upload.filename.endswith(".json")
+	else:
+		text = (await request.body()).decode("utf-8")
+		jsonl = "ndjson" in content_type or "jsonl" in content_type
+
+	items = batch.parse_items(text, jsonl)
+
+	async def lines():
+		async for result in batch.generate(items):
+			yield json.dumps(result) + "\n"
+
+	return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+# Earlier snippets generated from prompts similar to this one, best first, for offering their code
+# instead of generating it again. Those scoring at least SEMANTIC_REUSE_THRESHOLD with the same key
+# words would be reused as is
+@router.get("/prompts/similar")
+async def similar_prompts(q: str = Query(..., min_length=1), limit: int = Query(5, ge=1, le=20)):
+	return [
+		{
+			"id": snippet["id"],
+			"name": snippet["name"],
+			"coding_language": snippet["coding_language"],
+			"score": round(score, 4),
+			"reusable": score >= settings.SEMANTIC_REUSE_THRESHOLD and semantic.prompt_index.same_words(snippet["id"], q),
+		}
+		for snippet, score in services.similar_snippets(q, limit)
+	]
+
+
+# Every snippet the user can see, streamed as JSONL with each snippet's prompt and, unless history
+# is false, the code and tests of each of its versions, or as a zip of code and tests files
+@router.get("/export")
+async def export_snippets(format: Literal["jsonl", "zip"] = "jsonl", history: bool = True):
+	filename = f"snippets-{time.strftime('%Y%m%d')}.{format}"
+	headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+	if format == "zip":
+		return StreamingResponse(transfer.export_zip(users.current()), media_type="application/zip", headers=headers)
+	return StreamingResponse(
+		transfer.export_jsonl(users.current(), history), media_type="application/x-ndjson", headers=headers
+	)
+
+
+# Import snippets from JSONL in the export format, sent as the body or an uploaded file, as the
+# current user's. Snippets whose id is already taken are skipped
+@router.post("/import")
+async def import_snippets(request: Request):
+	if request.headers.get("content-type", "").startswith("multipart/form-data"):
+		form = await request.form()
+		upload = form.get("file")
+		if upload is None or isinstance(upload, str):
+			raise HTTPException(status_code=422, detail="Upload the snippets as a file field")
+		chunks = transfer.upload_chunks(upload)
+	else:
+		chunks = request.stream()
+	return await transfer.import_lines(transfer.lines(chunks), users.current())
+
+
+# Copy the database to a new file under BACKUP_DIR without holding up other requests. Admin only
+@router.post("/backups", status_code=201)
+async def create_backup(request: Request):
+	users.require_admin(request.headers)
+	return await transfer.backup()
@@ -1,82 +1,147 @@
-import os
-import sqlite3
 import uuid
-import json
-from dotenv import load_dotenv
-from openai import OpenAI
-from fastapi import FastAPI, Request, Form
-from fastapi.responses import HTMLResponse, RedirectResponse
+import logging
+import contextlib
+from fastapi import FastAPI, Depends, HTTPException, Request, Form
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 
-load_dotenv()
-
-client = OpenAI()
-client.api_key = os.getenv("OPENAI_API_KEY")
-
-app = FastAPI()
+import db
+import llm
+import api
+import sse
+import jobs
+import users
+import repair
+import metrics
+import tracing
+import runner
+import semantic
+import backends
+import settings
+import services
+
+logging.basicConfig(level=settings.LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+# The OpenAI client's HTTP library logs every request at INFO
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+logger = logging.getLogger("app")
+
+
+# Everything that touches the outside world is set up here rather than at import, so importing
+# the app stays cheap for every worker and script, and needs neither the database nor an API key
+@contextlib.asynccontextmanager
+async def lifespan(app):
+	tracing.configure()
+	applied = db.migrate()
+	if applied:
+		logger.info("applied %d schema migrations", applied)
+	db.delete_expired_sessions()
+	llm.response_cache.open()
+	# Index the stored prompts for reusing code generated for near duplicates
+	semantic.prompt_index.load(db.list_prompts(settings.SEMANTIC_INDEX_SIZE))
+	# Compile every template now instead of on its first request
+	for name in templates.env.list_templates(extensions=("html",)):
+		templates.env.get_template(name)
+	try:
+		await llm.backend.start()
+	except backends.BackendError as error:
+		logger.warning("model backend not ready, model calls will fail: %s", error)
+	# Warm sandbox workers used to run tests locally
+	await runner.test_runner.start()
+	# Background job workers, resuming jobs left over from the previous run
+	await jobs.job_queue.start()
+	try:
+		yield
+	finally:
+		await jobs.job_queue.stop()
+		await runner.test_runner.stop()
+		await llm.backend.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(users.SessionMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
 templates = Jinja2Templates(directory="templates")
-
-# Initialize SQLite connection and cursor
-conn = sqlite3.connect("snippet.db")
-cursor = conn.cursor()
-
-# Create a table to store snippets if not exists
-cursor.execute(
-	"""
-	CREATE TABLE IF NOT EXISTS snippets (
-		id TEXT PRIMARY KEY,
-		name TEXT DEFAULT "",
-		code TEXT DEFAULT "",
-		tests TEXT DEFAULT "",
-		coding_language TEXT DEFAULT "",
-		communication_language TEXT DEFAULT ""
+# Templates are only read from disk again when they change if TEMPLATES_AUTO_RELOAD is set
+templates.env.auto_reload = settings.TEMPLATES_AUTO_RELOAD
+metrics.instrument_templates(templates.env)
+
+app.include_router(api.router)
+
+# Templates for the panels that fragment endpoints render on their own
+PANELS = {
+	"code": "partials/code_panel.html",
+	"tests": "partials/tests_panel.html",
+	"results": "partials/results_panel.html",
+}
+
+# Fragment actions and the panel each one changes
+FRAGMENT_ACTIONS = {
+	"generate_code": "code",
+	"improve_code": "code",
+	"regenerate_code": "code",
+	"generate_test_cases": "tests",
+	"improve_test_cases": "tests",
+}
+
+
+# The snippet_id form field of a request, provided the snippet exists and the current user may see it
+def owned_snippet_id(snippet_id: str = Form(...)):
+	snippet = db.get_snippet(snippet_id)
+	if snippet is None or not users.can_access(snippet):
+		raise HTTPException(status_code=404, detail="Snippet not found")
+	return snippet_id
+
+
+# Define common function to build the template context for a selected snippet
+def snippet_context(request, snippet, **extra):
+	return {
+		"request": request,
+		"snippets": [snippet],
+		"snippet": snippet,
+		"snippet_selected": True,
+		"generated_code": True,
+		"improved_code": True,
+		"generated_tests": True,
+		"improved_tests": True,
+		"regenerated_code": True,
+		"code_value": bool(snippet["code_value"]),
+		"tests_value": bool(snippet["tests_value"]),
+		**extra,
+	}
+
+
+# Build the context for one page of the snippets list
+def listing_context(request, after=0, q="", coding_language="", communication_language=""):
+	filters = {"q": q, "coding_language": coding_language, "communication_language": communication_language}
+	snippets, next_cursor = db.list_snippets(
+		after, None, q, coding_language, communication_language, owner=users.current()
 	)
-"""
-)
-conn.commit()
-
-
-# Define common function to fetch snippet id to be passed between frontend and backend
-def get_snippet(snippet_id):
-	cursor.execute("SELECT * FROM snippets WHERE id = ?", (snippet_id,))
-	return cursor.fetchone()
-
-# Define common function to fetch status of values populated in code and test columns
-def get_code_test_status(snippet_id):
-	cursor.execute("SELECT tests FROM snippets WHERE id = ?", (snippet_id,))
-	tests = cursor.fetchone()
-
-	cursor.execute("SELECT code FROM snippets WHERE id = ?", (snippet_id,))
-	code = cursor.fetchone()
-
-	if code[0] == "":
-		code_value = False
-	else:
-		code_value = True
-
-	if tests[0] == "":
-		tests_value = False
-	else:
-		tests_value = True
-
-	return code_value, tests_value
+	return {
+		"request": request,
+		"snippets": snippets,
+		"next_cursor": next_cursor,
+		"filters": filters,
+		"snippet_selected": False,
+	}
 
 
 # Index route to render the main page
 @app.get("/", response_class=HTMLResponse)
-async def index(request: Request):
-	# Fetch all snippets from the database
-	cursor.execute("SELECT id, name FROM snippets")
-	snippets_data = cursor.fetchall()
-	snippet_selected = False
-	return templates.TemplateResponse(
-		"index.html",
-		{
-			"request": request,
-			"snippets": snippets_data,
-			"snippet_selected": snippet_selected,
-		},
-	)
+async def index(request: Request, q: str = "", coding_language: str = "", communication_language: str = ""):
+	# Fetch the first page of snippets and the languages for the filters
+	context = listing_context(request, 0, q, coding_language, communication_language)
+	context["coding_languages"], context["communication_languages"] = db.list_languages()
+	return templates.TemplateResponse("index.html", context)
+
+
+# Endpoint to render the next page of the snippets list for the sidebar
+@app.get("/fragments/snippets", response_class=HTMLResponse)
+async def snippet_list_fragment(
+	request: Request, after: int = 0, q: str = "", coding_language: str = "", communication_language: str = ""
+):
+	context = listing_context(request, after, q, coding_language, communication_language)
+	return templates.TemplateResponse("partials/snippet_list.html", context)
 
 
 # Endpoint to create a new snippet
@@ -87,436 +152,194 @@ async def add_snippet(request: Request):
 	# Default name for new snippet
 	snippet_name = f"New Code Snippet"
 	# Insert the new snippet into the database
-	cursor.execute(
-		"INSERT INTO snippets (id, name) VALUES (?, ?)", (snippet_id, snippet_name)
-	)
-	conn.commit()
+	db.create_snippet(snippet_id, snippet_name, users.current())
 	# Redirect back to the index page
 	return RedirectResponse("/", status_code=303)
 
 
 # Endpoint to delete a snippet
 @app.post("/delete_snippet", response_class=RedirectResponse)
-async def delete_snippet(request: Request, snippet_id: str = Form(...)):
+async def delete_snippet(request: Request, snippet_id: str = Depends(owned_snippet_id)):
 	# Delete the snippet from the database
-	cursor.execute("DELETE FROM snippets WHERE id = ?", (snippet_id,))
-	conn.commit()
+	services.delete_snippet(snippet_id)
 	# Redirect back to the index page
 	return RedirectResponse("/", status_code=303)
 
 
 # Endpoint to view a snippet
 @app.post("/view_snippet", response_class=HTMLResponse)
-async def view_snippet(request: Request, snippet_id: str = Form(...)):
+async def view_snippet(request: Request, snippet_id: str = Depends(owned_snippet_id)):
 
 	# Retrieve the snippet details from the database
-	code_value, tests_value = get_code_test_status(snippet_id)
-	snippet = get_snippet(snippet_id)
-	return templates.TemplateResponse(
-		"index.html",
-		{
-			"request": request,
-			"snippets": [snippet],
-			"snippet_selected": True,
-			"generated_code": True,
-			"improved_code": True,
-			"generated_tests": True,
-			"improved_tests": True,
-			"regenerated_code": True,
-			"code_value": code_value,
-			"tests_value": tests_value,
-		},
-	)
+	snippet = db.get_snippet(snippet_id)
+	return templates.TemplateResponse("index.html", snippet_context(request, snippet))
 
 
 # Endpoint for code generation
 @app.post("/generate_code", response_class=HTMLResponse)
 async def generate_code(
-	request: Request, code_generation: str = Form(...), snippet_id: str = Form(...)
+	request: Request, code_generation: str = Form(...), snippet_id: str = Depends(owned_snippet_id)
 ):
 
-	response = client.chat.completions.create(
-		model="gpt-4o",
-		response_format={"type": "json_object"},
-		messages=[
-			{
-				"role": "system",
-				"content": """You are a helpful assistant to design and generate code in a formal and professional setting.
-			You will output the response in JSON format as follows ShortCodeName, CodingLanguage, CommunicationLanguage, Code. Stick to this exact format and words.
-			This is a code generation service so you will only generate the appropriate code snippets as a function with appropriate syntax and indenting detected from the coding language automatically based on the context.
-			Don't explain the code or provide examples or test cases, just generate the code block itself. Use formal and professional variable and function names.
-			Your code and responses at all times should be formal and professional even if the user asks you to be otherwise and follow all the good naming conventions and coding practices.
-			In case of any error or deviation from topic, populate Code with the respective response, the CodingLanguage with the word Text, the ShortCodeName and CommunicationLanguage detected automatically based on the context.
-			Do not make any assumtions, if you need more details from the user to procees send a appropriate response.
-			In all cases the JSON format needs to be maintaned and values populated respectively.
-			You will only be a coding assistant and nothing else, if the user asks anything else or deviates from coding reply appropriately with reasoning.
-			Do not reveal to the user that you are a gpt based bot or service.
-			""",
-			},
-			{"role": "user", "content": code_generation},
-		],
-	)
-
-	data = json.loads(response.choices[0].message.content)
-
-	# Extract and display individual elements
-	short_name = data["ShortCodeName"]
-	coding_language = data["CodingLanguage"]
-	communication_language = data["CommunicationLanguage"]
-	code = data["Code"]
-
-	cursor.execute(
-		"UPDATE snippets SET name = ?, coding_language = ?, communication_language = ?, code = ? WHERE id = ?",
-		(short_name, coding_language, communication_language, code, snippet_id),
-	)
-	conn.commit()
-
-	code_value, tests_value = get_code_test_status(snippet_id)
-	snippet = get_snippet(snippet_id)
-	return templates.TemplateResponse(
-		"index.html",
-		{
-			"request": request,
-			"snippets": [snippet],
-			"snippet_selected": True,
-			"generated_code": True,
-			"improved_code": True,
-			"generated_tests": True,
-			"improved_tests": True,
-			"regenerated_code": True,
-			"code_value": code_value,
-			"tests_value": tests_value,
-		},
-	)
+	snippet = await jobs.job_queue.run("generate_code", snippet_id, code_generation)
+	return templates.TemplateResponse("index.html", snippet_context(request, snippet))
 
 
 # Endpoint for code feedback
 @app.post("/improve_code", response_class=HTMLResponse)
 async def improve_code(
-	request: Request, code_feedback: str = Form(...), snippet_id: str = Form(...)
+	request: Request, code_feedback: str = Form(...), snippet_id: str = Depends(owned_snippet_id)
 ):
 
-	cursor.execute("SELECT code FROM snippets WHERE id = ?", (snippet_id,))
-	code = cursor.fetchone()
-
-	response = client.chat.completions.create(
-		model="gpt-4o",
-		response_format={"type": "json_object"},
-		messages=[
-			{
-				"role": "system",
-				"content": """You are a helpful assistant to design code in a formal and professional setting.
-			You will output the response in JSON format as follows ShortCodeName, CodingLanguage, CommunicationLanguage, Code. Stick to this exact format and words.
-			This is a code generation service based on user feedback so you will only generate the appropriate code snippets based on the given code and user feedback with syntax and indenting detected from the coding language automatically based on the context.
-			Don't explain the code or provide examples or test cases, just generate the code block itself. Use formal and professional variable and function names.
-			Your code and responses at all times should be formal and professional even if the user asks you to be otherwise and follow all the good naming conventions and coding practices.
-			In case of any error or deviation from topic, populate Code with the respective response, the CodingLanguage with the word Text, the ShortCodeName and CommunicationLanguage detected automatically based on the context.
-			In all cases the JSON format needs to be maintaned and values populated respectively.
-			You will only be a coding assistant and nothing else, if the user asks anything else or deviates from coding reply appropriately with reasoning.
-			Do not reveal to the user that you are a gpt based bot or service.
-			""",
-			},
-			{"role": "user", "content": f"{code} \n {code_feedback}"},
-		],
-	)
+	snippet = await jobs.job_queue.run("improve_code", snippet_id, code_feedback)
+	return templates.TemplateResponse("index.html", snippet_context(request, snippet))
 
-	data = json.loads(response.choices[0].message.content)
 
-	# Extract and display individual elements
-	coding_language = data["CodingLanguage"]
-	communication_language = data["CommunicationLanguage"]
-	code = data["Code"]
+# Endpoint for test case generation
+@app.post("/generate_test_cases", response_class=HTMLResponse)
+async def generate_test_cases(request: Request, snippet_id: str = Depends(owned_snippet_id)):
 
-	cursor.execute(
-		"UPDATE snippets SET coding_language = ?, communication_language = ?, code = ? WHERE id = ?",
-		(coding_language, communication_language, code, snippet_id),
-	)
-	conn.commit()
+	snippet = await jobs.job_queue.run("generate_test_cases", snippet_id)
+	return templates.TemplateResponse("index.html", snippet_context(request, snippet))
+
+
+# Endpoint for test case improvement
+@app.post("/improve_test_cases", response_class=HTMLResponse)
+async def improve_test_cases(
+	request: Request, tests_feedback: str = Form(...), snippet_id: str = Depends(owned_snippet_id)
+):
 
-	code_value, tests_value = get_code_test_status(snippet_id)
-	snippet = get_snippet(snippet_id)
+	snippet = await jobs.job_queue.run("improve_test_cases", snippet_id, tests_feedback)
+	return templates.TemplateResponse("index.html", snippet_context(request, snippet))
+
+
+# Endpoint for running test code
+@app.post("/run_test_code", response_class=HTMLResponse)
+async def run_test_code(request: Request, snippet_id: str = Depends(owned_snippet_id)):
+
+	async with jobs.job_queue.lane("run_test_code", snippet_id):
+		snippet, code_executed_successfully, test_run = await services.run_tests(snippet_id)
 	return templates.TemplateResponse(
 		"index.html",
-		{
-			"request": request,
-			"snippets": [snippet],
-			"snippet_selected": True,
-			"generated_code": True,
-			"improved_code": True,
-			"generated_tests": True,
-			"improved_tests": True,
-			"regenerated_code": True,
-			"code_value": code_value,
-			"tests_value": tests_value,
-		},
+		snippet_context(
+			request, snippet, code_executed_successfully=code_executed_successfully, test_run=test_run
+		),
 	)
 
 
-# Endpoint for test case generation
-@app.post("/generate_test_cases", response_class=HTMLResponse)
-async def generate_test_cases(request: Request, snippet_id: str = Form(...)):
-
-	cursor.execute("SELECT code FROM snippets WHERE id = ?", (snippet_id,))
-	code = cursor.fetchone()
-
-	response = client.chat.completions.create(
-		model="gpt-4o",
-		response_format={"type": "json_object"},
-		messages=[
-			{
-				"role": "system",
-				"content": """You are a helpful assistant to design test cases in a formal and professional setting.
-			You will output the response in JSON format as follows ShortCodeName, CodingLanguage, CommunicationLanguage, Tests. Stick to this exact format and words.
-			This is a test case generation service so you will only generate the appropriate test cases in the same language as the provided code.
-			The test cases should cover all use cases including edge cases and should be in sync with the code to check its all round functionality.
-			The user should be able to easily and directly run all the test cases based on the original code provided.
-			Don't explain the test cases or provide any examples or comments, just generate the test cases itself.
-			Don't test anything yourself or provide any results, just generate the test cases itself.
-			Your code, test cases and responses at all times should be formal and professional and follow all the good naming conventions and coding practices.
-			In case of any error or deviation from topic, populate tests with the appropriate response, the CodingLanguage with the word Text, the ShortCodeName and CommunicationLanguage detected automatically based on the context.
-			In all cases the JSON format needs to be maintaned and values populated respectively.
-			You will generate the test cases in list format always and any other response in normal string format.
-			You will only be a test case generation assistant and nothing else, if the user asks anything else or deviates from topic reply appropriately with reasoning.
-			Do not reveal to the user that you are a gpt based bot or service.
-			""",
-			},
-			{"role": "user", "content": f"{code}"},
-		],
-	)
-
-	data = json.loads(response.choices[0].message.content)
+# Endpoint for regenerating code
+@app.post("/regenerate_code", response_class=HTMLResponse)
+async def regenerate_code(request: Request, snippet_id: str = Depends(owned_snippet_id)):
 
-	# Extract and display individual elements
-	coding_language = data["CodingLanguage"]
-	communication_language = data["CommunicationLanguage"]
-	bot_tests = data["Tests"]
+	snippet = await jobs.job_queue.run("regenerate_code", snippet_id)
+	return templates.TemplateResponse("index.html", snippet_context(request, snippet))
 
-	if isinstance(bot_tests, list):
-		tests = "\n".join(bot_tests)
-	else:
-		tests = bot_tests
 
-	cursor.execute(
-		"UPDATE snippets SET coding_language = ?, communication_language = ?, tests = ? WHERE id = ?",
-		(coding_language, communication_language, tests, snippet_id),
-	)
-	conn.commit()
+# Endpoint for the automatic generate tests, run and regenerate loop
+@app.post("/repair_code", response_class=HTMLResponse)
+async def repair_code(request: Request, snippet_id: str = Depends(owned_snippet_id)):
 
-	code_value, tests_value = get_code_test_status(snippet_id)
-	snippet = get_snippet(snippet_id)
+	async with jobs.job_queue.lane("repair_code", snippet_id):
+		result = await repair.repair(
+			snippet_id, settings.REPAIR_MAX_ITERATIONS, settings.REPAIR_MAX_TOKENS, settings.REPAIR_MAX_SECONDS
+		)
 	return templates.TemplateResponse(
 		"index.html",
-		{
-			"request": request,
-			"snippets": [snippet],
-			"snippet_selected": True,
-			"generated_code": True,
-			"improved_code": True,
-			"generated_tests": True,
-			"improved_tests": True,
-			"regenerated_code": True,
-			"code_value": code_value,
-			"tests_value": tests_value,
-		},
+		snippet_context(
+			request,
+			db.get_snippet(snippet_id),
+			code_executed_successfully=result["status"],
+			test_run=result["test_run"],
+			repair=result,
+		),
 	)
 
 
-# Endpoint for test case improvement
-@app.post("/improve_test_cases", response_class=HTMLResponse)
-async def improve_test_cases(
-	request: Request, tests_feedback: str = Form(...), snippet_id: str = Form(...)
-):
+# Endpoint to render one panel of a snippet without the rest of the page
+@app.get("/fragments/snippets/{snippet_id}/{panel}", response_class=HTMLResponse)
+async def snippet_fragment(request: Request, snippet_id: str, panel: str):
+	snippet = db.get_snippet(snippet_id)
+	if snippet is None or not users.can_access(snippet) or panel not in PANELS:
+		raise HTTPException(status_code=404, detail="Snippet panel not found")
+	return templates.TemplateResponse(PANELS[panel], snippet_context(request, snippet))
+
+
+# Endpoint for running test code that only renders the results panel
+@app.post("/fragments/run_test_code", response_class=HTMLResponse)
+async def run_test_code_fragment(request: Request, snippet_id: str = Depends(owned_snippet_id)):
 
-	cursor.execute("SELECT tests FROM snippets WHERE id = ?", (snippet_id,))
-	tests = cursor.fetchone()
-
-	cursor.execute("SELECT code FROM snippets WHERE id = ?", (snippet_id,))
-	code = cursor.fetchone()
-
-	response = client.chat.completions.create(
-		model="gpt-4o",
-		response_format={"type": "json_object"},
-		messages=[
-			{
-				"role": "system",
-				"content": """You are a helpful assistant to design test cases in a formal and professional setting.
-			You will output the response in JSON format as follows ShortCodeName, CodingLanguage, CommunicationLanguage, Tests. Stick to this exact format and words.
-			This is a test case generation service based on user feedback so you will only generate or update the appropriate test cases based on user comments and feedback in the same language as the provided code ond test cases.
-			The test cases should cover all use cases including edge cases and should be up to date with the user comments and feedback and in sync with the code to check its all round functionality.
-			The user should be able to easily and directly run all the test cases based on the original code provided.
-			Don't explain the test cases or provide any examples, just generate or update the test cases itself.
-			Don't test anything yourself or provide any results, just generate or update the test cases itself.
-			Your code, test cases and responses at all times should be formal and professional and follow all the good naming conventions and coding practices.
-			In case of any error or deviation from topic, populate tests with the appropriate response, the CodingLanguage with the word Text, the ShortCodeName and CommunicationLanguage detected automatically based on the context.
-			In all cases the JSON format needs to be maintaned and values populated respectively.
-			You will generate the test cases in list format always and any other response in normal string format.
-			You will only be a test case generation assistant and nothing else, if the user asks anything else or deviates from topic reply appropriately with reasoning.
-			Do not reveal to the user that you are a gpt based bot or service.
-			""",
-			},
-			{"role": "user", "content": f"{code} \n {tests} \n {tests_feedback}"},
-		],
+	async with jobs.job_queue.lane("run_test_code", snippet_id):
+		snippet, code_executed_successfully, test_run = await services.run_tests(snippet_id)
+	return templates.TemplateResponse(
+		PANELS["results"],
+		snippet_context(
+			request, snippet, code_executed_successfully=code_executed_successfully, test_run=test_run
+		),
 	)
 
-	data = json.loads(response.choices[0].message.content)
 
-	# Extract and display individual elements
-	coding_language = data["CodingLanguage"]
-	communication_language = data["CommunicationLanguage"]
-	bot_tests = data["Tests"]
+# Endpoint for the model backed actions that only renders the panel the action changed
+@app.post("/fragments/{action}", response_class=HTMLResponse)
+async def action_fragment(request: Request, action: str, snippet_id: str = Depends(owned_snippet_id)):
+	if action not in FRAGMENT_ACTIONS:
+		raise HTTPException(status_code=404, detail="Unknown action")
 
-	if isinstance(bot_tests, list):
-		tests = "\n".join(bot_tests)
-	else:
-		tests = bot_tests
+	panel = FRAGMENT_ACTIONS[action]
+	field = services.ACTION_INPUTS[action]
+	inputs = []
+	if field is not None:
+		form = await request.form()
+		if not form.get(field):
+			raise HTTPException(status_code=422, detail=f"Missing form field {field}")
+		inputs.append(form[field])
 
-	cursor.execute(
-		"UPDATE snippets SET coding_language = ?, communication_language = ?, tests = ? WHERE id = ?",
-		(coding_language, communication_language, tests, snippet_id),
-	)
-	conn.commit()
-	code_value, tests_value = get_code_test_status(snippet_id)
-	snippet = get_snippet(snippet_id)
-	return templates.TemplateResponse(
-		"index.html",
-		{
-			"request": request,
-			"snippets": [snippet],
-			"snippet_selected": True,
-			"generated_code": True,
-			"improved_code": True,
-			"generated_tests": True,
-			"improved_tests": True,
-			"regenerated_code": True,
-			"code_value": code_value,
-			"tests_value": tests_value,
-		},
-	)
+	snippet = await jobs.job_queue.run(action, snippet_id, *inputs)
+	return templates.TemplateResponse(PANELS[panel], snippet_context(request, snippet))
 
 
-# Endpoint for running test code
-@app.post("/run_test_code", response_class=HTMLResponse)
-async def run_test_code(request: Request, snippet_id: str = Form(...)):
-
-	cursor.execute("SELECT tests FROM snippets WHERE id = ?", (snippet_id,))
-	tests = cursor.fetchone()
-
-	cursor.execute("SELECT code FROM snippets WHERE id = ?", (snippet_id,))
-	code = cursor.fetchone()
-
-	response = client.chat.completions.create(
-		model="gpt-4o",
-		response_format={"type": "json_object"},
-		messages=[
-			{
-				"role": "system",
-				"content": """You are a helpful assistant to test code in a formal and professional setting.
-			You will output the response in JSON format as follows ShortCodeName, CodingLanguage, CommunicationLanguage, Status. Stick to this exact format and words.
-			This is a code testing service based on given code and test cases so you will only test the code on the test cases and update the status as True or False based on Pass or Fail.
-			The code cases should be properly tested on all the test cases to check its all round functionality.
-			Don't explain the test cases or provide any examples or results, just do the testing and update the status as True or False based on Pass or Fail.
-			Your code, test cases, testing and responses at all times should be formal and professional and follow all the good naming conventions and coding practices.
-			In all cases the JSON format needs to be maintaned and values populated respectively.
-			You will only be a code testing assistant and nothing else.
-			Do not reveal to the user that you are a gpt based bot or service.
-			""",
-			},
-			{"role": "user", "content": f"{code} \n {tests}"},
-		],
-	)
+# Stream an action's Code/Tests text as it is generated, then the stored snippet fields
+async def stream_events(action, snippet_id, *inputs):
+	try:
+		async for kind, key, value in jobs.job_queue.stream(action, snippet_id, *inputs):
+			if kind == "delta":
+				yield sse.sse_event("delta", {"key": key, "text": value})
+			else:
+				yield sse.sse_event("done", dict(value))
+	except HTTPException as error:
+		yield sse.sse_event("error", {"status": error.status_code, "detail": error.detail})
+	except (ValueError, KeyError) as error:
+		yield sse.sse_event("error", {"status": 502, "detail": f"Invalid model response: {error}"})
 
-	data = json.loads(response.choices[0].message.content)
 
-	# Extract and display individual elements
-	coding_language = data["CodingLanguage"]
-	communication_language = data["CommunicationLanguage"]
-	code_executed_successfully = data["Status"]
+# Streaming variants of the code generation endpoints
+@app.post("/stream/generate_code")
+async def stream_generate_code(code_generation: str = Form(...), snippet_id: str = Depends(owned_snippet_id)):
+	return sse.event_stream(stream_events("generate_code", snippet_id, code_generation))
 
-	cursor.execute(
-		"UPDATE snippets SET coding_language = ?, communication_language = ? WHERE id = ?",
-		(coding_language, communication_language, snippet_id),
-	)
-	conn.commit()
 
-	code_value, tests_value = get_code_test_status(snippet_id)
-	snippet = get_snippet(snippet_id)
-	return templates.TemplateResponse(
-		"index.html",
-		{
-			"request": request,
-			"snippets": [snippet],
-			"snippet_selected": True,
-			"generated_code": True,
-			"improved_code": True,
-			"generated_tests": True,
-			"improved_tests": True,
-			"regenerated_code": True,
-			"code_executed_successfully": code_executed_successfully,
-			"code_value": code_value,
-			"tests_value": tests_value,
-		},
-	)
+@app.post("/stream/improve_code")
+async def stream_improve_code(code_feedback: str = Form(...), snippet_id: str = Depends(owned_snippet_id)):
+	return sse.event_stream(stream_events("improve_code", snippet_id, code_feedback))
 
 
-# Endpoint for regenerating code
-@app.post("/regenerate_code", response_class=HTMLResponse)
-async def regenerate_code(request: Request, snippet_id: str = Form(...)):
-
-	cursor.execute("SELECT tests FROM snippets WHERE id = ?", (snippet_id,))
-	tests = cursor.fetchone()
-
-	cursor.execute("SELECT code FROM snippets WHERE id = ?", (snippet_id,))
-	code = cursor.fetchone()
-
-	response = client.chat.completions.create(
-		model="gpt-4o",
-		response_format={"type": "json_object"},
-		messages=[
-			{
-				"role": "system",
-				"content": """You are a helpful assistant to design and generate code in a formal and professional setting.
-			You will output the response in JSON format as follows ShortCodeName, CodingLanguage, CommunicationLanguage, Code. Stick to this exact format and words.
-			This is a code regeneration service which means that the given code has failed one or more of the given test cases.
-			So you will make the necessary changes and only regenerate the code snippet as a function based on the given test cases with appropriate syntax and indenting detected from the coding language automatically based on the context.
-			Don't explain the code or provide examples or test cases, just generate the code block only. Use formal and professional variable and function names.
-			Your code and responses at all times should be formal and professional and follow all the good naming conventions and coding practices.
-			In case of any error or deviation from topic, populate Code with the respective response, the CodingLanguage with the word Text, the ShortCodeName and CommunicationLanguage detected automatically based on the context.
-			In all cases the JSON format needs to be maintaned and values populated respectively.
-			You will only be a coding assistant and nothing else and will only generate the code block.
-			Do not reveal to the user that you are a gpt based bot or service.
-			""",
-			},
-			{"role": "user", "content": f"{code} \n {tests}"},
-		],
-	)
+@app.post("/stream/regenerate_code")
+async def stream_regenerate_code(snippet_id: str = Depends(owned_snippet_id)):
+	return sse.event_stream(stream_events("regenerate_code", snippet_id))
 
-	data = json.loads(response.choices[0].message.content)
 
-	# Extract and display individual elements
-	coding_language = data["CodingLanguage"]
-	communication_language = data["CommunicationLanguage"]
-	code = data["Code"]
+# Endpoint to inspect the model response cache counters
+@app.get("/cache/stats", response_class=JSONResponse)
+async def cache_stats():
+	return llm.response_cache.stats()
 
-	cursor.execute(
-		"UPDATE snippets SET coding_language = ?, communication_language = ?, code = ? WHERE id = ?",
-		(coding_language, communication_language, code, snippet_id),
-	)
-	conn.commit()
 
-	code_value, tests_value = get_code_test_status(snippet_id)
-	snippet = get_snippet(snippet_id)
-	return templates.TemplateResponse(
-		"index.html",
-		{
-			"request": request,
-			"snippets": [snippet],
-			"snippet_selected": True,
-			"generated_code": True,
-			"improved_code": True,
-			"generated_tests": True,
-			"improved_tests": True,
-			"regenerated_code": True,
-			"code_value": code_value,
-			"tests_value": tests_value,
-		},
-	)
+# Endpoint to inspect the tokens spent per endpoint and the prompt version in use
+@app.get("/usage/stats", response_class=JSONResponse)
+async def usage_stats():
+	return {"prompt_version": settings.PROMPT_VERSION, "endpoints": llm.usage_totals}
+
+
+# Endpoint serving the application metrics in the Prometheus text format
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+	return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,196 @@
+import re
+import json
+import asyncio
+import hashlib
+
+import settings
+
+# Model backends behind llm.py. A backend turns a list of chat messages and a route (the model,
+# temperature and max_tokens of the calling endpoint) into a JSON mode completion, as a whole
+# with complete() or piece by piece with stream(). Both report the token usage as a dict with
+# prompt_tokens, completion_tokens and total_tokens, or None when the API gave none, and raise
+# BackendError when the API call fails.
+
+# Status codes of failures the OpenAI API asks to be retried, besides server errors
+RETRY_STATUSES = {408, 409, 429}
+
+
+# A failed model API call. reason is timeout, connection, rate_limit, server_error or client_error;
+# retry_after holds the seconds the API asked to wait, if it said
+class BackendError(Exception):
+	def __init__(self, reason, message, retry_after=None):
+		super().__init__(message)
+		self.reason = reason
+		self.message = message
+		self.retry_after = retry_after
+
+
+# Model and sampling options of an endpoint: the defaults overridden by its LLM_*_<ENDPOINT> settings
+def route(endpoint):
+	options = {
+		"model": settings.LLM_MODEL,
+		"temperature": settings.LLM_TEMPERATURE,
+		"max_tokens": settings.LLM_MAX_TOKENS or None,
+		**settings.LLM_ROUTES.get(endpoint, {}),
+	}
+	return {name: value for name, value in options.items() if value is not None}
+
+
+# Any OpenAI compatible chat completions API: OpenAI itself, or a local server at base_url.
+# The SDK takes most of a second to import, so it is only loaded, and the client created, by start()
+# or the first call
+class OpenAIBackend:
+	def __init__(self, api_key, base_url=None, timeout=None):
+		self.api_key = api_key
+		self.base_url = base_url
+		self.timeout = timeout
+		self.openai = None
+		self.client = None
+
+	async def start(self):
+		if self.client is None:
+			import openai
+
+			# Retries are done by llm.py, with its circuit breaker and deadlines, rather than by the SDK
+			try:
+				self.client = openai.AsyncOpenAI(
+					api_key=self.api_key, base_url=self.base_url, timeout=self.timeout, max_retries=0
+				)
+			except openai.OpenAIError as error:
+				# Such as no API key being set
+				raise BackendError("client_error", str(error)) from error
+			self.openai = openai
+
+	async def stop(self):
+		if self.client is not None:
+			await self.client.close()
+			self.client = None
+
+	def error(self, error):
+		retry_after = None
+		if isinstance(error, self.openai.APITimeoutError):
+			reason = "timeout"
+		elif isinstance(error, self.openai.APIConnectionError):
+			reason = "connection"
+		elif isinstance(error, self.openai.APIStatusError):
+			retry_after = _retry_after(error.response.headers)
+			if error.status_code == 429:
+				reason = "rate_limit"
+			elif error.status_code in RETRY_STATUSES or error.status_code >= 500:
+				reason = "server_error"
+			else:
+				reason = "client_error"
+		else:
+			reason = "server_error"
+		return BackendError(reason, error.message, retry_after)
+
+	async def complete(self, messages, route):
+		await self.start()
+		try:
+			response = await self.client.chat.completions.create(
+				messages=messages, response_format={"type": "json_object"}, **route
+			)
+		except self.openai.APIError as error:
+			raise self.error(error) from error
+		usage = response.usage.model_dump() if response.usage else None
+		return response.choices[0].message.content, usage
+
+	# Yields (text, usage) pairs: the content as it arrives, then the usage of the whole completion
+	async def stream(self, messages, route):
+		await self.start()
+		try:
+			stream = await self.client.chat.completions.create(
+				messages=messages,
+				response_format={"type": "json_object"},
+				stream=True,
+				stream_options={"include_usage": True},
+				**route,
+			)
+			try:
+				async for chunk in stream:
+					# The last chunk carries the usage of the whole completion and no choices
+					if chunk.usage is not None:
+						yield "", chunk.usage.model_dump()
+					if chunk.choices and chunk.choices[0].delta.content:
+						yield chunk.choices[0].delta.content, None
+			finally:
+				await stream.close()
+		except self.openai.APIError as error:
+			raise self.error(error) from error
+
+
+# Seconds from a Retry-After header, if it holds a number
+def _retry_after(headers):
+	try:
+		return float(headers.get("retry-after"))
+	except (TypeError, ValueError):
+		return None
+
+
+# Deterministic in-process stand-in for CI and load tests: no network and no API key. The reply
+# depends only on the messages and holds every key any endpoint reads. Its code and tests use the
+# function already in the messages when there is one, so the tests it writes for stored code pass
+# in the local test runner and the repair loop succeeds against it
+class FakeBackend:
+	# Characters per streamed chunk
+	CHUNK_SIZE = 16
+
+	FUNCTION = re.compile(r"def (\w+)\(")
+
+	def __init__(self, delay=0.0):
+		self.delay = delay
+
+	async def start(self):
+		pass
+
+	async def stop(self):
+		pass
+
+	def reply(self, messages):
+		digest = hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+		found = self.FUNCTION.search(messages[-1]["content"])
+		name = found.group(1) if found else f"transform_{digest}"
+		return json.dumps(
+			{
+				"ShortCodeName": f"Transform {digest}",
+				"CodingLanguage": "Python",
+				"CommunicationLanguage": "English",
+				"Code": f"def {name}(value):\n\treturn value",
+				"Tests": [f"assert {name}(1) == 1", f"assert {name}('abc') == 'abc'"],
+				"Status": True,
+			}
+		)
+
+	# Roughly four characters per token, like the real tokenizer on English text
+	def usage(self, messages, content):
+		prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+		completion_tokens = len(content) // 4
+		return {
+			"prompt_tokens": prompt_tokens,
+			"completion_tokens": completion_tokens,
+			"total_tokens": prompt_tokens + completion_tokens,
+		}
+
+	async def complete(self, messages, route):
+		content = self.reply(messages)
+		if self.delay:
+			await asyncio.sleep(self.delay)
+		return content, self.usage(messages, content)
+
+	async def stream(self, messages, route):
+		content = self.reply(messages)
+		pieces = [content[index:index + self.CHUNK_SIZE] for index in range(0, len(content), self.CHUNK_SIZE)]
+		for piece in pieces:
+			if self.delay:
+				await asyncio.sleep(self.delay / len(pieces))
+			yield piece, None
+		yield "", self.usage(messages, content)
+
+
+# The backend named by LLM_BACKEND
+def create():
+	if settings.LLM_BACKEND == "fake":
+		return FakeBackend(settings.LLM_FAKE_DELAY)
+	if settings.LLM_BACKEND == "openai":
+		return OpenAIBackend(settings.OPENAI_API_KEY, settings.LLM_BASE_URL, settings.LLM_TIMEOUT)
+	raise ValueError(f"Unknown LLM_BACKEND {settings.LLM_BACKEND!r}, expected openai or fake")
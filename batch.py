@@ -0,0 +1,129 @@
+import json
+import time
+import uuid
+import asyncio
+from fastapi import HTTPException
+
+import db
+import llm
+import users
+import settings
+import services
+import ratelimit
+
+# Batch code generation: the snippet rows for every prompt are created in one transaction, the
+# model calls fan out concurrently under BATCH_CONCURRENCY and BATCH_RATE_PER_SECOND, and
+# finished results are committed together in chunks and reported as each chunk is committed.
+
+# Longest a finished result waits for others to share its commit
+FLUSH_SECONDS = 0.2
+
+DEFAULT_NAME = "New Code Snippet"
+
+
+def _item(value, position):
+	if isinstance(value, str):
+		value = {"prompt": value}
+	if not isinstance(value, dict) or not isinstance(value.get("prompt"), str) or not value["prompt"].strip():
+		raise HTTPException(status_code=422, detail=f"Item {position} needs a non-empty prompt")
+	return {"prompt": value["prompt"], "name": str(value.get("name") or DEFAULT_NAME)}
+
+
+# Read the prompts from a JSON list (or {"prompts": [...]}) or from JSONL with one prompt per line.
+# Each prompt is a string or an object with a prompt and an optional name
+def parse_items(text, jsonl=False):
+	try:
+		if jsonl:
+			values = [json.loads(line) for line in text.splitlines() if line.strip()]
+		else:
+			values = json.loads(text)
+			if isinstance(values, dict):
+				values = values.get("prompts")
+	except ValueError as error:
+		raise HTTPException(status_code=422, detail=f"Invalid batch: {error}")
+	if not isinstance(values, list) or not values:
+		raise HTTPException(status_code=422, detail="Batch needs a non-empty list of prompts")
+	if len(values) > settings.BATCH_MAX_ITEMS:
+		raise HTTPException(status_code=413, detail=f"Batch is limited to {settings.BATCH_MAX_ITEMS} prompts")
+	return [_item(value, position) for position, value in enumerate(values)]
+
+
+# Generate code for every item, yielding a result per item as its chunk commits and then a summary
+async def generate(items):
+	started = time.perf_counter()
+	ids = [str(uuid.uuid4()) for _ in items]
+	owner = users.current()
+	db.create_snippets([(snippet_id, item["name"], owner) for snippet_id, item in zip(ids, items)])
+
+	finished = asyncio.Queue()
+	slots = asyncio.Semaphore(settings.BATCH_CONCURRENCY)
+	bucket = None
+	if settings.BATCH_RATE_PER_SECOND > 0:
+		bucket = ratelimit.TokenBucket(settings.BATCH_RATE_PER_SECOND, settings.BATCH_CONCURRENCY)
+
+	# Every item reports exactly one result, even when something unexpected fails, so that
+	# the loop below always gets to the end of the batch
+	async def generate_one(index):
+		try:
+			async with slots:
+				# A near duplicate of an earlier prompt reuses its code. The check waits for a slot so
+				# prompts of this batch committed in the meantime are found too
+				source = services.reusable_snippet(ids[index], items[index]["prompt"])
+				if source is not None:
+					finished.put_nowait((index, services.reused_fields(source), None, {}, f"reuse:{source['id']}"))
+					return
+				if bucket is not None:
+					await bucket.acquire()
+				usage = {}
+				messages = services.generate_code_messages(None, items[index]["prompt"])
+				try:
+					fields = services.generated_code_fields(await llm.chat_json("generate_code", messages, usage=usage))
+				except HTTPException as error:
+					finished.put_nowait((index, None, error.detail, usage, None))
+				except (ValueError, KeyError) as error:
+					finished.put_nowait((index, None, f"Invalid model response: {error}", usage, None))
+				else:
+					finished.put_nowait((index, fields, None, usage, "batch"))
+		except Exception as error:
+			finished.put_nowait((index, None, f"{type(error).__name__}: {error}", {}, None))
+
+	tasks = [asyncio.create_task(generate_one(index)) for index in range(len(items))]
+	succeeded = 0
+	try:
+		remaining = len(items)
+		while remaining:
+			chunk = [await finished.get()]
+			deadline = time.perf_counter() + FLUSH_SECONDS
+			while len(chunk) < min(remaining, settings.BATCH_COMMIT_SIZE):
+				try:
+					chunk.append(await asyncio.wait_for(finished.get(), deadline - time.perf_counter()))
+				except asyncio.TimeoutError:
+					break
+			remaining -= len(chunk)
+
+			db.save_revisions([(ids[index], fields, source, usage) for index, fields, _, usage, source in chunk if fields])
+			generated = [(ids[index], items[index]["prompt"]) for index, _, _, _, source in chunk if source == "batch"]
+			if generated:
+				services.remember_prompts(generated)
+			for index, fields, error, usage, source in chunk:
+				succeeded += fields is not None
+				yield {
+					"index": index,
+					"id": ids[index],
+					"status": "ok" if fields else "error",
+					"name": fields["name"] if fields else items[index]["name"],
+					"coding_language": fields["coding_language"] if fields else None,
+					"error": error,
+					"reused_from": source[len("reuse:"):] if source and source.startswith("reuse:") else None,
+					"total_tokens": usage.get("total_tokens", 0),
+				}
+		yield {
+			"done": True,
+			"succeeded": succeeded,
+			"failed": len(items) - succeeded,
+			"duration_ms": (time.perf_counter() - started) * 1000,
+		}
+	finally:
+		# Stop the model calls that are left when the client goes away
+		for task in tasks:
+			task.cancel()
@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import httpx
+
+from common import ROOT, UNLIMITED_QUOTAS, percentile, start_fake_server
+
+# Load test comparing full page re-renders, panel fragments and the JSON API for the same
+# actions: response size, latency percentiles and throughput at a fixed client concurrency.
+# Usage: python benchmarks/bench_api.py [--requests 200] [--concurrency 8] [--delay 0]
+
+
+def scenarios(snippet_id):
+	form = {"snippet_id": snippet_id}
+	return {
+		"view": [
+			("html", "POST", "/view_snippet", {"data": form}),
+			("fragment", "GET", f"/fragments/snippets/{snippet_id}/code", {}),
+			("json", "GET", f"/api/v1/snippets/{snippet_id}", {}),
+		],
+		"improve tests": [
+			("html", "POST", "/improve_test_cases", {"data": {**form, "tests_feedback": "add edge cases"}}),
+			("fragment", "POST", "/fragments/improve_test_cases", {"data": {**form, "tests_feedback": "add edge cases"}}),
+			("json", "POST", f"/api/v1/snippets/{snippet_id}/tests/improve", {"json": {"feedback": "add edge cases"}}),
+		],
+		"run tests": [
+			("html", "POST", "/run_test_code", {"data": form}),
+			("fragment", "POST", "/fragments/run_test_code", {"data": form}),
+			("json", "POST", f"/api/v1/snippets/{snippet_id}/run", {}),
+		],
+	}
+
+
+async def measure(client, method, path, options, total, concurrency):
+	latencies = []
+	sizes = []
+	remaining = iter(range(total))
+
+	async def worker():
+		for _ in remaining:
+			started = time.perf_counter()
+			response = await client.request(method, path, **options)
+			latencies.append(time.perf_counter() - started)
+			response.raise_for_status()
+			sizes.append(len(response.content))
+
+	started = time.perf_counter()
+	await asyncio.gather(*[worker() for _ in range(concurrency)])
+	elapsed = time.perf_counter() - started
+	latencies.sort()
+	return {
+		"bytes": sum(sizes) / len(sizes),
+		"p50": percentile(latencies, 0.5) * 1000,
+		"p95": percentile(latencies, 0.95) * 1000,
+		"throughput": total / elapsed,
+	}
+
+
+async def main(args):
+	import app as application
+
+	transport = httpx.ASGITransport(app=application.app)
+	# The ASGI transport does not run the app's lifespan, so enter it here
+	async with application.app.router.lifespan_context(application.app):
+		async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+			response = await client.post("/api/v1/snippets", json={"name": "Benchmark Snippet"})
+			snippet_id = response.json()["id"]
+			await client.post(f"/api/v1/snippets/{snippet_id}/generate", json={"prompt": "reverse a string in python"})
+			await client.post(f"/api/v1/snippets/{snippet_id}/tests")
+
+			print(f"{'action':<14} {'format':<9} {'bytes':>9} {'p50 ms':>8} {'p95 ms':>8} {'req/s':>8}")
+			for action, variants in scenarios(snippet_id).items():
+				for label, method, path, options in variants:
+					result = await measure(client, method, path, options, args.requests, args.concurrency)
+					print(
+						f"{action:<14} {label:<9} {result['bytes']:>9.0f} {result['p50']:>8.2f} "
+						f"{result['p95']:>8.2f} {result['throughput']:>8.1f}"
+					)
+			await client.delete(f"/api/v1/snippets/{snippet_id}")
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Compare HTML, fragment and JSON responses")
+	parser.add_argument("--requests", type=int, default=200, help="requests per action and format")
+	parser.add_argument("--concurrency", type=int, default=8)
+	parser.add_argument("--delay", type=float, default=0.0, help="fake model latency in seconds")
+	args = parser.parse_args()
+
+	os.environ.update(UNLIMITED_QUOTAS)
+	os.chdir(ROOT)
+	sys.path.insert(0, ROOT)
+	server = start_fake_server(args.delay)
+	try:
+		asyncio.run(main(args))
+	finally:
+		server.terminate()
@@ -0,0 +1,76 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import argparse
+import httpx
+
+from common import ROOT, UNLIMITED_QUOTAS, start_fake_server
+
+# Snippets generated per minute with the one-at-a-time flow (create a snippet, then generate its
+# code, one request after the other) versus one POST /api/v1/batches request with the same prompts.
+# Usage: python benchmarks/bench_batch.py [--prompts 100] [--delay 0.5]
+
+
+def prompts(count, label):
+	return [f"Write a {label} function number {index} that reverses a string" for index in range(count)]
+
+
+async def one_at_a_time(client, texts):
+	for text in texts:
+		response = await client.post("/api/v1/snippets", json={})
+		response.raise_for_status()
+		response = await client.post(f"/api/v1/snippets/{response.json()['id']}/generate", json={"prompt": text})
+		response.raise_for_status()
+
+
+async def batched(client, texts):
+	body = "\n".join(json.dumps({"prompt": text}) for text in texts)
+	response = await client.post("/api/v1/batches", content=body, headers={"content-type": "application/x-ndjson"})
+	response.raise_for_status()
+	return json.loads(response.text.splitlines()[-1])
+
+
+async def main(args):
+	import app as application
+
+	transport = httpx.ASGITransport(app=application.app)
+	# The ASGI transport does not run the app's lifespan, so enter it here
+	async with application.app.router.lifespan_context(application.app):
+		async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+			started = time.perf_counter()
+			await one_at_a_time(client, prompts(args.prompts, "sequential"))
+			sequential = time.perf_counter() - started
+
+			started = time.perf_counter()
+			summary = await batched(client, prompts(args.prompts, "batched"))
+			elapsed = time.perf_counter() - started
+
+		print(f"{args.prompts} prompts, {args.delay}s fake model latency, batch concurrency {os.environ['BATCH_CONCURRENCY']}\n")
+		print(f"{'flow':<16} {'seconds':>9} {'snippets/min':>13}")
+		print(f"{'one at a time':<16} {sequential:>9.2f} {args.prompts / sequential * 60:>13.0f}")
+		print(f"{'batch':<16} {elapsed:>9.2f} {summary['succeeded'] / elapsed * 60:>13.0f}")
+		if summary["failed"]:
+			print(f"batch failures: {summary['failed']}")
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Compare batch generation with one snippet at a time")
+	parser.add_argument("--prompts", type=int, default=100)
+	parser.add_argument("--delay", type=float, default=0.5, help="fake model latency in seconds")
+	parser.add_argument("--concurrency", type=int, default=8, help="BATCH_CONCURRENCY")
+	args = parser.parse_args()
+
+	os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+	os.environ["BATCH_CONCURRENCY"] = str(args.concurrency)
+	os.environ.setdefault("LOG_LEVEL", "WARNING")
+	os.environ.update(UNLIMITED_QUOTAS)
+	os.chdir(ROOT)
+	sys.path.insert(0, ROOT)
+	server = start_fake_server(args.delay)
+	try:
+		asyncio.run(main(args))
+	finally:
+		server.terminate()
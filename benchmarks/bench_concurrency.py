@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import uuid
+import asyncio
+import argparse
+import httpx
+
+from common import ROOT, UNLIMITED_QUOTAS, start_fake_server
+
+# Measures /generate_code throughput at increasing client concurrency against the fake
+# completion server, plus the latency of GET / while generations are in flight.
+# Usage: python benchmarks/bench_concurrency.py [--delay 0.5] [--levels 1,2,4,8,16]
+
+
+async def run_level(client, snippet_id, concurrency, requests_per_worker):
+	async def worker():
+		for _ in range(requests_per_worker):
+			response = await client.post(
+				"/generate_code",
+				data={"code_generation": "reverse a string in python", "snippet_id": snippet_id},
+			)
+			response.raise_for_status()
+
+	async def probe():
+		# Time the index page while the generation requests are running
+		await asyncio.sleep(0.05)
+		started = time.perf_counter()
+		await client.get("/")
+		return time.perf_counter() - started
+
+	started = time.perf_counter()
+	results = await asyncio.gather(probe(), *[worker() for _ in range(concurrency)])
+	elapsed = time.perf_counter() - started
+	total = concurrency * requests_per_worker
+	return total / elapsed, results[0]
+
+
+async def main(args):
+	import app as application
+	import db
+
+	# The ASGI transport does not run the app's lifespan, so enter it here
+	async with application.app.router.lifespan_context(application.app):
+		snippet_id = str(uuid.uuid4())
+		db.create_snippet(snippet_id, "Benchmark Snippet")
+
+		transport = httpx.ASGITransport(app=application.app)
+		try:
+			async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+				print(f"{'concurrency':>12} {'requests/s':>12} {'GET / (ms)':>12}")
+				for level in args.levels:
+					throughput, index_latency = await run_level(client, snippet_id, level, args.requests)
+					print(f"{level:>12} {throughput:>12.2f} {index_latency * 1000:>12.1f}")
+		finally:
+			db.delete_snippet(snippet_id)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmark concurrent code generation requests")
+	parser.add_argument("--delay", type=float, default=0.5, help="fake model latency in seconds")
+	parser.add_argument("--requests", type=int, default=4, help="requests sent by each concurrent client")
+	parser.add_argument("--levels", type=lambda value: [int(level) for level in value.split(",")], default=[1, 2, 4, 8, 16])
+	args = parser.parse_args()
+
+	os.environ.update(UNLIMITED_QUOTAS)
+	os.chdir(ROOT)
+	sys.path.insert(0, ROOT)
+	os.environ.setdefault("LLM_MAX_IN_FLIGHT", str(max(args.levels)))
+	# Every request repeats the same prompt, so the response cache would hide the model latency
+	os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+
+	server = start_fake_server(args.delay)
+	try:
+		asyncio.run(main(args))
+	finally:
+		server.terminate()
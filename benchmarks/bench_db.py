@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+import uuid
+import sqlite3
+import tempfile
+import argparse
+import threading
+
+# Compares the page render read path before and after the data access layer.
+# Before: one shared connection guarded by a lock, two single-column SELECTs for the status
+# flags plus a SELECT * for the row. After: db.get_snippet on per-thread WAL connections.
+# Usage: python benchmarks/bench_db.py [--rows 10000] [--seconds 3] [--threads 1,4]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed(path, rows):
+	conn = sqlite3.connect(path)
+	conn.execute(
+		"""
+		CREATE TABLE snippets (
+			id TEXT PRIMARY KEY,
+			name TEXT DEFAULT "",
+			code TEXT DEFAULT "",
+			tests TEXT DEFAULT "",
+			coding_language TEXT DEFAULT "",
+			communication_language TEXT DEFAULT ""
+		)
+	"""
+	)
+	ids = [str(uuid.uuid4()) for _ in range(rows)]
+	conn.executemany(
+		"INSERT INTO snippets VALUES (?, ?, ?, ?, ?, ?)",
+		(
+			(snippet_id, f"Snippet {index}", "def f(x):\n\treturn x\n" * 10, "assert f(1) == 1\n" * 10, "python", "English")
+			for index, snippet_id in enumerate(ids)
+		),
+	)
+	conn.commit()
+	conn.close()
+	return ids
+
+
+def old_render_path(cursor, lock, snippet_id):
+	# Mirrors the removed get_code_test_status and get_snippet helpers
+	with lock:
+		cursor.execute("SELECT tests FROM snippets WHERE id = ?", (snippet_id,))
+		tests = cursor.fetchone()
+		cursor.execute("SELECT code FROM snippets WHERE id = ?", (snippet_id,))
+		code = cursor.fetchone()
+		cursor.execute("SELECT * FROM snippets WHERE id = ?", (snippet_id,))
+		snippet = cursor.fetchone()
+	return code[0] != "", tests[0] != "", snippet
+
+
+def new_render_path(snippet_id):
+	import db
+
+	snippet = db.get_snippet(snippet_id)
+	return bool(snippet["code_value"]), bool(snippet["tests_value"]), snippet
+
+
+def measure(function, ids, threads, seconds):
+	counts = [0] * threads
+	deadline = time.perf_counter() + seconds
+
+	def worker(slot):
+		index = slot
+		while time.perf_counter() < deadline:
+			function(ids[index % len(ids)])
+			index += threads
+			counts[slot] += 1
+
+	workers = [threading.Thread(target=worker, args=(slot,)) for slot in range(threads)]
+	for thread in workers:
+		thread.start()
+	for thread in workers:
+		thread.join()
+	return sum(counts) / seconds
+
+
+def main(args):
+	directory = tempfile.mkdtemp()
+	path = os.path.join(directory, "bench.db")
+	ids = seed(path, args.rows)
+
+	os.environ["DATABASE_PATH"] = path
+	sys.path.insert(0, ROOT)
+	import db
+
+	# Switch the file to WAL once so the old path below also benefits from the same file state
+	db.migrate()
+
+	shared = sqlite3.connect(path, check_same_thread=False)
+	cursor = shared.cursor()
+	lock = threading.Lock()
+
+	print(f"{'threads':>8} {'before (renders/s)':>20} {'after (renders/s)':>20}")
+	for threads in args.threads:
+		before = measure(lambda snippet_id: old_render_path(cursor, lock, snippet_id), ids, threads, args.seconds)
+		after = measure(new_render_path, ids, threads, args.seconds)
+		print(f"{threads:>8} {before:>20.0f} {after:>20.0f}")
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmark the snippet render read path")
+	parser.add_argument("--rows", type=int, default=10000)
+	parser.add_argument("--seconds", type=float, default=3)
+	parser.add_argument("--threads", type=lambda value: [int(count) for count in value.split(",")], default=[1, 4])
+	main(parser.parse_args())
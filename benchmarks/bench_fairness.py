@@ -0,0 +1,92 @@
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import argparse
+import httpx
+
+from common import ROOT, UNLIMITED_QUOTAS, percentile
+
+# Latency of light users' model calls while a heavy user floods the model queue, with free slots
+# handed out first come first served and with fair sharing. The heavy user sends all its requests
+# at once; shortly after, each light user sends a few requests one after another.
+# Usage: python benchmarks/bench_fairness.py [--heavy 64] [--light-users 4] [--slots 4] [--delay 0.2]
+
+
+async def session(client, name):
+	response = await client.post("/api/v1/sessions", json={"name": name})
+	headers = {"Authorization": f"Bearer {response.json()['token']}"}
+	response = await client.post("/api/v1/snippets", json={"name": name}, headers=headers)
+	return headers, response.json()["id"]
+
+
+async def generate(client, user, number):
+	headers, snippet_id = user
+	started = time.perf_counter()
+	response = await client.post(
+		f"/api/v1/snippets/{snippet_id}/generate", json={"prompt": f"reverse a string {number}"}, headers=headers
+	)
+	response.raise_for_status()
+	return time.perf_counter() - started
+
+
+async def run(client, heavy, light, args):
+	started = time.perf_counter()
+	flood = [asyncio.create_task(generate(client, heavy, number)) for number in range(args.heavy)]
+	await asyncio.sleep(args.delay / 2)
+
+	async def light_user(user):
+		return [await generate(client, user, number) for number in range(args.light_requests)]
+
+	light_latencies = sorted(sum(await asyncio.gather(*(light_user(user) for user in light)), []))
+	light_done = time.perf_counter() - started
+	heavy_latencies = sorted(await asyncio.gather(*flood))
+	return light_latencies, light_done, heavy_latencies, time.perf_counter() - started
+
+
+async def main(args):
+	import llm
+	import app as application
+
+	transport = httpx.ASGITransport(app=application.app)
+	async with application.app.router.lifespan_context(application.app):
+		async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+			heavy = await session(client, "Heavy")
+			light = [await session(client, f"Light {index}") for index in range(args.light_users)]
+
+			print(
+				f"{args.heavy} heavy requests, {args.light_users} light users sending {args.light_requests} each, "
+				f"{args.slots} model slots, {args.delay}s fake model latency\n"
+			)
+			print(f"{'mode':<6} {'light p50 ms':>13} {'light p95 ms':>13} {'light done s':>13} {'heavy p95 s':>12} {'total s':>8}")
+			for fair in (False, True):
+				llm.gate = llm.ConcurrencyGate(args.slots, args.heavy * 2, 600, fair)
+				light_latencies, light_done, heavy_latencies, total = await run(client, heavy, light, args)
+				print(
+					f"{'fair' if fair else 'fifo':<6} {percentile(light_latencies, 0.5) * 1000:>13.0f} "
+					f"{percentile(light_latencies, 0.95) * 1000:>13.0f} {light_done:>13.2f} "
+					f"{percentile(heavy_latencies, 0.95):>12.2f} {total:>8.2f}"
+				)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Light user latency next to a heavy user, FIFO against fair share")
+	parser.add_argument("--heavy", type=int, default=64, help="concurrent requests of the heavy user")
+	parser.add_argument("--light-users", type=int, default=4)
+	parser.add_argument("--light-requests", type=int, default=3, help="sequential requests of each light user")
+	parser.add_argument("--slots", type=int, default=4, help="LLM_MAX_IN_FLIGHT")
+	parser.add_argument("--delay", type=float, default=0.2, help="fake model latency in seconds")
+	args = parser.parse_args()
+
+	os.environ.update(UNLIMITED_QUOTAS)
+	os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+	os.environ["LLM_BACKEND"] = "fake"
+	os.environ["LLM_FAKE_DELAY"] = str(args.delay)
+	# Every call must reach the model rather than the response cache or an earlier snippet
+	os.environ["LLM_CACHE_ENABLED"] = "false"
+	os.environ["SEMANTIC_REUSE_THRESHOLD"] = "2"
+	os.environ.setdefault("LOG_LEVEL", "WARNING")
+	os.chdir(ROOT)
+	sys.path.insert(0, ROOT)
+	asyncio.run(main(args))
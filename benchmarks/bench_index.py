@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import argparse
+import httpx
+
+from common import ROOT, percentile, seed_snippets
+
+# Seeds a database with many snippets and measures the index route: latency and response size
+# of rendering every snippet into the sidebar (the old unpaginated listing) versus the first
+# keyset page, a deep page fetched by the lazy-loading sidebar, a language filter and a search.
+# Usage: python benchmarks/bench_index.py [--rows 100000] [--requests 50]
+
+
+# Render the sidebar the way the index route did before pagination: every row, one response
+def unpaginated(templates, rows):
+	import db
+
+	snippets, _ = db.list_snippets(0, rows)
+	context = {"request": None, "snippets": snippets, "filters": {}, "snippet_selected": False}
+	return templates.get_template("index.html").render(context).encode("utf-8")
+
+
+def report(label, latencies, sizes):
+	latencies.sort()
+	print(
+		f"{label:<22} {sum(sizes) / len(sizes):>12.0f} {percentile(latencies, 0.5) * 1000:>9.2f} "
+		f"{percentile(latencies, 0.95) * 1000:>9.2f}"
+	)
+
+
+async def main(args):
+	import app as application
+
+	started = time.perf_counter()
+	seed_snippets(args.rows)
+	print(f"seeded {args.rows} snippets in {time.perf_counter() - started:.1f}s\n")
+	print(f"{'scenario':<22} {'bytes':>12} {'p50 ms':>9} {'p95 ms':>9}")
+
+	latencies, sizes = [], []
+	for _ in range(max(1, args.requests // 10)):
+		started = time.perf_counter()
+		body = unpaginated(application.templates, args.rows)
+		latencies.append(time.perf_counter() - started)
+		sizes.append(len(body))
+	report("unpaginated /", latencies, sizes)
+
+	scenarios = {
+		"paginated /": "/",
+		"deep page fragment": f"/fragments/snippets?after={args.rows // 2}",
+		"language filter": "/?coding_language=Rust&communication_language=German",
+		"search": "/?q=fibonacci+prim",
+	}
+	transport = httpx.ASGITransport(app=application.app)
+	async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+		for label, path in scenarios.items():
+			latencies, sizes = [], []
+			for _ in range(args.requests):
+				started = time.perf_counter()
+				response = await client.get(path)
+				latencies.append(time.perf_counter() - started)
+				response.raise_for_status()
+				sizes.append(len(response.content))
+			report(label, latencies, sizes)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmark the paginated index route")
+	parser.add_argument("--rows", type=int, default=100000)
+	parser.add_argument("--requests", type=int, default=50, help="requests per scenario")
+	args = parser.parse_args()
+
+	os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+	os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+	os.chdir(ROOT)
+	sys.path.insert(0, ROOT)
+	asyncio.run(main(args))
@@ -0,0 +1,63 @@
+import os
+import sys
+import argparse
+
+# Counts the prompt tokens every model backed action sends for the same snippet before (the v1
+# prompts and message layout with the code and tests sent in full) and after (the v2 prompts with
+# the code and tests cut to the prompt budgets), for a short snippet and for one whose code and
+# tests are far larger than the budgets.
+# Usage: python benchmarks/bench_prompts.py [--lines 2000]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SHORT_CODE = "def reverse_string(value):\n\treturn value[::-1]\n"
+SHORT_TESTS = "assert reverse_string('abc') == 'cba'\nassert reverse_string('') == ''"
+
+
+def snippet(lines):
+	if not lines:
+		return {"code": SHORT_CODE, "tests": SHORT_TESTS}
+	code = "\n".join(f"def helper_{index}(value):\n\treturn value + {index}\n" for index in range(lines // 3))
+	tests = "\n".join(f"assert helper_{index}(1) == {index + 1}" for index in range(lines))
+	return {"code": code, "tests": tests}
+
+
+def action_messages(services, row):
+	return {
+		"generate_code": services.generate_code_messages(row, "Write a function that reverses a string"),
+		"improve_code": services.improve_code_messages(row, "Handle None input"),
+		"generate_test_cases": services.generate_tests_messages(row),
+		"improve_test_cases": services.improve_tests_messages(row, "Add unicode cases"),
+		"run_test_code": services.run_tests_messages(row),
+		"regenerate_code": services.regenerate_code_messages(row),
+	}
+
+
+def main(args):
+	os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+	sys.path.insert(0, ROOT)
+	import prompts
+	import services
+	import settings
+
+	print(f"token counts {'from tiktoken' if prompts.tiktoken else 'estimated at 4 characters per token'}\n")
+	budgets_after = (settings.PROMPT_CODE_TOKENS, settings.PROMPT_TESTS_TOKENS)
+	print(f"{'snippet':<8} {'action':<20} {'before':>10} {'after':>10} {'saved':>7}")
+	for label, lines in (("short", 0), ("long", args.lines)):
+		row = snippet(lines)
+		counts = {}
+		for version, budgets in (("v1", (sys.maxsize, sys.maxsize)), ("v2", budgets_after)):
+			settings.PROMPT_VERSION = version
+			settings.PROMPT_CODE_TOKENS, settings.PROMPT_TESTS_TOKENS = budgets
+			for action, messages in action_messages(services, row).items():
+				tokens = sum(prompts.count_tokens(message["content"]) for message in messages)
+				counts.setdefault(action, {})[version] = tokens
+		for action, tokens in counts.items():
+			saved = 1 - tokens["v2"] / tokens["v1"]
+			print(f"{label:<8} {action:<20} {tokens['v1']:>10} {tokens['v2']:>10} {saved:>6.0%}")
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Compare prompt token counts of the v1 and v2 prompts")
+	parser.add_argument("--lines", type=int, default=2000, help="test lines in the long snippet")
+	main(parser.parse_args())
@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import argparse
+import httpx
+
+from common import ROOT, FAKE_SERVER_PORT, UNLIMITED_QUOTAS, percentile, start_fake_server
+
+# Success rate and latency of POST /api/v1/snippets/<id>/generate while the fake completion
+# server injects faults, with the model client's retries, reply repair, hedging and circuit
+# breaker turned off ("plain") and on ("resilient").
+# Usage: python benchmarks/bench_resilience.py [--requests 100] [--concurrency 10] [--delay 0.2]
+
+# Fault rates per scenario, see FAULTS in fake_llm_server.py
+SCENARIOS = {
+	"clean": {},
+	"transient": {"server_error": 0.1, "rate_limit": 0.1},
+	"bad replies": {"malformed": 0.1, "missing_keys": 0.1},
+	"tail latency": {"slow": 0.05},
+	"hangs": {"hang": 0.02},
+	"outage": {"server_error": 1.0},
+}
+
+
+def configurations(delay):
+	return {
+		"plain": {"LLM_RETRIES": 0, "LLM_REPAIR_RETRIES": 0, "LLM_HEDGE_AFTER": 0, "LLM_BREAKER_FAILURES": 10**9},
+		"resilient": {"LLM_RETRIES": 3, "LLM_REPAIR_RETRIES": 1, "LLM_HEDGE_AFTER": delay * 3, "LLM_BREAKER_FAILURES": 5},
+	}
+
+
+async def run(client, snippet_id, requests, concurrency):
+	semaphore = asyncio.Semaphore(concurrency)
+	latencies = []
+	statuses = {}
+
+	async def one(index):
+		async with semaphore:
+			started = time.perf_counter()
+			response = await client.post(
+				f"/api/v1/snippets/{snippet_id}/generate", json={"prompt": f"Reverse a string, variant {index}"}
+			)
+			latencies.append(time.perf_counter() - started)
+			statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+	await asyncio.gather(*(one(index) for index in range(requests)))
+	return sorted(latencies), statuses
+
+
+async def main(args):
+	import app as application
+	import llm
+	import settings
+
+	transport = httpx.ASGITransport(app=application.app)
+	# The ASGI transport does not run the app's lifespan, so enter it here
+	async with application.app.router.lifespan_context(application.app):
+		async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+			response = await client.post("/api/v1/snippets", json={})
+			snippet_id = response.json()["id"]
+
+			print(f"{args.requests} requests per run, concurrency {args.concurrency}, {args.delay}s fake model latency\n")
+			print(f"{'scenario':<14} {'client':<10} {'ok':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  statuses")
+			for scenario, faults in SCENARIOS.items():
+				httpx.put(f"http://127.0.0.1:{FAKE_SERVER_PORT}/faults", json=faults)
+				for name, overrides in configurations(args.delay).items():
+					for setting, value in overrides.items():
+						setattr(settings, setting, value)
+					llm.breaker.threshold = settings.LLM_BREAKER_FAILURES
+					llm.breaker.success()
+
+					latencies, statuses = await run(client, snippet_id, args.requests, args.concurrency)
+					ok = statuses.get(200, 0) / args.requests
+					print(
+						f"{scenario:<14} {name:<10} {ok:>6.0%} {percentile(latencies, 0.5) * 1000:>8.0f} "
+						f"{percentile(latencies, 0.95) * 1000:>8.0f} {percentile(latencies, 0.99) * 1000:>8.0f}  "
+						+ " ".join(f"{status}x{count}" for status, count in sorted(statuses.items()))
+					)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Compare the model client with and without its resilience features")
+	parser.add_argument("--requests", type=int, default=100)
+	parser.add_argument("--concurrency", type=int, default=10)
+	parser.add_argument("--delay", type=float, default=0.2, help="fake model latency in seconds")
+	args = parser.parse_args()
+
+	os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+	os.environ["LLM_CACHE_ENABLED"] = "false"
+	# Hung calls are cut off well before the fake server's hang ends
+	os.environ["LLM_TIMEOUT"] = str(args.delay * 20)
+	os.environ["LLM_BACKOFF_BASE"] = str(args.delay)
+	os.environ["LLM_BACKOFF_MAX"] = str(args.delay * 10)
+	os.environ.setdefault("LOG_LEVEL", "WARNING")
+	os.environ.update(UNLIMITED_QUOTAS)
+	os.chdir(ROOT)
+	sys.path.insert(0, ROOT)
+	server = start_fake_server(args.delay)
+	try:
+		asyncio.run(main(args))
+	finally:
+		server.terminate()
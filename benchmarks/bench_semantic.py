@@ -0,0 +1,202 @@
+import sys
+import time
+import random
+import argparse
+
+from common import ROOT, percentile
+
+# Recall and false reuse of the semantic prompt index on a synthetic corpus, and its search latency
+# as it grows. Each task has several phrasings; the index holds the first phrasing of every indexed
+# task in every language, and the queries are the other phrasings in other sentence templates.
+# A query for an indexed task and language should reuse that snippet; a query for a held out task,
+# many of them near misses such as descending for ascending, should not reuse anything. Long
+# prompts that differ in a word or two, odd for even say, are among the near misses. Reuse is
+# decided as the server does, on prompts with the same key words.
+# Usage: python benchmarks/bench_semantic.py [--sizes 1000 10000 100000]
+
+INDEXED_TASKS = [
+	["reverse a string", "reverse the characters of a string", "return a string backwards"],
+	["sort a list in ascending order", "sort list ascending", "order a list from smallest to largest"],
+	["find the maximum value in a list", "return the largest element of a list", "get max of a list"],
+	["check if a number is prime", "test whether a number is prime", "primality check for a number"],
+	["compute the factorial of a number", "calculate factorial of n", "return n factorial"],
+	["generate the fibonacci sequence", "produce fibonacci numbers", "list the fibonacci series"],
+	["count the vowels in a string", "return how many vowels a string has", "number of vowels in a string"],
+	["check if a string is a palindrome", "test whether a string reads the same backwards", "palindrome check for a string"],
+	["remove duplicates from a list", "deduplicate a list", "return a list without duplicate items"],
+	["merge two sorted lists", "combine two sorted lists into one sorted list", "merge a pair of sorted lists"],
+	["parse a json string", "decode json text into an object", "load json from a string"],
+	["read a csv file", "load rows from a csv file", "parse a csv file into rows"],
+	["convert celsius to fahrenheit", "turn a celsius temperature into fahrenheit", "celsius to fahrenheit conversion"],
+	["flatten a nested list", "turn a list of lists into a flat list", "flatten nested lists"],
+	["binary search a sorted list", "find an item in a sorted list with binary search", "binary search over a sorted array"],
+	["validate an email address", "check that an email address is valid", "email address validation"],
+	["count word frequencies in a text", "count how often each word appears in text", "word frequency count of a text"],
+	["transpose a matrix", "swap the rows and columns of a matrix", "return the transpose of a matrix"],
+	["compute the greatest common divisor of two numbers", "gcd of two numbers", "find the greatest common divisor"],
+	["capitalize every word in a sentence", "title case each word of a sentence", "uppercase the first letter of each word"],
+	[
+		"return a new list containing only the even numbers from the input list of integers, preserving their original order and leaving the input list unchanged",
+		"given a list of integers build a new list holding just its even numbers in their original order without modifying the input",
+		"keep the even integers of a list in a new list in the order they appear and do not change the original list",
+	],
+	[
+		"read a text file line by line, skip blank lines and comment lines starting with a hash, and return the remaining lines stripped of surrounding whitespace",
+		"load the lines of a text file without the empty ones and the hash comments, trimming the whitespace around each line",
+		"return the stripped lines of a text file except blank lines and lines that begin with a hash comment",
+	],
+	[
+		"group a list of dictionaries by the value of a given key and return a dictionary mapping each value to the list of dictionaries that have it",
+		"bucket a list of dicts by one key so each key value maps to the dicts sharing it",
+		"given records as dictionaries and a key name, collect the records into lists keyed by their value for that key",
+	],
+]
+
+HELD_OUT_TASKS = [
+	["sort a list in descending order", "sort list descending", "order a list from largest to smallest"],
+	["find the minimum value in a list", "return the smallest element of a list", "get min of a list"],
+	["reverse a linked list", "reverse the nodes of a linked list", "return a linked list backwards"],
+	["count the consonants in a string", "return how many consonants a string has", "number of consonants in a string"],
+	["convert fahrenheit to celsius", "turn a fahrenheit temperature into celsius", "fahrenheit to celsius conversion"],
+	["write a csv file", "save rows to a csv file", "export rows into a csv file"],
+	["compute the least common multiple of two numbers", "lcm of two numbers", "find the least common multiple"],
+	["serialize an object to a json string", "encode an object as json text", "dump an object to json"],
+	["rotate a matrix by 90 degrees", "turn a matrix a quarter turn", "rotate the matrix clockwise"],
+	["send an http request", "make an http get call", "fetch a url over http"],
+	[
+		"return a new list containing only the odd numbers from the input list of integers, preserving their original order and leaving the input list unchanged",
+		"given a list of integers build a new list holding just its odd numbers in their original order without modifying the input",
+		"keep the odd integers of a list in a new list in the order they appear and do not change the original list",
+	],
+	[
+		"return a new list containing only the even numbers from the input list of integers, sorted in descending order and leaving the input list unchanged",
+		"given a list of integers build a new list holding just its even numbers sorted from largest to smallest without modifying the input",
+		"keep the even integers of a list in a new list in descending order and do not change the original list",
+	],
+	[
+		"read a text file line by line, skip blank lines and comment lines starting with a semicolon, and return the remaining lines stripped of surrounding whitespace",
+		"load the lines of a text file without the empty ones and the semicolon comments, trimming the whitespace around each line",
+		"return the stripped lines of a text file except blank lines and lines that begin with a semicolon comment",
+	],
+	[
+		"group a list of dictionaries by the value of a given key and return a dictionary mapping each value to the number of dictionaries that have it",
+		"bucket a list of dicts by one key so each key value maps to how many dicts share it",
+		"given records as dictionaries and a key name, count the records for each of their values for that key",
+	],
+]
+
+LANGUAGES = ["python", "javascript", "go", "rust", "java"]
+
+INDEX_TEMPLATE = "{phrase} in {language}"
+QUERY_TEMPLATES = [
+	"write a {language} function to {phrase}",
+	"{language}: {phrase}",
+	"how do I {phrase} using {language}",
+	"please {phrase} with {language}",
+]
+
+FILLER = ["helper", "utility", "quickly", "efficiently", "simple", "robust", "small", "clean", "fast", "safe"]
+NOUNS = ["queue", "stack", "tree", "graph", "heap", "cache", "token", "record", "invoice", "matrix", "vector", "date"]
+VERBS = ["build", "parse", "store", "update", "merge", "split", "encode", "render", "schedule", "validate"]
+
+
+# Prompts asking for each task in each language: "reworded" puts the indexed phrasing in other
+# sentences, "paraphrased" uses the other phrasings
+def queries(tasks, kind):
+	for task_index, phrases in enumerate(tasks):
+		for language in LANGUAGES:
+			for phrase in phrases[:1] if kind == "reworded" else phrases[1:]:
+				for template in QUERY_TEMPLATES:
+					yield task_index, language, template.format(phrase=phrase, language=language)
+
+
+# Unrelated prompts filling the index up to the given size
+def background(count, generator):
+	for index in range(count):
+		words = [generator.choice(VERBS), "a", generator.choice(FILLER), generator.choice(NOUNS)]
+		words += [generator.choice(["with", "from", "into"]), generator.choice(NOUNS), "in", generator.choice(LANGUAGES)]
+		yield f"background-{index}", " ".join(words)
+
+
+def accuracy(semantic, thresholds):
+	index = semantic.PromptIndex(10**6)
+	index.load(
+		[
+			(f"{task_index}:{language}", INDEX_TEMPLATE.format(phrase=phrases[0], language=language))
+			for task_index, phrases in enumerate(INDEXED_TASKS)
+			for language in LANGUAGES
+		]
+	)
+	positives = {
+		kind: [
+			(f"{task}:{language}", index.search(text, limit=1, same_words=True))
+			for task, language, text in queries(INDEXED_TASKS, kind)
+		]
+		for kind in ("reworded", "paraphrased")
+	}
+	negatives = [
+		index.search(text, limit=1, same_words=True)
+		for kind in ("reworded", "paraphrased")
+		for _, _, text in queries(HELD_OUT_TASKS, kind)
+	]
+
+	print(
+		f"{len(index)} indexed prompts, {len(positives['reworded'])} reworded and {len(positives['paraphrased'])} "
+		f"paraphrased queries for them, {len(negatives)} queries for held out tasks\n"
+	)
+	print(f"{'threshold':>9} {'reworded recall':>16} {'paraphrased recall':>19} {'wrong snippet':>14} {'false reuse':>12}")
+	for threshold in thresholds:
+		recall = {}
+		wrong = 0
+		for kind, results in positives.items():
+			reused = [(expected, matches[0][0]) for expected, matches in results if matches and matches[0][1] >= threshold]
+			right = sum(1 for expected, found in reused if expected == found)
+			recall[kind] = right / len(results)
+			wrong += len(reused) - right
+		false = sum(1 for matches in negatives if matches and matches[0][1] >= threshold)
+		print(
+			f"{threshold:>9.2f} {recall['reworded']:>16.1%} {recall['paraphrased']:>19.1%} "
+			f"{wrong / sum(map(len, positives.values())):>14.1%} {false / len(negatives):>12.1%}"
+		)
+
+
+def latency(semantic, sizes, searches):
+	generator = random.Random(0)
+	texts = [text for _, _, text in queries(INDEXED_TASKS, "paraphrased")]
+	print(f"\n{'prompts':>9} {'load s':>8} {'add ms':>8} {'search p50 ms':>14} {'p95 ms':>8} {'matrix MB':>10}")
+	for size in sizes:
+		index = semantic.PromptIndex(size * 2)
+		prompts = list(background(size, generator))
+		started = time.perf_counter()
+		index.load(prompts)
+		load = time.perf_counter() - started
+
+		started = time.perf_counter()
+		for number in range(100):
+			index.add(f"added-{number}", generator.choice(texts))
+		add = (time.perf_counter() - started) / 100
+
+		timings = []
+		for _ in range(searches):
+			started = time.perf_counter()
+			index.search(generator.choice(texts))
+			timings.append(time.perf_counter() - started)
+		timings.sort()
+		print(
+			f"{size:>9} {load:>8.2f} {add * 1000:>8.3f} {percentile(timings, 0.5) * 1000:>14.3f} "
+			f"{percentile(timings, 0.95) * 1000:>8.3f} {index.matrix.nbytes / 2**20:>10.1f}"
+		)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Recall and latency of the semantic prompt index")
+	parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+	parser.add_argument("--searches", type=int, default=200)
+	parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.6, 0.7, 0.8, 0.9, 0.95])
+	args = parser.parse_args()
+
+	sys.path.insert(0, ROOT)
+	import semantic
+
+	accuracy(semantic, args.thresholds)
+	latency(semantic, args.sizes, args.searches)
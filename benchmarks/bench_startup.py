@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import tempfile
+import argparse
+import statistics
+import subprocess
+import httpx
+
+from common import ROOT
+
+# Cold start cost: seconds to import the app in a fresh interpreter, and seconds from launching
+# uvicorn until the first request is answered, with one and with several workers. Every launch
+# gets a new database, so the schema migrations are part of the time to first request.
+# Usage: python benchmarks/bench_startup.py [--runs 5] [--workers 4]
+
+PORT = 9200
+
+
+def environment(directory):
+	return {
+		**os.environ,
+		"DATABASE_PATH": os.path.join(directory, "startup.db"),
+		"LLM_BACKEND": "fake",
+		"LOG_LEVEL": "WARNING",
+	}
+
+
+def interpreter(code):
+	with tempfile.TemporaryDirectory() as directory:
+		started = time.perf_counter()
+		subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=environment(directory), check=True)
+		return time.perf_counter() - started
+
+
+def first_request(workers):
+	with tempfile.TemporaryDirectory() as directory:
+		started = time.perf_counter()
+		process = subprocess.Popen(
+			[sys.executable, "-m", "uvicorn", "app:app", "--port", str(PORT), "--workers", str(workers), "--log-level", "warning"],
+			cwd=ROOT,
+			env=environment(directory),
+		)
+		try:
+			while True:
+				try:
+					if httpx.get(f"http://127.0.0.1:{PORT}/api/v1/snippets", timeout=5).status_code == 200:
+						return time.perf_counter() - started
+				except httpx.TransportError:
+					pass
+				if process.poll() is not None:
+					raise RuntimeError("uvicorn exited before answering")
+				time.sleep(0.01)
+		finally:
+			process.terminate()
+			process.wait()
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Measure import time and time to first request")
+	parser.add_argument("--runs", type=int, default=5)
+	parser.add_argument("--workers", type=int, default=4)
+	args = parser.parse_args()
+
+	scenarios = {
+		"interpreter only": lambda: interpreter("pass"),
+		"import app": lambda: interpreter("import app"),
+		"first request, 1 worker": lambda: first_request(1),
+		f"first request, {args.workers} workers": lambda: first_request(args.workers),
+	}
+	print(f"median of {args.runs} runs\n")
+	print(f"{'scenario':<28} {'seconds':>8}")
+	for label, measure in scenarios.items():
+		print(f"{label:<28} {statistics.median(measure() for _ in range(args.runs)):>8.3f}")
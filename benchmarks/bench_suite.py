@@ -0,0 +1,438 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import tempfile
+import argparse
+import platform
+import subprocess
+import httpx
+
+from common import ROOT, UNLIMITED_QUOTAS, memory, percentile, seed_snippets
+
+# Regression benchmark of the whole request path. Every route of the app is called in-process
+# through ASGI with the fake model backend, against databases seeded with each --rows count of
+# snippets, and then groups of concurrent users run the browse, generate, improve and run tests
+# scenarios. Reports p50/p95/p99 latency, throughput and process memory per route and scenario,
+# and writes them all to a JSON file that --compare checks a later run against.
+# Each database size runs in a fresh interpreter so its memory figures stand on their own.
+# Usage: python benchmarks/bench_suite.py [--rows 1000 100000 1000000] [--users 1 8 32]
+#        [--duration 5] [--output results.json] [--compare baseline.json] [--seed-cache DIR]
+
+WORDS = ["reverse", "string", "sort", "list", "parse", "json", "fibonacci", "prime", "matrix", "graph"]
+
+# Status codes that count as a successful request
+OK_STATUSES = range(200, 400)
+
+
+def summary(latencies, errors, elapsed):
+	latencies = sorted(latencies)
+	return {
+		"requests": len(latencies),
+		"errors": errors,
+		"p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+		"p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+		"p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+		"throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+	}
+
+
+# Snippets and jobs the routes are called with. "ready" is only read, "work" takes every model
+# backed action, and routes that remove a snippet get a new one per call
+class Fixtures:
+	def __init__(self, client, rows):
+		self.client = client
+		self.rows = rows
+		self.counter = 0
+
+	async def snippet(self, code=True, tests=True):
+		self.counter += 1
+		response = await self.client.post("/api/v1/snippets", json={"name": f"Bench {self.counter}"})
+		snippet_id = response.json()["id"]
+		if code:
+			await self.client.post(
+				f"/api/v1/snippets/{snippet_id}/generate", json={"prompt": f"reverse string number {self.counter}"}
+			)
+		if tests:
+			await self.client.post(f"/api/v1/snippets/{snippet_id}/tests")
+		return snippet_id
+
+	async def setup(self):
+		# Every request runs as one session's user, as a browser's would
+		response = await self.client.post("/api/v1/sessions", json={"name": "Bench"})
+		self.client.headers["Authorization"] = f"Bearer {response.json()['token']}"
+		self.ready = await self.snippet()
+		self.work = await self.snippet()
+		response = await self.client.post(
+			f"/api/v1/snippets/{self.work}/jobs", json={"action": "improve_code", "input": "add type hints"}
+		)
+		self.job = response.json()["id"]
+		while (await self.client.get(f"/api/v1/jobs/{self.job}")).json()["status"] in ("queued", "running"):
+			await asyncio.sleep(0.01)
+		versions = (await self.client.get(f"/api/v1/snippets/{self.ready}/versions")).json()
+		self.version = versions[0]["version"]
+		page = (await self.client.get("/api/v1/snippets", params={"limit": 100})).json()
+		self.seeded = [item["id"] for item in page["items"]]
+
+	def prompt(self):
+		self.counter += 1
+		return f"{random.choice(WORDS)} a {random.choice(WORDS)} variant {self.counter}"
+
+
+def form(**data):
+	return {"data": data}
+
+
+# How to call each route: (method, path) as the app declares it, and a function of the fixtures
+# returning the concrete path and request options. Any route missing here is reported as uncovered
+ROUTES = {
+	("GET", "/openapi.json"): lambda f: ("/openapi.json", {}),
+	("GET", "/docs"): lambda f: ("/docs", {}),
+	("GET", "/docs/oauth2-redirect"): lambda f: ("/docs/oauth2-redirect", {}),
+	("GET", "/redoc"): lambda f: ("/redoc", {}),
+	("GET", "/api/v1/snippets"): lambda f: ("/api/v1/snippets", {"params": {"limit": 50}}),
+	("POST", "/api/v1/snippets"): lambda f: ("/api/v1/snippets", {"json": {}}),
+	("GET", "/api/v1/snippets/{snippet_id}"): lambda f: (f"/api/v1/snippets/{f.ready}", {}),
+	("DELETE", "/api/v1/snippets/{snippet_id}"): "fresh",
+	("POST", "/api/v1/snippets/{snippet_id}/generate"): lambda f: (
+		f"/api/v1/snippets/{f.work}/generate", {"json": {"prompt": f.prompt()}}
+	),
+	("POST", "/api/v1/snippets/{snippet_id}/improve"): lambda f: (
+		f"/api/v1/snippets/{f.work}/improve", {"json": {"feedback": f.prompt()}}
+	),
+	("POST", "/api/v1/snippets/{snippet_id}/tests"): lambda f: (f"/api/v1/snippets/{f.work}/tests", {}),
+	("POST", "/api/v1/snippets/{snippet_id}/tests/improve"): lambda f: (
+		f"/api/v1/snippets/{f.work}/tests/improve", {"json": {"feedback": f.prompt()}}
+	),
+	("POST", "/api/v1/snippets/{snippet_id}/run"): lambda f: (f"/api/v1/snippets/{f.ready}/run", {}),
+	("POST", "/api/v1/snippets/{snippet_id}/regenerate"): lambda f: (f"/api/v1/snippets/{f.work}/regenerate", {}),
+	("POST", "/api/v1/snippets/{snippet_id}/repair"): lambda f: (
+		f"/api/v1/snippets/{f.work}/repair", {"json": {"iterations": 1}}
+	),
+	("GET", "/api/v1/snippets/{snippet_id}/repairs"): lambda f: (f"/api/v1/snippets/{f.work}/repairs", {}),
+	("POST", "/api/v1/snippets/{snippet_id}/jobs"): lambda f: (
+		f"/api/v1/snippets/{f.work}/jobs", {"json": {"action": "improve_code", "input": f.prompt()}}
+	),
+	("GET", "/api/v1/snippets/{snippet_id}/jobs"): lambda f: (f"/api/v1/snippets/{f.work}/jobs", {}),
+	("GET", "/api/v1/jobs/{job_id}"): lambda f: (f"/api/v1/jobs/{f.job}", {}),
+	("GET", "/api/v1/jobs/{job_id}/events"): lambda f: (f"/api/v1/jobs/{f.job}/events", {}),
+	("POST", "/api/v1/jobs/{job_id}/cancel"): lambda f: (f"/api/v1/jobs/{f.job}/cancel", {}),
+	("GET", "/api/v1/snippets/{snippet_id}/versions"): lambda f: (f"/api/v1/snippets/{f.ready}/versions", {}),
+	("GET", "/api/v1/snippets/{snippet_id}/versions/{version}"): lambda f: (
+		f"/api/v1/snippets/{f.ready}/versions/{f.version}", {}
+	),
+	("GET", "/api/v1/snippets/{snippet_id}/versions/{version}/diff"): lambda f: (
+		f"/api/v1/snippets/{f.ready}/versions/{f.version}/diff", {"params": {"against": 1}}
+	),
+	("POST", "/api/v1/snippets/{snippet_id}/versions/{version}/restore"): lambda f: (
+		f"/api/v1/snippets/{f.ready}/versions/{f.version}/restore", {}
+	),
+	("POST", "/api/v1/batches"): lambda f: ("/api/v1/batches", {"json": [f.prompt() for _ in range(5)]}),
+	("POST", "/api/v1/sessions"): lambda f: ("/api/v1/sessions", {"json": {}}),
+	("GET", "/api/v1/session"): lambda f: ("/api/v1/session", {}),
+	("DELETE", "/api/v1/session"): "fresh",
+	("GET", "/api/v1/prompts/similar"): lambda f: ("/api/v1/prompts/similar", {"params": {"q": f.prompt()}}),
+	("GET", "/"): lambda f: ("/", {}),
+	("GET", "/fragments/snippets"): lambda f: ("/fragments/snippets", {"params": {"after": f.rows // 2}}),
+	("POST", "/add_snippet"): lambda f: ("/add_snippet", {}),
+	("POST", "/delete_snippet"): "fresh",
+	("POST", "/view_snippet"): lambda f: ("/view_snippet", form(snippet_id=f.ready)),
+	("POST", "/generate_code"): lambda f: ("/generate_code", form(snippet_id=f.work, code_generation=f.prompt())),
+	("POST", "/improve_code"): lambda f: ("/improve_code", form(snippet_id=f.work, code_feedback=f.prompt())),
+	("POST", "/generate_test_cases"): lambda f: ("/generate_test_cases", form(snippet_id=f.work)),
+	("POST", "/improve_test_cases"): lambda f: (
+		"/improve_test_cases", form(snippet_id=f.work, tests_feedback=f.prompt())
+	),
+	("POST", "/run_test_code"): lambda f: ("/run_test_code", form(snippet_id=f.ready)),
+	("POST", "/regenerate_code"): lambda f: ("/regenerate_code", form(snippet_id=f.work)),
+	("POST", "/repair_code"): lambda f: ("/repair_code", form(snippet_id=f.work)),
+	("GET", "/fragments/snippets/{snippet_id}/{panel}"): lambda f: (f"/fragments/snippets/{f.ready}/code", {}),
+	("POST", "/fragments/run_test_code"): lambda f: ("/fragments/run_test_code", form(snippet_id=f.ready)),
+	("POST", "/fragments/{action}"): lambda f: (
+		"/fragments/improve_code", form(snippet_id=f.work, code_feedback=f.prompt())
+	),
+	("POST", "/stream/generate_code"): lambda f: (
+		"/stream/generate_code", form(snippet_id=f.work, code_generation=f.prompt())
+	),
+	("POST", "/stream/improve_code"): lambda f: (
+		"/stream/improve_code", form(snippet_id=f.work, code_feedback=f.prompt())
+	),
+	("POST", "/stream/regenerate_code"): lambda f: ("/stream/regenerate_code", form(snippet_id=f.work)),
+	("GET", "/cache/stats"): lambda f: ("/cache/stats", {}),
+	("GET", "/usage/stats"): lambda f: ("/usage/stats", {}),
+	("GET", "/metrics"): lambda f: ("/metrics", {}),
+}
+
+
+# Build the request for a route; "fresh" routes delete a snippet or end a session created for the call
+async def route_request(method, path, fixtures):
+	call = ROUTES[(method, path)]
+	if call != "fresh":
+		return call(fixtures)
+	if path == "/api/v1/session":
+		response = await fixtures.client.post("/api/v1/sessions", json={})
+		return path, {"headers": {"Authorization": f"Bearer {response.json()['token']}"}}
+	snippet_id = await fixtures.snippet(code=False, tests=False)
+	if path.startswith("/api/"):
+		return f"/api/v1/snippets/{snippet_id}", {}
+	return path, form(snippet_id=snippet_id)
+
+
+def app_routes(application):
+	for route in application.routes:
+		for method in sorted(getattr(route, "methods", None) or ()):
+			if method != "HEAD":
+				yield method, route.path
+
+
+async def measure_routes(client, application, fixtures, requests):
+	results = []
+	for method, path in app_routes(application):
+		if (method, path) not in ROUTES:
+			continue
+		latencies, errors, elapsed = [], 0, 0.0
+		for _ in range(requests):
+			url, options = await route_request(method, path, fixtures)
+			started = time.perf_counter()
+			response = await client.request(method, url, **options)
+			took = time.perf_counter() - started
+			elapsed += took
+			latencies.append(took)
+			errors += response.status_code not in OK_STATUSES
+		results.append({"route": f"{method} {path}", **summary(latencies, errors, elapsed)})
+	return results
+
+
+# Scenario steps; each returns (step, method, url, options) for a user holding its own snippet
+def browse(user, fixtures):
+	return [
+		("index", "GET", "/", {}),
+		("next page", "GET", "/fragments/snippets", {"params": {"after": random.randrange(max(fixtures.rows, 1))}}),
+		("search", "GET", "/", {"params": {"q": random.choice(WORDS)}}),
+		("view", "POST", "/view_snippet", form(snippet_id=random.choice(fixtures.seeded or [fixtures.ready]))),
+		("panel", "GET", f"/fragments/snippets/{random.choice(fixtures.seeded or [fixtures.ready])}/code", {}),
+	]
+
+
+def generate(user, fixtures):
+	return [
+		("generate", "POST", "/stream/generate_code", form(snippet_id=user, code_generation=fixtures.prompt())),
+		("tests", "POST", "/fragments/generate_test_cases", form(snippet_id=user)),
+	]
+
+
+def improve(user, fixtures):
+	return [
+		("improve", "POST", "/fragments/improve_code", form(snippet_id=user, code_feedback=fixtures.prompt())),
+		("run", "POST", "/fragments/run_test_code", form(snippet_id=user)),
+	]
+
+
+def run_tests(user, fixtures):
+	return [("run", "POST", "/fragments/run_test_code", form(snippet_id=user))]
+
+
+# Most users browse, a few generate, improve or run tests
+def mixed(user, fixtures):
+	return random.choices([browse, generate, improve, run_tests], weights=[7, 1, 1, 1])[0](user, fixtures)
+
+
+SCENARIOS = {"browse": browse, "generate": generate, "improve": improve, "run_tests": run_tests, "mixed": mixed}
+
+
+async def measure_scenario(client, fixtures, scenario, users, duration):
+	snippets = [await fixtures.snippet() for _ in range(users)]
+	steps = {}
+	deadline = time.perf_counter() + duration
+
+	async def user(snippet_id):
+		while time.perf_counter() < deadline:
+			for step, method, url, options in SCENARIOS[scenario](snippet_id, fixtures):
+				started = time.perf_counter()
+				response = await client.request(method, url, **options)
+				latencies, errors = steps.setdefault(step, ([], [0]))
+				latencies.append(time.perf_counter() - started)
+				errors[0] += response.status_code not in OK_STATUSES
+
+	started = time.perf_counter()
+	await asyncio.gather(*(user(snippet_id) for snippet_id in snippets))
+	elapsed = time.perf_counter() - started
+	return {
+		"scenario": scenario,
+		"users": users,
+		**summary(
+			[latency for latencies, _ in steps.values() for latency in latencies],
+			sum(errors[0] for _, errors in steps.values()),
+			elapsed,
+		),
+		**memory(),
+		"steps": {step: summary(latencies, errors[0], elapsed) for step, (latencies, errors) in steps.items()},
+	}
+
+
+# Database setup: seed a new file, or copy one seeded earlier into --seed-cache
+def prepare_database(rows, path, seed_cache):
+	cached = os.path.join(seed_cache, f"snippets-{rows}.db") if seed_cache else None
+	started = time.perf_counter()
+	if cached and os.path.exists(cached):
+		shutil.copyfile(cached, path)
+	else:
+		seed_snippets(rows)
+		import db
+
+		db.get_connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+		db.close_connection()
+		if cached:
+			os.makedirs(seed_cache, exist_ok=True)
+			shutil.copyfile(path, cached)
+	return time.perf_counter() - started
+
+
+async def run_size(args):
+	import app as application
+
+	seed_seconds = prepare_database(args.rows[0], os.environ["DATABASE_PATH"], args.seed_cache)
+	result = {"rows": args.rows[0], "seed_seconds": round(seed_seconds, 2), "memory": {"seeded": memory()}}
+	transport = httpx.ASGITransport(app=application.app)
+	# The ASGI transport does not run the app's lifespan, so enter it here
+	async with application.app.router.lifespan_context(application.app):
+		async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+			fixtures = Fixtures(client, args.rows[0])
+			await fixtures.setup()
+			result["memory"]["started"] = memory()
+			result["routes"] = await measure_routes(client, application.app, fixtures, args.requests)
+			result["memory"]["routes"] = memory()
+			result["uncovered"] = [
+				f"{method} {path}" for method, path in app_routes(application.app) if (method, path) not in ROUTES
+			]
+			result["scenarios"] = []
+			for scenario in args.scenarios:
+				for users in args.users:
+					result["scenarios"].append(await measure_scenario(client, fixtures, scenario, users, args.duration))
+	return result
+
+
+def git_commit():
+	try:
+		return subprocess.run(
+			["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+		).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def print_size(result):
+	print(f"\n{result['rows']} seeded snippets (seeded in {result['seed_seconds']}s)")
+	for uncovered in result["uncovered"]:
+		print(f"  not benchmarked: {uncovered}")
+	print(f"{'route':<62} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'errors':>7}")
+	for route in result["routes"]:
+		print(
+			f"{route['route']:<62} {route['p50_ms']:>9.2f} {route['p95_ms']:>9.2f} {route['p99_ms']:>9.2f} "
+			f"{route['throughput_rps']:>9.1f} {route['errors']:>7}"
+		)
+	print(
+		f"\n{'scenario':<10} {'users':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'errors':>7} {'RSS MB':>8}"
+	)
+	for scenario in result["scenarios"]:
+		print(
+			f"{scenario['scenario']:<10} {scenario['users']:>6} {scenario['p50_ms']:>9.2f} {scenario['p95_ms']:>9.2f} "
+			f"{scenario['p99_ms']:>9.2f} {scenario['throughput_rps']:>9.1f} {scenario['errors']:>7} {scenario['rss_mb']:>8.1f}"
+		)
+		for step, timings in scenario["steps"].items():
+			print(
+				f"  {step:<15} {timings['p50_ms']:>9.2f} {timings['p95_ms']:>9.2f} {timings['p99_ms']:>9.2f} "
+				f"{timings['throughput_rps']:>9.1f} {timings['errors']:>7}"
+			)
+	print(f"memory: {json.dumps(result['memory'])}")
+
+
+# Print the p95 latency and throughput changes of every route and scenario against a baseline run
+def compare(baseline, results):
+	def keyed(run):
+		for size in run["results"]:
+			for route in size["routes"]:
+				yield (size["rows"], route["route"]), route
+			for scenario in size["scenarios"]:
+				yield (size["rows"], f"{scenario['scenario']} x{scenario['users']}"), scenario
+
+	before = dict(keyed(baseline))
+	print(f"\ncompared with {baseline['meta'].get('commit')}")
+	print(f"{'rows':>8} {'route or scenario':<62} {'p95 change':>11} {'req/s change':>13}")
+	for key, after in keyed(results):
+		if key not in before:
+			continue
+		old = before[key]
+		p95 = (after["p95_ms"] - old["p95_ms"]) / old["p95_ms"] if old["p95_ms"] else 0.0
+		rate = (after["throughput_rps"] - old["throughput_rps"]) / old["throughput_rps"] if old["throughput_rps"] else 0.0
+		print(f"{key[0]:>8} {key[1]:<62} {p95:>+11.1%} {rate:>+13.1%}")
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmark every route and concurrent user scenarios in-process")
+	parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100000, 1000000])
+	parser.add_argument("--requests", type=int, default=20, help="sequential requests per route")
+	parser.add_argument("--users", type=int, nargs="+", default=[1, 8, 32])
+	parser.add_argument("--duration", type=float, default=5, help="seconds per scenario and user count")
+	parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+	parser.add_argument("--delay", type=float, default=0.0, help="fake model latency in seconds")
+	parser.add_argument("--cache", action="store_true", help="keep the response cache and prompt reuse on")
+	parser.add_argument("--seed-cache", default="", help="directory keeping seeded databases between runs")
+	parser.add_argument("--output", default="bench_suite.json")
+	parser.add_argument("--compare", default="", help="results file of an earlier run to compare with")
+	parser.add_argument("--child-output", default="", help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	os.chdir(ROOT)
+	sys.path.insert(0, ROOT)
+	if args.child_output:
+		random.seed(0)
+		result = asyncio.run(run_size(args))
+		with open(args.child_output, "w") as output:
+			json.dump(result, output)
+		sys.exit(0)
+
+	environment = {
+		**os.environ,
+		"LLM_BACKEND": "fake",
+		"LLM_FAKE_DELAY": str(args.delay),
+		"LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+		**UNLIMITED_QUOTAS,
+	}
+	if not args.cache:
+		# Requests repeat prompts, which the response cache and prompt reuse would answer without the model path
+		environment["LLM_CACHE_ENABLED"] = "false"
+		environment["SEMANTIC_REUSE_THRESHOLD"] = "2"
+
+	results = []
+	for rows in args.rows:
+		with tempfile.TemporaryDirectory() as directory:
+			child_output = os.path.join(directory, "result.json")
+			command = [sys.executable, os.path.abspath(__file__), "--rows", str(rows), "--child-output", child_output]
+			command += ["--requests", str(args.requests), "--duration", str(args.duration), "--seed-cache", args.seed_cache]
+			command += ["--users", *map(str, args.users), "--scenarios", *args.scenarios]
+			subprocess.run(command, env={**environment, "DATABASE_PATH": os.path.join(directory, "bench.db")}, check=True)
+			with open(child_output) as output:
+				results.append(json.load(output))
+		print_size(results[-1])
+
+	run = {
+		"meta": {
+			"commit": git_commit(),
+			"created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+			"python": platform.python_version(),
+			"platform": platform.platform(),
+			"cpus": os.cpu_count(),
+			"arguments": {name: value for name, value in vars(args).items() if name != "child_output"},
+		},
+		"results": results,
+	}
+	with open(args.output, "w") as output:
+		json.dump(run, output, indent=1)
+	print(f"\nresults written to {args.output}")
+	if args.compare:
+		with open(args.compare) as baseline:
+			compare(json.load(baseline), run)
@@ -0,0 +1,191 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+import argparse
+import threading
+
+from common import ROOT, memory, percentile, seed_snippets
+
+# Bulk export, import and backup of a large snippet library. Seeds --rows snippets, a --history
+# share of them with several versions, then streams the JSONL export with and without history and
+# the zip export to files, imports the JSONL into an empty database at the configured chunk size
+# and, on the first --sweep-rows lines, at each --chunk-sizes size, and takes an online backup.
+# A probe thread reads a page of snippets and creates one the whole time, so the table shows how
+# long other requests' queries take while each step runs, against an idle baseline.
+# Usage: python benchmarks/bench_transfer.py [--rows 1000000] [--history 0.05] [--sweep-rows 50000]
+
+VERSIONS_PER_SNIPPET = 4
+
+
+# Give a share of the snippets a few code and tests versions
+def seed_history(db, versions, share):
+	conn = db.get_connection()
+	generator = random.Random(1)
+	query = "SELECT id FROM snippets WHERE abs(random()) % 1000 < ?"
+	ids = [row[0] for row in conn.execute(query, (int(share * 1000),))]
+	rows = []
+	for snippet_id in ids:
+		lines = [f"def step_{index}(value):\n\treturn value + {index}" for index in range(generator.randint(3, 12))]
+		history = []
+		for _ in range(VERSIONS_PER_SNIPPET):
+			lines[generator.randrange(len(lines))] += f"\n# revised {generator.random():.6f}"
+			history.append({"code": "\n".join(lines), "tests": f"assert step_0(1) == 1\n# {len(history)}"})
+		for number, (full, body) in enumerate(versions.encode(history, 20), start=1):
+			rows.append((snippet_id, number, time.time(), "generate_code", 100, 50, int(full), body))
+	with conn:
+		conn.executemany(db.INSERT_SNIPPET_VERSION, rows)
+	return len(ids)
+
+
+# Query latencies of a thread reading a page of snippets and creating one, until stopped
+class Probe:
+	def __init__(self):
+		self.latencies = []
+		self.stopped = threading.Event()
+		self.thread = threading.Thread(target=self.run)
+
+	def run(self):
+		import db
+
+		while not self.stopped.is_set():
+			started = time.perf_counter()
+			db.list_snippets(0, 50)
+			db.create_snippet(f"probe-{threading.get_ident()}-{time.time_ns()}", "Probe")
+			self.latencies.append(time.perf_counter() - started)
+			time.sleep(0.005)
+		db.close_connection()
+
+	def __enter__(self):
+		self.thread.start()
+		return self
+
+	def __exit__(self, *exc):
+		self.stopped.set()
+		self.thread.join()
+
+	def summary(self):
+		latencies = [latency * 1000 for latency in sorted(self.latencies)]
+		return f"{percentile(latencies, 0.5):>9.2f} {percentile(latencies, 0.99):>9.2f} {latencies[-1]:>9.2f}"
+
+
+def report(step, seconds, count, size, probe):
+	rate = f"{count / seconds:>10.0f}" if count else f"{'':>10}"
+	print(
+		f"{step:<28} {seconds:>8.2f} {rate} {size / 2**20:>8.1f} {memory()['peak_rss_mb']:>9.1f} {probe.summary()}"
+	)
+
+
+def export(generator, path):
+	size = 0
+	with Probe() as probe, open(path, "wb") as output:
+		started = time.perf_counter()
+		for chunk in generator:
+			size += len(chunk)
+			output.write(chunk)
+		seconds = time.perf_counter() - started
+	return seconds, size, probe
+
+
+# Read a file in chunks, as a request body arrives
+async def file_chunks(path):
+	with open(path, "rb") as source:
+		while chunk := source.read(1 << 16):
+			yield chunk
+
+
+async def limited(source, limit):
+	count = 0
+	async for line in source:
+		yield line
+		count += 1
+		if count >= limit:
+			return
+
+
+# Import the first limit lines of a JSONL file into a new database; each asyncio.run has new worker
+# threads, so their per-thread connections open the new file
+def import_file(db, settings, transfer, path, directory, chunk_size, limit=None):
+	db.close_connection()
+	settings.DATABASE_PATH = os.path.join(directory, f"import-{chunk_size}-{limit}.db")
+	settings.TRANSFER_CHUNK_SIZE = chunk_size
+	db.migrate()
+
+	async def run():
+		source = transfer.lines(file_chunks(path))
+		if limit:
+			source = limited(source, limit)
+		return await transfer.import_lines(source, "")
+
+	with Probe() as probe:
+		started = time.perf_counter()
+		summary = asyncio.run(run())
+		seconds = time.perf_counter() - started
+	db.close_connection()
+	wal = f"{settings.DATABASE_PATH}-wal"
+	size = os.path.getsize(settings.DATABASE_PATH) + (os.path.getsize(wal) if os.path.exists(wal) else 0)
+	return seconds, summary, size, probe
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Bulk export, import and backup of a large snippet library")
+	parser.add_argument("--rows", type=int, default=1000000)
+	parser.add_argument("--history", type=float, default=0.05, help="share of snippets with versions")
+	parser.add_argument("--sweep-rows", type=int, default=50000, help="lines imported per chunk size in the sweep")
+	parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[1, 100, 500, 2000])
+	parser.add_argument("--idle", type=float, default=2, help="seconds of the idle probe baseline")
+	args = parser.parse_args()
+
+	directory = tempfile.mkdtemp()
+	os.environ["DATABASE_PATH"] = os.path.join(directory, "library.db")
+	os.environ["BACKUP_DIR"] = os.path.join(directory, "backups")
+	os.environ.setdefault("LOG_LEVEL", "WARNING")
+	os.chdir(ROOT)
+	sys.path.insert(0, ROOT)
+	import db
+	import settings
+	import transfer
+	import versions
+
+	started = time.perf_counter()
+	seed_snippets(args.rows)
+	with_history = seed_history(db, versions, args.history)
+	db.get_connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+	library = settings.DATABASE_PATH
+	print(
+		f"{args.rows} snippets, {with_history} of them with {VERSIONS_PER_SNIPPET} versions, "
+		f"seeded in {time.perf_counter() - started:.1f}s ({os.path.getsize(library) / 2**20:.0f} MB)\n"
+	)
+	print(
+		f"{'step':<28} {'seconds':>8} {'rows/s':>10} {'MB':>8} {'peak RSS':>9} "
+		f"{'probe p50':>9} {'p99':>9} {'max ms':>9}"
+	)
+
+	with Probe() as probe:
+		time.sleep(args.idle)
+	report("idle", args.idle, 0, 0, probe)
+
+	jsonl = os.path.join(directory, "export.jsonl")
+	seconds, size, probe = export(transfer.export_jsonl(None), jsonl)
+	report("export jsonl", seconds, args.rows, size, probe)
+	seconds, size, probe = export(transfer.export_jsonl(None, False), f"{jsonl}.plain")
+	report("export jsonl, no history", seconds, args.rows, size, probe)
+	seconds, size, probe = export(transfer.export_zip(None), os.path.join(directory, "export.zip"))
+	report("export zip", seconds, args.rows, size, probe)
+
+	with Probe() as probe:
+		started = time.perf_counter()
+		result = asyncio.run(transfer.backup())
+		seconds = time.perf_counter() - started
+	report("backup", seconds, 0, result["bytes"], probe)
+
+	chunk_size = settings.TRANSFER_CHUNK_SIZE
+	seconds, summary, size, probe = import_file(db, settings, transfer, jsonl, directory, chunk_size)
+	report(f"import, chunks of {chunk_size}", seconds, summary["imported"], size, probe)
+	for sweep_size in args.chunk_sizes:
+		seconds, summary, size, probe = import_file(
+			db, settings, transfer, jsonl, directory, sweep_size, args.sweep_rows
+		)
+		report(f"import {args.sweep_rows}, chunks of {sweep_size}", seconds, summary["imported"], size, probe)
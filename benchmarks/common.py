@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+import uuid
+import random
+import resource
+import subprocess
+import httpx
+
+# Helpers shared by the benchmark scripts
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_SERVER_PORT = 9100
+
+
+# Settings lifting the per user quotas and the session start limit, which would soon refuse a
+# benchmark sending everything as one user from one address
+UNLIMITED_QUOTAS = {"USER_REQUESTS_PER_MINUTE": "0", "USER_TOKENS_PER_HOUR": "0", "SESSIONS_PER_HOUR": "0"}
+
+
+# Start the fake completion server and point the OpenAI client at it
+def start_fake_server(delay, port=FAKE_SERVER_PORT):
+	process = subprocess.Popen(
+		[sys.executable, os.path.join(ROOT, "benchmarks", "fake_llm_server.py"), "--port", str(port), "--delay", str(delay)]
+	)
+	os.environ["LLM_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+	os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+	# Wait until the server accepts connections
+	for _ in range(100):
+		try:
+			httpx.post(f"http://127.0.0.1:{port}/v1/chat/completions", json={"messages": []}, timeout=5)
+			return process
+		except httpx.TransportError:
+			time.sleep(0.1)
+	process.kill()
+	raise RuntimeError("Fake completion server did not start")
+
+
+# Resident and peak resident memory of this process in MB
+def memory():
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+	try:
+		with open("/proc/self/statm") as statm:
+			resident = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+	except OSError:
+		resident = peak
+	return {"rss_mb": round(resident, 1), "peak_rss_mb": round(peak, 1)}
+
+
+# Value at the given percentile of an already sorted list
+def percentile(values, fraction):
+	if not values:
+		return 0.0
+	index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+	return values[index]
+
+
+LANGUAGES = ["Python", "JavaScript", "Go", "Rust", "Java"]
+COMMUNICATION_LANGUAGES = ["English", "German", "French", "Spanish"]
+WORDS = ["reverse", "string", "sort", "list", "parse", "json", "fibonacci", "prime", "matrix", "graph"]
+
+
+# Fill the database with rows snippets of generated names, code and languages in one transaction
+def seed_snippets(rows):
+	import db
+
+	db.migrate()
+	conn = db.get_connection()
+	generator = random.Random(0)
+	with conn:
+		conn.executemany(
+			"INSERT INTO snippets (id, name, code, coding_language, communication_language) VALUES (?, ?, ?, ?, ?)",
+			(
+				(
+					str(uuid.uuid4()),
+					f"Snippet {index} {generator.choice(WORDS)}",
+					f"def {generator.choice(WORDS)}_{generator.choice(WORDS)}(value):\n\treturn value\n",
+					generator.choice(LANGUAGES),
+					generator.choice(COMMUNICATION_LANGUAGES),
+				)
+				for index in range(rows)
+			),
+		)
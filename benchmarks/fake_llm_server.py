@@ -0,0 +1,156 @@
+import json
+import time
+import random
+import asyncio
+import argparse
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Local stand-in for the OpenAI chat completions API used by the benchmarks.
+# Every request sleeps for a fixed delay to mimic model latency and returns a JSON object
+# containing every key the application reads from a completion.
+# Faults can be injected at a given rate each, from the command line or at runtime with
+# PUT /faults {"server_error": 0.2, ...}: see FAULTS.
+
+app = FastAPI()
+app.state.delay = 0.5
+
+# Injected faults, each the fraction of requests it hits
+FAULTS = {
+	# 500 response
+	"server_error": 0.0,
+	# 429 response with a Retry-After header
+	"rate_limit": 0.0,
+	# No response for HANG_SECONDS
+	"hang": 0.0,
+	# Ten times the configured delay, a tail latency outlier
+	"slow": 0.0,
+	# Content that is not valid JSON
+	"malformed": 0.0,
+	# Valid JSON missing the Code, Tests and Status keys
+	"missing_keys": 0.0,
+}
+app.state.faults = dict(FAULTS)
+
+HANG_SECONDS = 300
+
+# Characters per streamed chunk when the client asks for stream=True
+STREAM_CHUNK_SIZE = 8
+
+CONTENT = {
+	"ShortCodeName": "Reverse String",
+	"CodingLanguage": "python",
+	"CommunicationLanguage": "English",
+	"Code": "def reverse_string(value):\n\treturn value[::-1]",
+	"Tests": [
+		"assert reverse_string('abc') == 'cba'",
+		"assert reverse_string('') == ''",
+	],
+	"Status": True,
+}
+
+
+@app.put("/faults")
+async def set_faults(request: Request):
+	app.state.faults = {**FAULTS, **await request.json()}
+	return app.state.faults
+
+
+# The fault hitting this request, if any; each is drawn on its own
+def draw_fault():
+	for fault, rate in app.state.faults.items():
+		if random.random() < rate:
+			return fault
+	return None
+
+
+def error_response(status, message, headers=None):
+	return JSONResponse({"error": {"message": message, "type": "fake_fault"}}, status_code=status, headers=headers)
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+	body = await request.json()
+	fault = draw_fault()
+	if fault == "server_error":
+		return error_response(500, "Injected server error")
+	if fault == "rate_limit":
+		return error_response(429, "Injected rate limit", {"Retry-After": "0.2"})
+	if fault == "hang":
+		await asyncio.sleep(HANG_SECONDS)
+
+	content = json.dumps(CONTENT)
+	if fault == "malformed":
+		content = "Here is the code: " + content[: len(content) // 2]
+	elif fault == "missing_keys":
+		content = json.dumps({key: value for key, value in CONTENT.items() if key not in ("Code", "Tests", "Status")})
+	delay = app.state.delay * (10 if fault == "slow" else 1)
+
+	if body.get("stream"):
+		return StreamingResponse(stream_chunks(body, content, delay), media_type="text/event-stream")
+
+	await asyncio.sleep(delay)
+	return {
+		"id": "chatcmpl-fake",
+		"object": "chat.completion",
+		"created": int(time.time()),
+		"model": body.get("model", "gpt-4o"),
+		"choices": [
+			{
+				"index": 0,
+				"message": {"role": "assistant", "content": content},
+				"finish_reason": "stop",
+			}
+		],
+		"usage": fake_usage(body, content),
+	}
+
+
+# Roughly four characters per token, like the real tokenizer on English text
+def fake_usage(body, content):
+	prompt_tokens = sum(len(message["content"]) // 4 for message in body["messages"])
+	completion_tokens = len(content) // 4
+	return {
+		"prompt_tokens": prompt_tokens,
+		"completion_tokens": completion_tokens,
+		"total_tokens": prompt_tokens + completion_tokens,
+	}
+
+
+# Spread the configured delay over the chunks so the first token arrives early
+async def stream_chunks(body, content, delay):
+	pieces = [content[index:index + STREAM_CHUNK_SIZE] for index in range(0, len(content), STREAM_CHUNK_SIZE)]
+	for piece in pieces:
+		await asyncio.sleep(delay / len(pieces))
+		chunk = {
+			"id": "chatcmpl-fake",
+			"object": "chat.completion.chunk",
+			"created": int(time.time()),
+			"model": body.get("model", "gpt-4o"),
+			"choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+		}
+		yield f"data: {json.dumps(chunk)}\n\n"
+	if (body.get("stream_options") or {}).get("include_usage"):
+		chunk = {
+			"id": "chatcmpl-fake",
+			"object": "chat.completion.chunk",
+			"created": int(time.time()),
+			"model": body.get("model", "gpt-4o"),
+			"choices": [],
+			"usage": fake_usage(body, content),
+		}
+		yield f"data: {json.dumps(chunk)}\n\n"
+	yield "data: [DONE]\n\n"
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Fake OpenAI compatible completion server")
+	parser.add_argument("--port", type=int, default=9100)
+	parser.add_argument("--delay", type=float, default=0.5)
+	for fault in FAULTS:
+		parser.add_argument(f"--{fault.replace('_', '-')}", type=float, default=0.0, help=f"rate of {fault} faults")
+	args = parser.parse_args()
+	app.state.delay = args.delay
+	app.state.faults = {fault: getattr(args, fault) for fault in FAULTS}
+	uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
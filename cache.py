@@ -0,0 +1,140 @@
+import copy
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import db
+
+CREATE_CACHE = """
+	CREATE TABLE IF NOT EXISTS llm_cache (
+		key TEXT PRIMARY KEY,
+		value TEXT NOT NULL,
+		expires_at REAL NOT NULL,
+		accessed_at REAL NOT NULL
+	)
+"""
+GET_ENTRY = "SELECT value, expires_at FROM llm_cache WHERE key = ?"
+TOUCH_ENTRY = "UPDATE llm_cache SET accessed_at = ? WHERE key = ?"
+PUT_ENTRY = "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)"
+DELETE_ENTRY = "DELETE FROM llm_cache WHERE key = ?"
+DELETE_EXPIRED = "DELETE FROM llm_cache WHERE expires_at <= ?"
+COUNT_ENTRIES = "SELECT COUNT(*) FROM llm_cache"
+# Drop the least recently used rows beyond the size cap
+TRIM_ENTRIES = """
+	DELETE FROM llm_cache WHERE key IN (
+		SELECT key FROM llm_cache ORDER BY accessed_at LIMIT ?
+	)
+"""
+
+
+# Content address of a model request: the model plus every message, so any prompt change is a new key
+def make_key(model, messages):
+	payload = json.dumps([model, messages], sort_keys=True, separators=(",", ":"))
+	return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# Two tier cache of parsed model responses: an in-memory LRU and an optional SQLite file
+class ResponseCache:
+	def __init__(self, max_entries, ttl, disk_path=None, disk_max_entries=10000):
+		self.max_entries = max_entries
+		self.ttl = ttl
+		self.disk_max_entries = disk_max_entries
+		self.entries = OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.disk_hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.disk_writes = 0
+
+		self.disk_path = disk_path
+		self.disk = None
+
+	# Open the SQLite tier, if there is one; until then only the memory tier is used
+	def open(self):
+		if self.disk_path and self.disk is None:
+			disk = db.connect(self.disk_path)
+			with disk:
+				disk.execute(CREATE_CACHE)
+				disk.execute(DELETE_EXPIRED, (time.time(),))
+			self.disk = disk
+
+	# Return a copy of the cached value or None when the key is missing or expired
+	def get(self, key):
+		now = time.time()
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is not None:
+				expires_at, value = entry
+				if expires_at > now:
+					self.entries.move_to_end(key)
+					self.hits += 1
+					return copy.deepcopy(value)
+				del self.entries[key]
+
+			if self.disk is not None:
+				row = self.disk.execute(GET_ENTRY, (key,)).fetchone()
+				if row is not None and row["expires_at"] > now:
+					with self.disk:
+						self.disk.execute(TOUCH_ENTRY, (now, key))
+					value = json.loads(row["value"])
+					self._remember(key, row["expires_at"], value)
+					self.disk_hits += 1
+					return copy.deepcopy(value)
+				if row is not None:
+					with self.disk:
+						self.disk.execute(DELETE_ENTRY, (key,))
+
+			self.misses += 1
+			return None
+
+	def set(self, key, value):
+		expires_at = time.time() + self.ttl
+		with self.lock:
+			self._remember(key, expires_at, copy.deepcopy(value))
+			if self.disk is not None:
+				with self.disk:
+					self.disk.execute(PUT_ENTRY, (key, json.dumps(value), expires_at, time.time()))
+				self.disk_writes += 1
+				# Checking the row count on every write is wasteful, so trim in batches
+				if self.disk_writes % 100 == 0:
+					self._trim_disk()
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+			if self.disk is not None:
+				with self.disk:
+					self.disk.execute("DELETE FROM llm_cache")
+
+	def stats(self):
+		with self.lock:
+			lookups = self.hits + self.disk_hits + self.misses
+			return {
+				"hits": self.hits,
+				"disk_hits": self.disk_hits,
+				"misses": self.misses,
+				"hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+				"evictions": self.evictions,
+				"entries": len(self.entries),
+				"max_entries": self.max_entries,
+				"ttl": self.ttl,
+				"disk_enabled": self.disk is not None,
+			}
+
+	# Store in the memory tier and evict the least recently used entries over the cap
+	def _remember(self, key, expires_at, value):
+		self.entries[key] = (expires_at, value)
+		self.entries.move_to_end(key)
+		while len(self.entries) > self.max_entries:
+			self.entries.popitem(last=False)
+			self.evictions += 1
+
+	def _trim_disk(self):
+		with self.disk:
+			self.disk.execute(DELETE_EXPIRED, (time.time(),))
+			count = self.disk.execute(COUNT_ENTRIES).fetchone()[0]
+			if count > self.disk_max_entries:
+				self.disk.execute(TRIM_ENTRIES, (count - self.disk_max_entries,))
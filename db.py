@@ -0,0 +1,896 @@
+import json
+import time
+import sqlite3
+import threading
+
+import metrics
+import settings
+import versions
+
+# Pragmas applied to every new connection: WAL lets readers run alongside a writer and
+# NORMAL sync is durable enough under WAL while avoiding an fsync on every commit
+PRAGMAS = (
+	"PRAGMA journal_mode = WAL",
+	"PRAGMA synchronous = NORMAL",
+	"PRAGMA busy_timeout = 5000",
+	"PRAGMA cache_size = -16000",
+	"PRAGMA temp_store = MEMORY",
+	"PRAGMA mmap_size = 134217728",
+)
+
+# SQL statements are kept as constants so the per-connection statement cache reuses the prepared statement
+CREATE_SNIPPETS = """
+	CREATE TABLE IF NOT EXISTS snippets (
+		id TEXT PRIMARY KEY,
+		name TEXT DEFAULT "",
+		code TEXT DEFAULT "",
+		tests TEXT DEFAULT "",
+		coding_language TEXT DEFAULT "",
+		communication_language TEXT DEFAULT ""
+	)
+"""
+CREATE_TEST_RUNS = """
+	CREATE TABLE IF NOT EXISTS test_runs (
+		id INTEGER PRIMARY KEY AUTOINCREMENT,
+		snippet_id TEXT NOT NULL,
+		created_at REAL NOT NULL,
+		status INTEGER NOT NULL,
+		duration_ms REAL NOT NULL,
+		results TEXT NOT NULL
+	)
+"""
+CREATE_TEST_RUNS_INDEX = "CREATE INDEX IF NOT EXISTS test_runs_snippet ON test_runs (snippet_id, id)"
+# Code and tests revisions; body is a compressed full snapshot or a delta against the previous version
+CREATE_SNIPPET_VERSIONS = """
+	CREATE TABLE IF NOT EXISTS snippet_versions (
+		snippet_id TEXT NOT NULL,
+		version INTEGER NOT NULL,
+		created_at REAL NOT NULL,
+		source TEXT NOT NULL,
+		prompt_tokens INTEGER NOT NULL DEFAULT 0,
+		completion_tokens INTEGER NOT NULL DEFAULT 0,
+		full INTEGER NOT NULL,
+		body BLOB NOT NULL,
+		PRIMARY KEY (snippet_id, version)
+	)
+"""
+CREATE_REPAIR_RUNS = """
+	CREATE TABLE IF NOT EXISTS repair_runs (
+		id INTEGER PRIMARY KEY AUTOINCREMENT,
+		snippet_id TEXT NOT NULL,
+		created_at REAL NOT NULL,
+		status INTEGER NOT NULL,
+		stop_reason TEXT NOT NULL,
+		iterations INTEGER NOT NULL,
+		duration_ms REAL NOT NULL,
+		total_tokens INTEGER NOT NULL,
+		history TEXT NOT NULL
+	)
+"""
+CREATE_REPAIR_RUNS_INDEX = "CREATE INDEX IF NOT EXISTS repair_runs_snippet ON repair_runs (snippet_id, id)"
+CREATE_JOBS = """
+	CREATE TABLE IF NOT EXISTS jobs (
+		id TEXT PRIMARY KEY,
+		snippet_id TEXT NOT NULL,
+		action TEXT NOT NULL,
+		inputs TEXT NOT NULL,
+		status TEXT NOT NULL,
+		error TEXT,
+		created_at REAL NOT NULL,
+		started_at REAL,
+		finished_at REAL
+	)
+"""
+# At most one queued or running job per snippet, action and inputs, so a retried submit joins the existing job
+CREATE_JOBS_ACTIVE_INDEX = """
+	CREATE UNIQUE INDEX IF NOT EXISTS jobs_active ON jobs (snippet_id, action, inputs)
+	WHERE status IN ('queued', 'running')
+"""
+CREATE_JOBS_SNIPPET_INDEX = "CREATE INDEX IF NOT EXISTS jobs_snippet ON jobs (snippet_id, created_at)"
+# Indexes backing the sidebar language filters
+CREATE_LANGUAGE_INDEXES = (
+	"CREATE INDEX IF NOT EXISTS snippets_coding_language ON snippets (coding_language)",
+	"CREATE INDEX IF NOT EXISTS snippets_communication_language ON snippets (communication_language)",
+)
+# Full text index over name, language and code, kept in sync with snippets by triggers.
+# It references snippets by rowid, so the index must be rebuilt if the database is ever VACUUMed.
+CREATE_SNIPPETS_FTS = """
+	CREATE VIRTUAL TABLE IF NOT EXISTS snippets_fts USING fts5(
+		name, coding_language, code, content='snippets', content_rowid='rowid'
+	)
+"""
+CREATE_SNIPPETS_FTS_TRIGGERS = (
+	"""
+	CREATE TRIGGER IF NOT EXISTS snippets_fts_insert AFTER INSERT ON snippets BEGIN
+		INSERT INTO snippets_fts (rowid, name, coding_language, code)
+		VALUES (new.rowid, new.name, new.coding_language, new.code);
+	END
+	""",
+	"""
+	CREATE TRIGGER IF NOT EXISTS snippets_fts_delete AFTER DELETE ON snippets BEGIN
+		INSERT INTO snippets_fts (snippets_fts, rowid, name, coding_language, code)
+		VALUES ('delete', old.rowid, old.name, old.coding_language, old.code);
+	END
+	""",
+	"""
+	CREATE TRIGGER IF NOT EXISTS snippets_fts_update AFTER UPDATE OF name, coding_language, code ON snippets BEGIN
+		INSERT INTO snippets_fts (snippets_fts, rowid, name, coding_language, code)
+		VALUES ('delete', old.rowid, old.name, old.coding_language, old.code);
+		INSERT INTO snippets_fts (rowid, name, coding_language, code)
+		VALUES (new.rowid, new.name, new.coding_language, new.code);
+	END
+	""",
+)
+# Code generation prompts of the snippets, for finding near duplicates of new ones
+CREATE_SNIPPET_PROMPTS = """
+	CREATE TABLE IF NOT EXISTS snippet_prompts (
+		snippet_id TEXT PRIMARY KEY,
+		prompt TEXT NOT NULL,
+		created_at REAL NOT NULL
+	)
+"""
+CREATE_SNIPPET_PROMPTS_INDEX = "CREATE INDEX IF NOT EXISTS snippet_prompts_created ON snippet_prompts (created_at)"
+# Who snippets and jobs belong to; rows from before users existed keep an empty owner
+ADD_SNIPPETS_OWNER = "ALTER TABLE snippets ADD COLUMN owner TEXT NOT NULL DEFAULT ''"
+ADD_JOBS_OWNER = "ALTER TABLE jobs ADD COLUMN owner TEXT NOT NULL DEFAULT ''"
+CREATE_SNIPPETS_OWNER_INDEX = "CREATE INDEX IF NOT EXISTS snippets_owner ON snippets (owner)"
+# The process running a job and until when its claim holds; renewed while the job runs
+ADD_JOBS_LEASE_OWNER = "ALTER TABLE jobs ADD COLUMN lease_owner TEXT"
+ADD_JOBS_LEASE_EXPIRES = "ALTER TABLE jobs ADD COLUMN lease_expires REAL"
+CREATE_JOBS_STATUS_INDEX = "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, snippet_id)"
+# Inline jobs are the actions requests run themselves once it is their turn in the snippet's lane.
+# Workers never claim them, and they are not shared with identical jobs
+ADD_JOBS_INLINE = "ALTER TABLE jobs ADD COLUMN inline INTEGER NOT NULL DEFAULT 0"
+DROP_JOBS_ACTIVE_INDEX = "DROP INDEX IF EXISTS jobs_active"
+CREATE_JOBS_QUEUED_ACTIVE_INDEX = """
+	CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_queued ON jobs (snippet_id, action, inputs)
+	WHERE status IN ('queued', 'running') AND inline = 0
+"""
+CREATE_USERS = """
+	CREATE TABLE IF NOT EXISTS users (
+		id TEXT PRIMARY KEY,
+		name TEXT NOT NULL,
+		created_at REAL NOT NULL
+	)
+"""
+# Sessions are looked up by a hash of their token, so the table never holds a usable token
+CREATE_SESSIONS = """
+	CREATE TABLE IF NOT EXISTS sessions (
+		token_hash TEXT PRIMARY KEY,
+		user_id TEXT NOT NULL,
+		created_at REAL NOT NULL,
+		expires_at REAL NOT NULL
+	)
+"""
+CREATE_SESSIONS_EXPIRY_INDEX = "CREATE INDEX IF NOT EXISTS sessions_expiry ON sessions (expires_at)"
+REBUILD_SNIPPETS_FTS = "INSERT INTO snippets_fts (snippets_fts) VALUES ('rebuild')"
+GET_SCHEMA_VERSION = "PRAGMA user_version"
+# Distinct values of an indexed language column, found by jumping through the index one value
+# at a time instead of scanning every row
+LIST_LANGUAGES = """
+	WITH RECURSIVE languages (value) AS (
+		SELECT MIN({column}) FROM snippets WHERE {column} > ''
+		UNION ALL
+		SELECT (SELECT MIN({column}) FROM snippets WHERE {column} > value) FROM languages WHERE value IS NOT NULL
+	)
+	SELECT value FROM languages WHERE value IS NOT NULL
+"""
+LIST_CODING_LANGUAGES = LIST_LANGUAGES.format(column="coding_language")
+LIST_COMMUNICATION_LANGUAGES = LIST_LANGUAGES.format(column="communication_language")
+GET_SNIPPET = """
+	SELECT id, name, code, tests, coding_language, communication_language, owner,
+		code != '' AS code_value, tests != '' AS tests_value
+	FROM snippets WHERE id = ?
+"""
+INSERT_SNIPPET = "INSERT INTO snippets (id, name, owner) VALUES (?, ?, ?)"
+DELETE_SNIPPET = "DELETE FROM snippets WHERE id = ?"
+DELETE_TEST_RUNS = "DELETE FROM test_runs WHERE snippet_id = ?"
+DELETE_REPAIR_RUNS = "DELETE FROM repair_runs WHERE snippet_id = ?"
+DELETE_SNIPPET_VERSIONS = "DELETE FROM snippet_versions WHERE snippet_id = ?"
+DELETE_SNIPPET_PROMPT = "DELETE FROM snippet_prompts WHERE snippet_id = ?"
+GET_SNIPPET_TEXTS = "SELECT code, tests FROM snippets WHERE id = ?"
+LATEST_VERSION = "SELECT MAX(version) FROM snippet_versions WHERE snippet_id = ?"
+INSERT_SNIPPET_VERSION = """
+	INSERT INTO snippet_versions (snippet_id, version, created_at, source, prompt_tokens, completion_tokens, full, body)
+	VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+# The bodies needed to rebuild a version: the nearest full snapshot at or before it and every delta after that
+GET_VERSION_CHAIN = """
+	SELECT full, body FROM snippet_versions
+	WHERE snippet_id = ?1 AND version <= ?2 AND version >= (
+		SELECT MAX(version) FROM snippet_versions WHERE snippet_id = ?1 AND version <= ?2 AND full
+	)
+	ORDER BY version
+"""
+LIST_SNIPPET_VERSIONS = """
+	SELECT version, created_at, source, prompt_tokens, completion_tokens, full, length(body) AS size
+	FROM snippet_versions WHERE snippet_id = ? ORDER BY version DESC LIMIT ?
+"""
+GET_SNIPPET_VERSION = """
+	SELECT version, created_at, source, prompt_tokens, completion_tokens, full, length(body) AS size
+	FROM snippet_versions WHERE snippet_id = ? AND version = ?
+"""
+INSERT_REPAIR_RUN = """
+	INSERT INTO repair_runs (snippet_id, created_at, status, stop_reason, iterations, duration_ms, total_tokens, history)
+	VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+LIST_REPAIR_RUNS = "SELECT * FROM repair_runs WHERE snippet_id = ? ORDER BY id DESC LIMIT ?"
+INSERT_JOB = """
+	INSERT OR IGNORE INTO jobs (id, snippet_id, action, inputs, status, created_at, owner)
+	VALUES (?, ?, ?, ?, 'queued', ?, ?)
+"""
+GET_ACTIVE_JOB = """
+	SELECT * FROM jobs
+	WHERE snippet_id = ? AND action = ? AND inputs = ? AND status IN ('queued', 'running') AND inline = 0
+"""
+# An inline job waits in the queue under its request's lease until it is its turn
+INSERT_INLINE_JOB = """
+	INSERT INTO jobs (id, snippet_id, action, inputs, status, created_at, owner, inline, lease_owner, lease_expires)
+	VALUES (?, ?, ?, ?, 'queued', ?, ?, 1, ?, ?)
+"""
+GET_JOB = "SELECT * FROM jobs WHERE id = ?"
+LIST_JOBS = "SELECT * FROM jobs WHERE snippet_id = ? ORDER BY created_at DESC LIMIT ?"
+# The oldest queued job whose snippet has no job running and no older job queued, so each
+# snippet's jobs run one at a time in submission order whichever process claims them
+CLAIM_JOB = """
+	UPDATE jobs SET status = 'running', started_at = ?1, lease_owner = ?2, lease_expires = ?3
+	WHERE id = (
+		SELECT queued.id FROM jobs AS queued
+		WHERE queued.status = 'queued' AND queued.inline = 0
+		AND NOT EXISTS (
+			SELECT 1 FROM jobs AS running WHERE running.status = 'running' AND running.snippet_id = queued.snippet_id
+		)
+		AND NOT EXISTS (
+			SELECT 1 FROM jobs AS earlier
+			WHERE earlier.status = 'queued' AND earlier.snippet_id = queued.snippet_id AND earlier.rowid < queued.rowid
+		)
+		ORDER BY queued.rowid LIMIT 1
+	)
+	RETURNING *
+"""
+# The same job when it is its turn in the snippet's lane
+CLAIM_INLINE_JOB = """
+	UPDATE jobs SET status = 'running', started_at = ?1, lease_expires = ?3
+	WHERE id = ?4 AND status = 'queued' AND lease_owner = ?2
+	AND NOT EXISTS (SELECT 1 FROM jobs AS running WHERE running.status = 'running' AND running.snippet_id = jobs.snippet_id)
+	AND NOT EXISTS (
+		SELECT 1 FROM jobs AS earlier
+		WHERE earlier.status = 'queued' AND earlier.snippet_id = jobs.snippet_id AND earlier.rowid < jobs.rowid
+	)
+	RETURNING *
+"""
+RENEW_JOB_LEASES = """
+	UPDATE jobs SET lease_expires = ? WHERE lease_owner = ? AND status IN ('queued', 'running') RETURNING id
+"""
+# Jobs whose process stopped renewing their lease; jobs from before leases existed have none
+REQUEUE_EXPIRED_JOBS = """
+	UPDATE jobs SET status = 'queued', started_at = NULL, lease_owner = NULL, lease_expires = NULL
+	WHERE status = 'running' AND inline = 0 AND (lease_expires IS NULL OR lease_expires < ?)
+"""
+# Inline jobs whose process stopped renewing their lease; nobody is waiting for them any more
+FAIL_EXPIRED_INLINE_JOBS = """
+	UPDATE jobs SET status = 'failed', error = 'The request running it stopped', finished_at = ?1
+	WHERE status IN ('queued', 'running') AND inline = 1 AND lease_expires < ?1
+"""
+RELEASE_JOBS = """
+	UPDATE jobs SET status = 'queued', started_at = NULL, lease_owner = NULL, lease_expires = NULL
+	WHERE status = 'running' AND inline = 0 AND lease_owner = ?
+"""
+COUNT_QUEUED_JOBS = "SELECT count(*) FROM jobs WHERE status = 'queued'"
+FINISH_JOB = "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ? AND status IN ('queued', 'running')"
+FINISH_LEASED_JOB = """
+	UPDATE jobs SET status = ?, error = ?, finished_at = ?
+	WHERE id = ? AND status IN ('queued', 'running') AND lease_owner = ?
+"""
+SAVE_SNIPPET_PROMPT = "INSERT OR REPLACE INTO snippet_prompts (snippet_id, prompt, created_at) VALUES (?, ?, ?)"
+# The most recent prompts, returned oldest first
+LIST_SNIPPET_PROMPTS = """
+	SELECT snippet_id, prompt FROM (
+		SELECT snippet_id, prompt, created_at FROM snippet_prompts ORDER BY created_at DESC LIMIT ?
+	) ORDER BY created_at
+"""
+# Bulk export reads snippets in insertion order, all of them when the owner is NULL, and the
+# version rows of a chunk of them at once, their ids given as a JSON list
+EXPORT_SNIPPETS = """
+	SELECT s.rowid AS cursor, s.id, s.name, s.code, s.tests, s.coding_language, s.communication_language, p.prompt
+	FROM snippets s LEFT JOIN snippet_prompts p ON p.snippet_id = s.id
+	WHERE s.rowid > ?1 AND (?2 IS NULL OR s.owner IN (?2, '')) ORDER BY s.rowid LIMIT ?3
+"""
+EXPORT_SNIPPET_VERSIONS = """
+	SELECT snippet_id, version, created_at, source, prompt_tokens, completion_tokens, full, body
+	FROM snippet_versions WHERE snippet_id IN (SELECT value FROM json_each(?)) ORDER BY snippet_id, version
+"""
+EXISTING_SNIPPET_IDS = "SELECT id FROM snippets WHERE id IN (SELECT value FROM json_each(?))"
+IMPORT_SNIPPET = """
+	INSERT INTO snippets (id, name, code, tests, coding_language, communication_language, owner)
+	VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+INSERT_USER = "INSERT INTO users (id, name, created_at) VALUES (?, ?, ?)"
+GET_USER = "SELECT id, name, created_at FROM users WHERE id = ?"
+INSERT_SESSION = "INSERT INTO sessions (token_hash, user_id, created_at, expires_at) VALUES (?, ?, ?, ?)"
+GET_SESSION = """
+	SELECT u.id, u.name FROM sessions s JOIN users u ON u.id = s.user_id
+	WHERE s.token_hash = ? AND s.expires_at > ?
+"""
+DELETE_SESSION = "DELETE FROM sessions WHERE token_hash = ?"
+DELETE_EXPIRED_SESSIONS = "DELETE FROM sessions WHERE expires_at <= ?"
+INSERT_TEST_RUN = """
+	INSERT INTO test_runs (snippet_id, created_at, status, duration_ms, results)
+	VALUES (?, ?, ?, ?, ?)
+"""
+
+# Columns handlers are allowed to update through update_snippet
+UPDATABLE_COLUMNS = ("name", "coding_language", "communication_language", "code", "tests")
+
+_local = threading.local()
+
+
+# Open a new connection with the tuned pragmas and a row factory that supports index and name access
+def connect(path=None):
+	conn = sqlite3.connect(
+		path or settings.DATABASE_PATH, check_same_thread=False, cached_statements=256
+	)
+	conn.row_factory = sqlite3.Row
+	for pragma in PRAGMAS:
+		conn.execute(pragma)
+	return conn
+
+
+# Return the connection owned by the calling thread, opening it on first use
+def get_connection():
+	conn = getattr(_local, "conn", None)
+	if conn is None:
+		conn = connect()
+		_local.conn = conn
+	return conn
+
+
+# Close the calling thread's connection if it has one
+def close_connection():
+	conn = getattr(_local, "conn", None)
+	if conn is not None:
+		conn.close()
+		_local.conn = None
+
+
+# Schema bring up, one migration at a time, each a sequence of statements.
+# PRAGMA user_version records how many a database has had applied
+MIGRATIONS = (
+	# 1: the schema as it was when migrations were introduced. Every statement is idempotent, so
+	# databases created before then are brought to version 1 too, indexing their existing rows for search
+	(
+		CREATE_SNIPPETS,
+		CREATE_TEST_RUNS,
+		CREATE_TEST_RUNS_INDEX,
+		CREATE_SNIPPET_VERSIONS,
+		CREATE_REPAIR_RUNS,
+		CREATE_REPAIR_RUNS_INDEX,
+		CREATE_JOBS,
+		CREATE_JOBS_ACTIVE_INDEX,
+		CREATE_JOBS_SNIPPET_INDEX,
+		*CREATE_LANGUAGE_INDEXES,
+		CREATE_SNIPPETS_FTS,
+		REBUILD_SNIPPETS_FTS,
+		*CREATE_SNIPPETS_FTS_TRIGGERS,
+	),
+	# 2: the prompts code was generated from
+	(
+		CREATE_SNIPPET_PROMPTS,
+		CREATE_SNIPPET_PROMPTS_INDEX,
+	),
+	# 3: users, their sessions and the owners of snippets and jobs
+	(
+		ADD_SNIPPETS_OWNER,
+		ADD_JOBS_OWNER,
+		CREATE_SNIPPETS_OWNER_INDEX,
+		CREATE_USERS,
+		CREATE_SESSIONS,
+		CREATE_SESSIONS_EXPIRY_INDEX,
+	),
+	# 4: job leases, so several server processes share one queue
+	(
+		ADD_JOBS_LEASE_OWNER,
+		ADD_JOBS_LEASE_EXPIRES,
+		CREATE_JOBS_STATUS_INDEX,
+	),
+	# 5: inline jobs, so requests running an action wait for their turn in the snippet's lane
+	(
+		ADD_JOBS_INLINE,
+		DROP_JOBS_ACTIVE_INDEX,
+		CREATE_JOBS_QUEUED_ACTIVE_INDEX,
+	),
+)
+
+
+# Apply the migrations the database is missing, all in one transaction, and return how many ran.
+# The write lock is taken before the version is read again, so when several workers start
+# together one migrates and the others wait and find nothing left to do
+def migrate():
+	conn = get_connection()
+	if conn.execute(GET_SCHEMA_VERSION).fetchone()[0] >= len(MIGRATIONS):
+		return 0
+
+	conn.execute("BEGIN IMMEDIATE")
+	try:
+		version = conn.execute(GET_SCHEMA_VERSION).fetchone()[0]
+		for number in range(version, len(MIGRATIONS)):
+			for statement in MIGRATIONS[number]:
+				conn.execute(statement)
+			conn.execute(f"PRAGMA user_version = {number + 1}")
+	except BaseException:
+		conn.rollback()
+		raise
+	conn.commit()
+	return max(len(MIGRATIONS) - version, 0)
+
+
+# Turn free text into an FTS5 query matching every word as a prefix
+def fts_query(text):
+	words = text.replace('"', " ").split()
+	return " ".join(f'"{word}"*' for word in words)
+
+
+# Fetch one page of the sidebar listing in insertion order using the rowid as the keyset cursor.
+# Given an owner, only their snippets and those without an owner are listed.
+# Returns the rows and the cursor of the next page, or None on the last page
+@metrics.db_timed
+def list_snippets(after=0, limit=None, query="", coding_language="", communication_language="", owner=None):
+	limit = limit or settings.SNIPPETS_PAGE_SIZE
+	conditions = ["s.rowid > ?"]
+	values = [after]
+	if owner is not None:
+		conditions.append("s.owner IN (?, '')")
+		values.append(owner)
+	if coding_language:
+		conditions.append("s.coding_language = ?")
+		values.append(coding_language)
+	if communication_language:
+		conditions.append("s.communication_language = ?")
+		values.append(communication_language)
+
+	source = "snippets s"
+	match = fts_query(query)
+	if match:
+		source = "snippets_fts JOIN snippets s ON s.rowid = snippets_fts.rowid"
+		conditions.append("snippets_fts MATCH ?")
+		values.append(match)
+
+	rows = get_connection().execute(
+		f"""
+		SELECT s.rowid AS cursor, s.id, s.name, s.coding_language, s.communication_language
+		FROM {source} WHERE {" AND ".join(conditions)} ORDER BY s.rowid LIMIT ?
+		""",
+		(*values, limit + 1),
+	).fetchall()
+	if len(rows) > limit:
+		return rows[:limit], rows[limit - 1]["cursor"]
+	return rows, None
+
+
+# Fetch the distinct coding and communication languages for the sidebar filters
+@metrics.db_timed
+def list_languages():
+	conn = get_connection()
+	coding = [row[0] for row in conn.execute(LIST_CODING_LANGUAGES)]
+	communication = [row[0] for row in conn.execute(LIST_COMMUNICATION_LANGUAGES)]
+	return coding, communication
+
+
+# Fetch a snippet together with its code and tests status flags in a single query
+@metrics.db_timed
+def get_snippet(snippet_id):
+	return get_connection().execute(GET_SNIPPET, (snippet_id,)).fetchone()
+
+
+@metrics.db_timed
+def create_snippet(snippet_id, name, owner=""):
+	conn = get_connection()
+	with conn:
+		conn.execute(INSERT_SNIPPET, (snippet_id, name, owner))
+
+
+# Create many empty snippets from (snippet_id, name, owner) rows in one transaction
+@metrics.db_timed
+def create_snippets(rows):
+	conn = get_connection()
+	with conn:
+		conn.executemany(INSERT_SNIPPET, rows)
+
+
+@metrics.db_timed
+def delete_snippet(snippet_id):
+	conn = get_connection()
+	with conn:
+		conn.execute(DELETE_SNIPPET, (snippet_id,))
+		conn.execute(DELETE_TEST_RUNS, (snippet_id,))
+		conn.execute(DELETE_REPAIR_RUNS, (snippet_id,))
+		conn.execute(DELETE_SNIPPET_VERSIONS, (snippet_id,))
+		conn.execute(DELETE_SNIPPET_PROMPT, (snippet_id,))
+
+
+# Record the prompts snippets' code was generated from, as (snippet_id, prompt) pairs
+@metrics.db_timed
+def save_prompts(rows):
+	conn = get_connection()
+	now = time.time()
+	with conn:
+		conn.executemany(SAVE_SNIPPET_PROMPT, [(snippet_id, prompt, now) for snippet_id, prompt in rows])
+
+
+# Fetch the (snippet_id, prompt) pairs of the most recent prompts, oldest first
+@metrics.db_timed
+def list_prompts(limit):
+	return [tuple(row) for row in get_connection().execute(LIST_SNIPPET_PROMPTS, (limit,))]
+
+
+# Update the given columns of a snippet in one statement
+@metrics.db_timed
+def update_snippet(snippet_id, **fields):
+	conn = get_connection()
+	with conn:
+		_update_snippet(conn, snippet_id, fields)
+
+
+def _update_snippet(conn, snippet_id, fields):
+	columns = [column for column in UPDATABLE_COLUMNS if column in fields]
+	unknown = set(fields) - set(columns)
+	if unknown:
+		raise ValueError(f"Unknown snippet columns: {', '.join(sorted(unknown))}")
+	if not columns:
+		return
+
+	assignments = ", ".join(f"{column} = ?" for column in columns)
+	values = [fields[column] for column in columns]
+	conn.execute(f"UPDATE snippets SET {assignments} WHERE id = ?", (*values, snippet_id))
+
+
+# Store the outcome of a local test run for a snippet
+@metrics.db_timed
+def record_test_run(snippet_id, result):
+	conn = get_connection()
+	with conn:
+		_insert_test_run(conn, snippet_id, result)
+
+
+def _insert_test_run(conn, snippet_id, result):
+	conn.execute(
+		INSERT_TEST_RUN,
+		(snippet_id, time.time(), int(result["status"]), result["duration_ms"], json.dumps(result)),
+	)
+
+
+# Store the final state of a repair loop in one transaction: the changed snippet columns,
+# the last local test run if there was one and the run's per iteration history
+@metrics.db_timed
+def record_repair_run(snippet_id, fields, test_run, result):
+	conn = get_connection()
+	with conn:
+		_record_version(conn, snippet_id, fields, "repair", result["usage"])
+		_update_snippet(conn, snippet_id, fields)
+		if test_run is not None:
+			_insert_test_run(conn, snippet_id, test_run)
+		conn.execute(
+			INSERT_REPAIR_RUN,
+			(
+				snippet_id,
+				time.time(),
+				int(result["status"]),
+				result["stop_reason"],
+				result["iterations"],
+				result["duration_ms"],
+				result["usage"].get("total_tokens", 0),
+				json.dumps(result["history"]),
+			),
+		)
+
+
+@metrics.db_timed
+def list_repair_runs(snippet_id, limit=20):
+	return get_connection().execute(LIST_REPAIR_RUNS, (snippet_id, limit)).fetchall()
+
+
+# Queue a job unless an identical one is already queued or running.
+# Returns the job row and whether it was newly created
+@metrics.db_timed
+def create_job(job_id, snippet_id, action, inputs, owner=""):
+	inputs = json.dumps(inputs)
+	conn = get_connection()
+	with conn:
+		created = conn.execute(INSERT_JOB, (job_id, snippet_id, action, inputs, time.time(), owner)).rowcount == 1
+		job = conn.execute(GET_ACTIVE_JOB, (snippet_id, action, inputs)).fetchone()
+	return job, created
+
+
+@metrics.db_timed
+def get_job(job_id):
+	return get_connection().execute(GET_JOB, (job_id,)).fetchone()
+
+
+@metrics.db_timed
+def list_jobs(snippet_id, limit=20):
+	return get_connection().execute(LIST_JOBS, (snippet_id, limit)).fetchall()
+
+
+# Mark the next job that may run as running under a lease held by owner and return it, or None
+@metrics.db_timed
+def claim_job(owner, lease_seconds):
+	conn = get_connection()
+	now = time.time()
+	# The write lock is taken first, so the job picked is still queued when it is marked
+	conn.execute("BEGIN IMMEDIATE")
+	try:
+		rows = conn.execute(CLAIM_JOB, (now, owner, now + lease_seconds)).fetchall()
+	except BaseException:
+		conn.rollback()
+		raise
+	conn.commit()
+	return rows[0] if rows else None
+
+
+# Add an inline job for a request of this process and start it if it is the snippet's turn.
+# Returns the job row, queued or running
+@metrics.db_timed
+def create_inline_job(job_id, snippet_id, action, inputs, owner, lease_owner, lease_seconds):
+	conn = get_connection()
+	now = time.time()
+	conn.execute("BEGIN IMMEDIATE")
+	try:
+		conn.execute(
+			INSERT_INLINE_JOB,
+			(job_id, snippet_id, action, json.dumps(inputs), now, owner, lease_owner, now + lease_seconds),
+		)
+		rows = conn.execute(CLAIM_INLINE_JOB, (now, lease_owner, now + lease_seconds, job_id)).fetchall()
+	except BaseException:
+		conn.rollback()
+		raise
+	conn.commit()
+	return rows[0] if rows else get_job(job_id)
+
+
+# Start an inline job of owner's if it is the snippet's turn; returns the running job or None
+@metrics.db_timed
+def claim_inline_job(job_id, owner, lease_seconds):
+	conn = get_connection()
+	now = time.time()
+	# As in claim_job, so the lane is still free when the job is marked
+	conn.execute("BEGIN IMMEDIATE")
+	try:
+		rows = conn.execute(CLAIM_INLINE_JOB, (now, owner, now + lease_seconds, job_id)).fetchall()
+	except BaseException:
+		conn.rollback()
+		raise
+	conn.commit()
+	return rows[0] if rows else None
+
+
+# Extend the leases of owner's queued inline and running jobs and return the ids of those it still holds
+@metrics.db_timed
+def renew_job_leases(owner, lease_seconds):
+	conn = get_connection()
+	with conn:
+		return {row["id"] for row in conn.execute(RENEW_JOB_LEASES, (time.time() + lease_seconds, owner)).fetchall()}
+
+
+# Put running jobs whose lease ran out back in the queue and fail inline ones,
+# returning how many lanes may have been freed
+@metrics.db_timed
+def requeue_expired_jobs():
+	conn = get_connection()
+	now = time.time()
+	with conn:
+		requeued = conn.execute(REQUEUE_EXPIRED_JOBS, (now,)).rowcount
+		return requeued + conn.execute(FAIL_EXPIRED_INLINE_JOBS, (now,)).rowcount
+
+
+# Put owner's running jobs back in the queue when it stops
+@metrics.db_timed
+def release_jobs(owner):
+	conn = get_connection()
+	with conn:
+		conn.execute(RELEASE_JOBS, (owner,))
+
+
+@metrics.db_timed
+def count_queued_jobs():
+	return get_connection().execute(COUNT_QUEUED_JOBS).fetchone()[0]
+
+
+# Record the final status of a job that is still queued or running, returning False if it had already
+# finished. With an owner, only a job still running under that owner's lease is finished
+@metrics.db_timed
+def finish_job(job_id, status, error=None, owner=None):
+	conn = get_connection()
+	with conn:
+		if owner is not None:
+			return conn.execute(FINISH_LEASED_JOB, (status, error, time.time(), job_id, owner)).rowcount == 1
+		return conn.execute(FINISH_JOB, (status, error, time.time(), job_id)).rowcount == 1
+
+
+# Update a snippet with a model's result and record the code and tests revision it produced,
+# with the endpoint that produced it and the tokens it cost, in one transaction
+@metrics.db_timed
+def save_revision(snippet_id, fields, source, usage=None):
+	conn = get_connection()
+	with conn:
+		_record_version(conn, snippet_id, fields, source, usage or {})
+		_update_snippet(conn, snippet_id, fields)
+
+
+# Save many (snippet_id, fields, source, usage) results with a single commit
+@metrics.db_timed
+def save_revisions(revisions):
+	conn = get_connection()
+	with conn:
+		for snippet_id, fields, source, usage in revisions:
+			_record_version(conn, snippet_id, fields, source, usage or {})
+			_update_snippet(conn, snippet_id, fields)
+
+
+# Append a version when the fields change the snippet's code or tests. Must run before the update.
+# Every VERSIONS_SNAPSHOT_EVERY versions is stored in full so a rebuild never replays more deltas than that
+def _record_version(conn, snippet_id, fields, source, usage):
+	current = conn.execute(GET_SNIPPET_TEXTS, (snippet_id,)).fetchone()
+	if current is None:
+		return
+	latest = conn.execute(LATEST_VERSION, (snippet_id,)).fetchone()[0] or 0
+	if latest:
+		previous = _version_texts(conn, snippet_id, latest)
+	else:
+		previous = {"code": current["code"], "tests": current["tests"]}
+		# Keep the text the snippet had before history was recorded so it can be restored too
+		if current["code"] or current["tests"]:
+			latest = 1
+			conn.execute(
+				INSERT_SNIPPET_VERSION,
+				(snippet_id, latest, time.time(), "initial", 0, 0, 1, versions.full_body(previous)),
+			)
+
+	texts = {column: fields.get(column, previous[column]) for column in versions.COLUMNS}
+	if texts == previous:
+		return
+	version = latest + 1
+	full = latest == 0 or (version - 1) % settings.VERSIONS_SNAPSHOT_EVERY == 0
+	body = versions.full_body(texts) if full else versions.delta_body(previous, texts)
+	conn.execute(
+		INSERT_SNIPPET_VERSION,
+		(
+			snippet_id,
+			version,
+			time.time(),
+			source,
+			usage.get("prompt_tokens", 0),
+			usage.get("completion_tokens", 0),
+			int(full),
+			body,
+		),
+	)
+
+
+def _version_texts(conn, snippet_id, version):
+	chain = conn.execute(GET_VERSION_CHAIN, (snippet_id, version)).fetchall()
+	if not chain:
+		return None
+	return versions.rebuild((row["full"], row["body"]) for row in chain)
+
+
+@metrics.db_timed
+def list_versions(snippet_id, limit=50):
+	return get_connection().execute(LIST_SNIPPET_VERSIONS, (snippet_id, limit)).fetchall()
+
+
+# Fetch a version's metadata and rebuilt code and tests, or None if it does not exist
+@metrics.db_timed
+def get_version(snippet_id, version):
+	conn = get_connection()
+	row = conn.execute(GET_SNIPPET_VERSION, (snippet_id, version)).fetchone()
+	if row is None:
+		return None
+	return {**dict(row), **_version_texts(conn, snippet_id, version)}
+
+
+# Put a version's code and tests back, recorded as a new version
+@metrics.db_timed
+def restore_version(snippet_id, version):
+	conn = get_connection()
+	with conn:
+		texts = _version_texts(conn, snippet_id, version)
+		_record_version(conn, snippet_id, texts, f"restore:{version}", {})
+		_update_snippet(conn, snippet_id, texts)
+
+
+# Create a user and a session for it in one transaction
+@metrics.db_timed
+def create_session(token_hash, user_id, name, expires_at):
+	conn = get_connection()
+	now = time.time()
+	with conn:
+		conn.execute(INSERT_USER, (user_id, name, now))
+		conn.execute(INSERT_SESSION, (token_hash, user_id, now, expires_at))
+
+
+# Fetch the user of an unexpired session, or None
+@metrics.db_timed
+def get_session(token_hash):
+	return get_connection().execute(GET_SESSION, (token_hash, time.time())).fetchone()
+
+
+@metrics.db_timed
+def get_user(user_id):
+	return get_connection().execute(GET_USER, (user_id,)).fetchone()
+
+
+@metrics.db_timed
+def delete_session(token_hash):
+	conn = get_connection()
+	with conn:
+		conn.execute(DELETE_SESSION, (token_hash,))
+
+
+# Remove expired sessions and return how many there were
+@metrics.db_timed
+def delete_expired_sessions():
+	conn = get_connection()
+	with conn:
+		return conn.execute(DELETE_EXPIRED_SESSIONS, (time.time(),)).rowcount
+
+
+# Yield (snippet row, version rows) for every snippet the owner may see, or every snippet when the
+# owner is None, in insertion order. Reads chunk_size snippets per query on a connection of its own
+# inside one read transaction, so the export is one consistent snapshot and, under WAL, never holds
+# up writers. Nothing but the current chunk is held in memory
+def export_snippets(owner=None, with_versions=True, chunk_size=None):
+	chunk_size = chunk_size or settings.TRANSFER_CHUNK_SIZE
+	conn = connect()
+	try:
+		conn.execute("BEGIN")
+		after = 0
+		while True:
+			rows = conn.execute(EXPORT_SNIPPETS, (after, owner, chunk_size)).fetchall()
+			if not rows:
+				return
+			history = {}
+			if with_versions:
+				ids = json.dumps([row["id"] for row in rows])
+				for version in conn.execute(EXPORT_SNIPPET_VERSIONS, (ids,)):
+					history.setdefault(version["snippet_id"], []).append(version)
+			for row in rows:
+				yield row, history.get(row["id"], [])
+			after = rows[-1]["cursor"]
+	finally:
+		conn.close()
+
+
+# Insert imported snippets with their version rows and prompts in one transaction, skipping those
+# whose id is already taken. Takes (snippet row, version rows, prompt) triples in IMPORT_SNIPPET and
+# INSERT_SNIPPET_VERSION column order and returns the ones inserted
+@metrics.db_timed
+def import_snippets(items):
+	conn = get_connection()
+	conn.execute("BEGIN IMMEDIATE")
+	try:
+		ids = json.dumps([snippet[0] for snippet, _, _ in items])
+		taken = {row[0] for row in conn.execute(EXISTING_SNIPPET_IDS, (ids,))}
+		items = [item for item in items if item[0][0] not in taken]
+		now = time.time()
+		conn.executemany(IMPORT_SNIPPET, [snippet for snippet, _, _ in items])
+		conn.executemany(INSERT_SNIPPET_VERSION, [row for _, rows, _ in items for row in rows])
+		conn.executemany(SAVE_SNIPPET_PROMPT, [(snippet[0], prompt, now) for snippet, _, prompt in items if prompt])
+	except BaseException:
+		conn.rollback()
+		raise
+	conn.commit()
+	return items
+
+
+# Copy the whole database to path with SQLite's online backup API. Under WAL the copy reads one
+# snapshot in a single step while writers carry on; copying a few pages per step instead would
+# restart from scratch whenever another connection wrote in between
+@metrics.db_timed
+def backup(path):
+	source = connect()
+	target = sqlite3.connect(path)
+	try:
+		source.backup(target)
+	finally:
+		target.close()
+		source.close()
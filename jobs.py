@@ -0,0 +1,245 @@
+import os
+import json
+import uuid
+import asyncio
+import contextlib
+import contextvars
+from fastapi import HTTPException
+
+import db
+import users
+import metrics
+import settings
+import services
+
+# Job states that never change again
+FINISHED = ("succeeded", "failed", "cancelled")
+
+# Seconds a watcher waits for a change before reporting the unchanged job again as a heartbeat
+WATCH_HEARTBEAT_SECONDS = 15
+
+
+# Worker pool for the model backed actions, backed by the jobs table and shared by every server
+# process. A worker claims the next job in the table under a lease that its process renews while the
+# job runs, so a job runs once however many processes there are, and a process that dies has its
+# jobs put back in the queue once their leases run out. Jobs for one snippet form a lane that runs
+# strictly in submission order and one at a time, so an improve never races a regenerate, while
+# different snippets run in parallel. Requests that run an action themselves take their turn in the
+# same lane as an inline job, so they never race a job or each other either.
+class JobQueue:
+	def __init__(self, size):
+		self.size = size
+		# Name of this process on the leases of the jobs it runs
+		self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+		# Set when a job may have become ready to run; other processes' jobs are found by polling
+		self.wakeup = asyncio.Event()
+		# Set and replaced whenever a lane may have moved on, for the inline jobs waiting their turn
+		self.freed = asyncio.Event()
+		self.running = {}
+		self.changes = {}
+		self.workers = []
+
+	# Pick up jobs whose process died, then start the workers and the lease keeper
+	async def start(self):
+		db.requeue_expired_jobs()
+		self.workers = [asyncio.create_task(self._work()) for _ in range(self.size)]
+		self.workers.append(asyncio.create_task(self._keep_leases()))
+
+	# Stop the workers and put the jobs they were running back in the queue for any process
+	async def stop(self):
+		for worker in self.workers:
+			worker.cancel()
+		await asyncio.gather(*self.workers, return_exceptions=True)
+		self.workers = []
+		db.release_jobs(self.owner)
+
+	# Queue an action for a snippet as the current user, or return the identical job that is already
+	# queued or running. Returns the job row and whether it was newly created
+	def submit(self, action, snippet_id, *inputs):
+		job, created = db.create_job(str(uuid.uuid4()), snippet_id, action, list(inputs), users.current())
+		if created:
+			self.wakeup.set()
+		return job, created
+
+	# Cancel a queued or running job and return its row, or None if there is no such job. A job
+	# running in another process stops there when that process next renews its leases
+	def cancel(self, job_id):
+		job = db.get_job(job_id)
+		if job is None or job["status"] in FINISHED:
+			return job
+
+		task = self.running.get(job_id)
+		if task is not None:
+			# A task that already finished keeps the status its worker records
+			if task.cancel():
+				self._finish(job_id, "cancelled")
+		else:
+			self._finish(job_id, "cancelled")
+		self._lane_freed()
+		return db.get_job(job_id)
+
+	# Run a request's action as an inline job, once every job and request before it on the snippet
+	# is done, and return the updated snippet row
+	async def run(self, action, snippet_id, *inputs):
+		async with self.lane(action, snippet_id, *inputs):
+			return await services.run_action(action, snippet_id, *inputs)
+
+	# Stream a request's action as an inline job, like run
+	async def stream(self, action, snippet_id, *inputs):
+		async with self.lane(action, snippet_id, *inputs):
+			async for event in services.stream_action(action, snippet_id, *inputs):
+				yield event
+
+	# Hold the snippet's lane for the body as an inline job named after the action. Waits for the jobs
+	# and requests before it, then records how the body ended. A cancel through the jobs API turns
+	# into a 409 for the request
+	@contextlib.asynccontextmanager
+	async def lane(self, action, snippet_id, *inputs):
+		job_id = str(uuid.uuid4())
+		job = db.create_inline_job(
+			job_id, snippet_id, action, list(inputs), users.current(), self.owner, settings.JOBS_LEASE_SECONDS
+		)
+		try:
+			while job["status"] == "queued":
+				freed = self.freed
+				job = db.claim_inline_job(job_id, self.owner, settings.JOBS_LEASE_SECONDS) or db.get_job(job_id)
+				if job["status"] == "queued":
+					await self._wait(freed)
+		except BaseException:
+			self._complete(job_id, "cancelled")
+			raise
+		if job["status"] != "running":
+			raise HTTPException(status_code=409, detail=f"The action was {job['status']} before it started")
+
+		self.running[job_id] = asyncio.current_task()
+		self._notify(job_id)
+		try:
+			yield
+		except asyncio.CancelledError:
+			status = db.get_job(job_id)["status"]
+			if status not in FINISHED:
+				self._complete(job_id, "cancelled")
+				raise
+			# Cancelled through the jobs API or by another process, rather than by the client going away
+			asyncio.current_task().uncancel()
+			raise HTTPException(status_code=409, detail=f"The action was {status}") from None
+		except HTTPException as error:
+			self._complete(job_id, "failed", error.detail)
+			raise
+		except Exception as error:
+			self._complete(job_id, "failed", f"{type(error).__name__}: {error}")
+			raise
+		except BaseException:
+			self._complete(job_id, "cancelled")
+			raise
+		else:
+			self._complete(job_id, "succeeded")
+		finally:
+			del self.running[job_id]
+			self._lane_freed()
+
+	# Yield the job row now and again every time its status changes, until it finishes
+	async def watch(self, job_id):
+		while True:
+			job = db.get_job(job_id)
+			yield job
+			if job is None or job["status"] in FINISHED:
+				return
+			change = self.changes.setdefault(job_id, asyncio.Event())
+			try:
+				await asyncio.wait_for(change.wait(), WATCH_HEARTBEAT_SECONDS)
+			except asyncio.TimeoutError:
+				pass
+
+	def _notify(self, job_id):
+		change = self.changes.pop(job_id, None)
+		if change is not None:
+			change.set()
+
+	def _finish(self, job_id, status, error=None):
+		if db.finish_job(job_id, status, error):
+			self._notify(job_id)
+
+	# Record how a job run here ended, unless it was cancelled or lost its lease meanwhile
+	def _complete(self, job_id, status, error=None):
+		db.finish_job(job_id, status, error, self.owner)
+		self._notify(job_id)
+
+	# The snippet's next job or request can run now
+	def _lane_freed(self):
+		self.wakeup.set()
+		freed, self.freed = self.freed, asyncio.Event()
+		freed.set()
+
+	# Wait until the event is set, or for JOBS_POLL_SECONDS to notice other processes' jobs.
+	# Not wait_for, which on 3.11 can swallow a stop that lands as the event is set
+	async def _wait(self, event):
+		waiter = asyncio.create_task(event.wait())
+		try:
+			await asyncio.wait({waiter}, timeout=settings.JOBS_POLL_SECONDS)
+		finally:
+			waiter.cancel()
+
+	async def _work(self):
+		while True:
+			self.wakeup.clear()
+			job = db.claim_job(self.owner, settings.JOBS_LEASE_SECONDS)
+			if job is None:
+				await self._wait(self.wakeup)
+				continue
+			await self._run(job)
+			self._lane_freed()
+
+	# Renew the leases of the jobs running here, stop those that were cancelled or handed to another
+	# process meanwhile, and put back in the queue the jobs of processes that stopped renewing theirs.
+	# Their inline jobs fail, as the requests waiting for them are gone
+	async def _keep_leases(self):
+		while True:
+			await asyncio.sleep(settings.JOBS_LEASE_SECONDS / 3)
+			held = db.renew_job_leases(self.owner, settings.JOBS_LEASE_SECONDS)
+			for job_id, task in list(self.running.items()):
+				if job_id not in held:
+					task.cancel()
+			if db.requeue_expired_jobs():
+				self._lane_freed()
+
+	async def _run(self, job):
+		job_id = job["id"]
+		self._notify(job_id)
+		if db.get_snippet(job["snippet_id"]) is None:
+			self._complete(job_id, "failed", "Snippet not found")
+			return
+
+		# The action runs as the user that submitted it, for their quotas and share of the model
+		context = contextvars.copy_context()
+		context.run(users.current_user.set, job["owner"])
+		task = asyncio.create_task(
+			services.run_action(job["action"], job["snippet_id"], *json.loads(job["inputs"])), context=context
+		)
+		self.running[job_id] = task
+		try:
+			await asyncio.wait({task})
+		except asyncio.CancelledError:
+			task.cancel()
+			raise
+		finally:
+			del self.running[job_id]
+
+		if task.cancelled():
+			self._complete(job_id, "cancelled")
+		elif isinstance(task.exception(), HTTPException):
+			self._complete(job_id, "failed", task.exception().detail)
+		elif task.exception() is not None:
+			self._complete(job_id, "failed", f"{type(task.exception()).__name__}: {task.exception()}")
+		else:
+			self._complete(job_id, "succeeded")
+
+
+job_queue = JobQueue(settings.JOBS_WORKERS)
+
+metrics.Gauge("jobs_running", "Background jobs being run", function=lambda: {(): len(job_queue.running)})
+metrics.Gauge(
+	"jobs_queued",
+	"Background jobs waiting to run in any process",
+	function=lambda: {(): db.count_queued_jobs()},
+)
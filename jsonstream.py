@@ -0,0 +1,103 @@
+import json
+
+# Incremental parser for the JSON object a model streams in json_object mode.
+# It only understands as much JSON as is needed to surface the top level string values (and
+# the strings of top level arrays, joined with newlines like the handlers do for Tests) while
+# they are still being written; the complete text is still parsed with json.loads at the end.
+
+ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class PartialJSONParser:
+	def __init__(self):
+		self.text = []
+		self.stack = []
+		self.expect_key = True
+		self.key = None
+		self.key_chars = []
+		self.role = None
+		self.escape = None
+		self.high_surrogate = None
+		self.items = 0
+		self.deltas = []
+
+	# Feed the next chunk of text and return the new (key, text) deltas it completes
+	def feed(self, chunk):
+		self.text.append(chunk)
+		self.deltas = []
+		for char in chunk:
+			if self.role is not None:
+				self._string_char(char)
+			else:
+				self._structure_char(char)
+		return self.deltas
+
+	# Parse the whole document once the stream has finished
+	def result(self):
+		return json.loads("".join(self.text))
+
+	def _structure_char(self, char):
+		depth = len(self.stack)
+		if char in "{[":
+			self.stack.append(char)
+			if char == "[" and depth == 1:
+				self.items = 0
+		elif char in "}]":
+			if self.stack:
+				self.stack.pop()
+		elif char == ":" and depth == 1:
+			self.expect_key = False
+		elif char == "," and depth == 1:
+			self.expect_key = True
+		elif char == '"':
+			if depth == 1:
+				self.role = "key" if self.expect_key else "value"
+				if self.role == "key":
+					self.key_chars = []
+			elif depth == 2 and self.stack[-1] == "[":
+				self.role = "item"
+				if self.items:
+					self._emit("\n")
+				self.items += 1
+			else:
+				self.role = "skip"
+
+	def _string_char(self, char):
+		if self.escape is not None:
+			self.escape += char
+			if self.escape[0] != "u":
+				self._decoded(ESCAPES.get(self.escape, self.escape))
+				self.escape = None
+			elif len(self.escape) == 5:
+				self._unicode(int(self.escape[1:], 16))
+				self.escape = None
+		elif char == "\\":
+			self.escape = ""
+		elif char == '"':
+			if self.role == "key":
+				self.key = "".join(self.key_chars)
+			self.role = None
+		else:
+			self._decoded(char)
+
+	# Combine UTF-16 surrogate pairs written as two \u escapes
+	def _unicode(self, code):
+		if 0xD800 <= code <= 0xDBFF:
+			self.high_surrogate = code
+			return
+		if 0xDC00 <= code <= 0xDFFF and self.high_surrogate is not None:
+			code = 0x10000 + ((self.high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+		self.high_surrogate = None
+		self._decoded(chr(code))
+
+	def _decoded(self, text):
+		if self.role == "key":
+			self.key_chars.append(text)
+		elif self.role in ("value", "item"):
+			self._emit(text)
+
+	def _emit(self, text):
+		if self.deltas and self.deltas[-1][0] == self.key:
+			self.deltas[-1] = (self.key, self.deltas[-1][1] + text)
+		else:
+			self.deltas.append((self.key, text))
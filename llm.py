@@ -0,0 +1,425 @@
+import copy
+import json
+import time
+import asyncio
+import logging
+import itertools
+import contextlib
+from collections import OrderedDict, deque
+from fastapi import HTTPException
+
+import cache
+import users
+import metrics
+import prompts
+import backends
+import settings
+import resilience
+
+# Creating the backend is cheap; an API client is only set up by its start() or first call
+backend = backends.create()
+
+logger = logging.getLogger("llm")
+
+
+# Bounded gate in front of the model so a burst of requests queues up to a limit and then fails fast.
+# A freed slot goes to the waiting user with the fewest calls running, users with as many taking
+# turns, so one user's burst does not hold everyone else up; without fair sharing to the call
+# that has waited longest
+class ConcurrencyGate:
+	def __init__(self, max_in_flight, max_queue, queue_timeout, fair=True):
+		self.max_in_flight = max_in_flight
+		self.max_queue = max_queue
+		self.queue_timeout = queue_timeout
+		self.fair = fair
+		self.in_flight = 0
+		self.waiting = 0
+		# Calls holding a slot per user, and the waiting calls of each user in the order users take turns
+		self.running = {}
+		self.queues = OrderedDict()
+		self.arrivals = itertools.count()
+
+	@contextlib.asynccontextmanager
+	async def slot(self, user=""):
+		if self.in_flight < self.max_in_flight and not self.waiting:
+			self._grant(user)
+		else:
+			# Reject straight away when every slot is busy and the queue is already full
+			if self.waiting >= self.max_queue:
+				raise HTTPException(
+					status_code=429,
+					detail="Too many pending generation requests, please retry shortly",
+					headers={"Retry-After": "1"},
+				)
+			await self._wait(user)
+
+		try:
+			yield
+		finally:
+			self._release(user)
+
+	def _grant(self, user):
+		self.in_flight += 1
+		self.running[user] = self.running.get(user, 0) + 1
+
+	async def _wait(self, user):
+		entry = (next(self.arrivals), asyncio.get_running_loop().create_future())
+		self.queues.setdefault(user, deque()).append(entry)
+		self.waiting += 1
+		started = time.perf_counter()
+		try:
+			await asyncio.wait_for(asyncio.shield(entry[1]), self.queue_timeout)
+		except (asyncio.TimeoutError, asyncio.CancelledError) as error:
+			if entry[1].done():
+				# The slot was handed over just as the wait ended, so pass it on
+				self._release(user)
+			else:
+				self._dequeue(user, entry)
+			if isinstance(error, asyncio.TimeoutError):
+				raise HTTPException(
+					status_code=503,
+					detail="Generation service is busy, please retry shortly",
+					headers={"Retry-After": str(int(self.queue_timeout))},
+				) from error
+			raise
+		finally:
+			metrics.LLM_QUEUE_WAIT_SECONDS.observe(time.perf_counter() - started)
+
+	def _dequeue(self, user, entry):
+		queue = self.queues[user]
+		queue.remove(entry)
+		if not queue:
+			del self.queues[user]
+		self.waiting -= 1
+
+	# Free a slot and hand it straight to the next waiting call
+	def _release(self, user):
+		self.in_flight -= 1
+		self.running[user] -= 1
+		if not self.running[user]:
+			del self.running[user]
+		if not self.queues:
+			return
+
+		if self.fair:
+			# The first of the users with the fewest running calls, then moved to the back
+			user = min(self.queues, key=lambda queued: self.running.get(queued, 0))
+		else:
+			user = min(self.queues, key=lambda queued: self.queues[queued][0][0])
+		queue = self.queues[user]
+		_, future = queue.popleft()
+		if queue:
+			self.queues.move_to_end(user)
+		else:
+			del self.queues[user]
+		self.waiting -= 1
+		self._grant(user)
+		future.set_result(None)
+
+
+gate = ConcurrencyGate(
+	settings.LLM_MAX_IN_FLIGHT, settings.LLM_MAX_QUEUE, settings.LLM_QUEUE_TIMEOUT, settings.LLM_FAIR_SHARE
+)
+
+metrics.Gauge("llm_requests_in_flight", "Model calls holding a concurrency slot", function=lambda: {(): gate.in_flight})
+metrics.Gauge("llm_requests_waiting", "Model calls queued for a concurrency slot", function=lambda: {(): gate.waiting})
+metrics.Gauge("llm_queued_users", "Users with model calls queued for a slot", function=lambda: {(): len(gate.queues)})
+
+
+breaker = resilience.CircuitBreaker(settings.LLM_BREAKER_FAILURES, settings.LLM_BREAKER_COOLDOWN)
+
+metrics.Gauge(
+	"llm_circuit_state",
+	"Model circuit breaker state: 0 closed, 1 half open, 2 open",
+	function=lambda: {(): ("closed", "half_open", "open").index(breaker.state())},
+)
+
+
+response_cache = cache.ResponseCache(
+	settings.LLM_CACHE_SIZE,
+	settings.LLM_CACHE_TTL,
+	disk_path=settings.LLM_CACHE_DB,
+	disk_max_entries=settings.LLM_CACHE_DISK_SIZE,
+)
+
+# Token counters reported by the API for every completion
+USAGE_FIELDS = ("prompt_tokens", "completion_tokens", "total_tokens")
+
+# Tokens spent per endpoint since start up, as reported by the API
+usage_totals = {}
+
+
+# Log the tokens a completion spent and add them to the endpoint's totals, the caller's counter and
+# the current user's token quota
+def record_usage(endpoint, response_usage, usage=None):
+	if response_usage is None:
+		return
+	counts = {field: response_usage.get(field) or 0 for field in USAGE_FIELDS}
+	logger.info(
+		"usage endpoint=%s prompt_tokens=%d completion_tokens=%d total_tokens=%d",
+		endpoint,
+		counts["prompt_tokens"],
+		counts["completion_tokens"],
+		counts["total_tokens"],
+	)
+	totals = usage_totals.setdefault(endpoint, {"calls": 0, **{field: 0 for field in USAGE_FIELDS}})
+	totals["calls"] += 1
+	for field, count in counts.items():
+		totals[field] += count
+		metrics.LLM_TOKENS.inc(count, endpoint=endpoint, type=field.replace("_tokens", ""))
+		if usage is not None:
+			usage[field] = usage.get(field, 0) + count
+	users.quotas.charge_tokens(users.current(), counts["total_tokens"])
+
+
+# Time a model call, including its wait for a slot, and count it as ok or error
+@contextlib.contextmanager
+def observed(endpoint):
+	outcome = "error"
+	try:
+		with metrics.timed(metrics.LLM_REQUEST_SECONDS, f"llm.{endpoint}", endpoint=endpoint):
+			yield
+		outcome = "ok"
+	finally:
+		metrics.LLM_REQUESTS.inc(endpoint=endpoint, outcome=outcome)
+
+
+# Identical requests already waiting on the model, so a double submit shares one call
+pending = {}
+
+
+# Handed to the requests sharing a call when the request that made it is cancelled, so they
+# make the call again themselves instead of being cancelled along with it
+class CallAbandoned(Exception):
+	pass
+
+
+# Define common function to send a JSON mode chat completion and return the parsed response.
+# The endpoint's route picks the model and sampling options.
+# When a usage dict is given, the tokens this call spent are added to it (nothing for cache hits).
+# A call that reaches the model counts against the current user's request quota
+async def chat_json(endpoint, messages, usage=None):
+	route = backends.route(endpoint)
+	use_cache = settings.LLM_CACHE_ENABLED and endpoint not in settings.LLM_CACHE_BYPASS
+	if not use_cache:
+		users.quotas.charge_request(users.current())
+		return await _complete(endpoint, messages, route, usage)
+
+	key = cache.make_key(route, messages)
+	while True:
+		data = response_cache.get(key)
+		if data is not None:
+			return data
+		if key not in pending:
+			break
+		try:
+			return copy.deepcopy(await asyncio.shield(pending[key]))
+		except CallAbandoned:
+			pass
+
+	users.quotas.charge_request(users.current())
+	future = asyncio.get_running_loop().create_future()
+	pending[key] = future
+	try:
+		data = await _complete(endpoint, messages, route, usage)
+	except asyncio.CancelledError:
+		future.set_exception(CallAbandoned())
+		future.exception()
+		raise
+	except Exception as error:
+		future.set_exception(error)
+		# Mark the exception as retrieved when nobody else was waiting on it
+		future.exception()
+		raise
+	finally:
+		del pending[key]
+
+	response_cache.set(key, data)
+	future.set_result(data)
+	return copy.deepcopy(data)
+
+
+# Classify a failed attempt: timeout, connection, rate_limit, server_error or client_error
+def failure_reason(error):
+	if isinstance(error, asyncio.TimeoutError):
+		return "timeout"
+	return error.reason
+
+
+# Record a failed attempt with the circuit breaker and return the seconds to wait before retrying,
+# or raise the HTTPException the call gives up with
+def retry_delay(endpoint, attempt, error):
+	reason = failure_reason(error)
+	# A rate limit or a rejected request still means the API is up
+	if reason in ("rate_limit", "client_error"):
+		breaker.success()
+	else:
+		breaker.failure()
+
+	if reason == "client_error" or attempt >= settings.LLM_RETRIES:
+		if reason == "rate_limit":
+			raise HTTPException(
+				status_code=503,
+				detail="Model API rate limit reached, please retry shortly",
+				headers={"Retry-After": str(int(settings.LLM_BACKOFF_MAX))},
+			) from error
+		if reason == "timeout":
+			raise HTTPException(status_code=504, detail="Model call timed out") from error
+		raise HTTPException(status_code=502, detail=f"Model API error: {getattr(error, 'message', error)}") from error
+
+	metrics.LLM_RETRIES.inc(endpoint=endpoint, reason=reason)
+	wait = getattr(error, "retry_after", None)
+	return resilience.backoff(attempt, settings.LLM_BACKOFF_BASE, settings.LLM_BACKOFF_MAX, wait)
+
+
+# Parse a reply and check it holds the keys the endpoint stores; raises ValueError otherwise
+def parse_reply(endpoint, content):
+	try:
+		data = json.loads(content)
+	except (TypeError, ValueError):
+		data = resilience.extract_json(content)
+		metrics.LLM_REPAIRS.inc(endpoint=endpoint, kind="local")
+	return resilience.validate(data, prompts.RESPONSE_KEYS.get(endpoint, ()))
+
+
+# The conversation asking the model to fix an unusable reply
+def repair_messages(endpoint, messages, content, error):
+	keys = ", ".join(prompts.RESPONSE_KEYS.get(endpoint, ()))
+	return [
+		*messages,
+		{"role": "assistant", "content": content or ""},
+		{"role": "user", "content": prompts.REPAIR_PROMPT.format(error=error, keys=keys)},
+	]
+
+
+# Parse a complete reply, asking the model once more when it is unusable
+async def check_reply(endpoint, messages, content, usage=None):
+	try:
+		return parse_reply(endpoint, content)
+	except ValueError as error:
+		if settings.LLM_REPAIR_RETRIES < 1:
+			raise HTTPException(status_code=502, detail=f"Invalid model response: {error}") from error
+		metrics.LLM_REPAIRS.inc(endpoint=endpoint, kind="model")
+		route = backends.route(endpoint)
+		return await _complete(endpoint, repair_messages(endpoint, messages, content, error), route, usage, repairs=1)
+
+
+# One attempt: a single request holding a concurrency slot, cut off after LLM_TIMEOUT
+async def _request(messages, route):
+	async with gate.slot(users.current()):
+		return await asyncio.wait_for(backend.complete(messages, route), settings.LLM_TIMEOUT)
+
+
+# An attempt that, when it has not answered after LLM_HEDGE_AFTER seconds, is raced against a
+# duplicate; the first reply wins and the other request is cancelled
+async def _hedged(endpoint, messages, route):
+	if settings.LLM_HEDGE_AFTER <= 0:
+		return await _request(messages, route)
+
+	tasks = {asyncio.create_task(_request(messages, route))}
+	try:
+		done, _ = await asyncio.wait(tasks, timeout=settings.LLM_HEDGE_AFTER)
+		if not done:
+			metrics.LLM_HEDGES.inc(endpoint=endpoint)
+			tasks.add(asyncio.create_task(_request(messages, route)))
+
+		error = None
+		while tasks:
+			done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+			for task in done:
+				if task.exception() is None:
+					return task.result()
+				error = task.exception()
+		raise error
+	finally:
+		for task in tasks:
+			task.cancel()
+
+
+# Send a JSON mode completion with retries, the circuit breaker and the reply checks, all within
+# LLM_DEADLINE. Every failure surfaces as an HTTPException with a 5xx status instead of a crash
+async def _complete(endpoint, messages, route, usage=None, repairs=0):
+	with observed(endpoint):
+		try:
+			return await asyncio.wait_for(_attempts(endpoint, messages, route, usage, repairs), settings.LLM_DEADLINE)
+		except asyncio.TimeoutError as error:
+			raise HTTPException(status_code=504, detail="Model call timed out") from error
+
+
+async def _attempts(endpoint, messages, route, usage, repairs):
+	attempt = 0
+	while True:
+		breaker.check()
+		try:
+			content, response_usage = await _hedged(endpoint, messages, route)
+		except (asyncio.TimeoutError, backends.BackendError) as error:
+			await asyncio.sleep(retry_delay(endpoint, attempt, error))
+			attempt += 1
+			continue
+		breaker.success()
+		record_usage(endpoint, response_usage, usage)
+
+		try:
+			return parse_reply(endpoint, content)
+		except ValueError as error:
+			if repairs >= settings.LLM_REPAIR_RETRIES:
+				raise HTTPException(status_code=502, detail=f"Invalid model response: {error}") from error
+			repairs += 1
+			metrics.LLM_REPAIRS.inc(endpoint=endpoint, kind="model")
+			messages = repair_messages(endpoint, messages, content, error)
+
+
+# Stream a JSON mode chat completion, yielding the raw content text as it arrives.
+# A call is retried like chat_json until it has yielded text, which cannot be taken back; the
+# stream may stay silent for at most LLM_TIMEOUT and run for at most LLM_DEADLINE seconds.
+# The caller checks the complete text with check_reply
+async def stream_json(endpoint, messages, usage=None):
+	route = backends.route(endpoint)
+	use_cache = settings.LLM_CACHE_ENABLED and endpoint not in settings.LLM_CACHE_BYPASS
+	key = cache.make_key(route, messages)
+	if use_cache:
+		data = response_cache.get(key)
+		if data is not None:
+			yield json.dumps(data)
+			return
+
+	users.quotas.charge_request(users.current())
+	chunks = []
+	loop = asyncio.get_running_loop()
+	deadline = loop.time() + settings.LLM_DEADLINE
+	attempt = 0
+	with observed(endpoint):
+		while True:
+			breaker.check()
+			try:
+				async with gate.slot(users.current()):
+					stream = backend.stream(messages, route)
+					try:
+						while True:
+							timeout = min(settings.LLM_TIMEOUT, deadline - loop.time())
+							try:
+								text, chunk_usage = await asyncio.wait_for(anext(stream), max(timeout, 0))
+							except StopAsyncIteration:
+								break
+							record_usage(endpoint, chunk_usage, usage)
+							if text:
+								chunks.append(text)
+								yield text
+					finally:
+						await stream.aclose()
+			except (asyncio.TimeoutError, backends.BackendError) as error:
+				# Text already yielded cannot be taken back, so a call that produced some is not retried
+				delay = retry_delay(endpoint, settings.LLM_RETRIES if chunks else attempt, error)
+				if loop.time() + delay >= deadline:
+					raise HTTPException(status_code=504, detail="Model call timed out") from error
+				await asyncio.sleep(delay)
+				attempt += 1
+				continue
+			breaker.success()
+			break
+
+	if use_cache:
+		try:
+			response_cache.set(key, parse_reply(endpoint, "".join(chunks)))
+		except ValueError:
+			pass
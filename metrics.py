@@ -0,0 +1,225 @@
+import time
+import bisect
+import functools
+import threading
+import contextlib
+
+import tracing
+
+# Minimal Prometheus metrics registry and the application's series, served in the text
+# exposition format at /metrics. Kept dependency free; the series names follow the usual
+# Prometheus conventions so a prometheus_client based exporter could replace it later.
+
+# Default latency buckets in seconds, from a fast SQLite read up to a slow model call
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REGISTRY = []
+
+
+def _escape(value):
+	return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+	pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+	return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+	if value == float("inf"):
+		return "+Inf"
+	return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+	type = None
+
+	def __init__(self, name, documentation, labelnames=()):
+		self.name = name
+		self.documentation = documentation
+		self.labelnames = tuple(labelnames)
+		self.values = {}
+		self.lock = threading.Lock()
+		REGISTRY.append(self)
+
+	def _key(self, labels):
+		return tuple(str(labels[name]) for name in self.labelnames)
+
+	def samples(self):
+		with self.lock:
+			return [(self.name, key, (), value) for key, value in self.values.items()]
+
+	def render(self):
+		lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+		for name, key, extra, value in self.samples():
+			lines.append(f"{name}{_labels(self.labelnames, key, extra)} {_number(value)}")
+		return "\n".join(lines)
+
+
+class Counter(Metric):
+	type = "counter"
+
+	def inc(self, amount=1, **labels):
+		key = self._key(labels)
+		with self.lock:
+			self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+	type = "gauge"
+
+	def __init__(self, name, documentation, labelnames=(), function=None):
+		super().__init__(name, documentation, labelnames)
+		# Gauges backed by a function are read at scrape time; it returns {label values: value}
+		self.function = function
+
+	def inc(self, amount=1, **labels):
+		key = self._key(labels)
+		with self.lock:
+			self.values[key] = self.values.get(key, 0) + amount
+
+	def dec(self, amount=1, **labels):
+		self.inc(-amount, **labels)
+
+	def samples(self):
+		if self.function is None:
+			return super().samples()
+		return [(self.name, key, (), value) for key, value in self.function().items()]
+
+
+class Histogram(Metric):
+	type = "histogram"
+
+	def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+		super().__init__(name, documentation, labelnames)
+		self.buckets = tuple(buckets) + (float("inf"),)
+
+	def observe(self, value, **labels):
+		self._observe(self._key(labels), value)
+
+	# Only the bucket the value falls in is counted; the cumulative counts are summed up at scrape time
+	def _observe(self, key, value):
+		index = bisect.bisect_left(self.buckets, value)
+		with self.lock:
+			entry = self.values.get(key)
+			if entry is None:
+				entry = self.values[key] = [[0] * len(self.buckets), 0.0]
+			entry[0][index] += 1
+			entry[1] += value
+
+	def samples(self):
+		samples = []
+		with self.lock:
+			for key, (counts, total) in self.values.items():
+				cumulative = 0
+				for bound, count in zip(self.buckets, counts):
+					cumulative += count
+					samples.append((f"{self.name}_bucket", key, (("le", _number(bound)),), cumulative))
+				samples.append((f"{self.name}_sum", key, (), total))
+				samples.append((f"{self.name}_count", key, (), cumulative))
+		return samples
+
+
+# Time a block into a histogram and, inside a traced request, as a trace span
+@contextlib.contextmanager
+def timed(histogram, span, **labels):
+	started = time.perf_counter()
+	try:
+		with tracing.span(span, **labels):
+			yield
+	finally:
+		histogram.observe(time.perf_counter() - started, **labels)
+
+
+# Decorator timing every call of a data access function as one DB query. These run on every
+# request, so outside a traced request the span and the label lookup are skipped
+def db_timed(function):
+	span = f"db.{function.__name__}"
+	key = (function.__name__,)
+
+	@functools.wraps(function)
+	def wrapper(*args, **kwargs):
+		if tracing.active():
+			with timed(DB_QUERY_SECONDS, span, query=function.__name__):
+				return function(*args, **kwargs)
+		started = time.perf_counter()
+		try:
+			return function(*args, **kwargs)
+		finally:
+			DB_QUERY_SECONDS._observe(key, time.perf_counter() - started)
+
+	return wrapper
+
+
+def render():
+	return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+	"http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")
+)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being handled")
+LLM_REQUEST_SECONDS = Histogram("llm_request_duration_seconds", "Model call latency by endpoint", ("endpoint",))
+LLM_REQUESTS = Counter("llm_requests_total", "Model calls by endpoint and outcome", ("endpoint", "outcome"))
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens reported by the model API", ("endpoint", "type"))
+LLM_RETRIES = Counter("llm_retries_total", "Model calls retried by endpoint and reason", ("endpoint", "reason"))
+LLM_HEDGES = Counter("llm_hedged_requests_total", "Duplicate model calls started for slow ones", ("endpoint",))
+LLM_REPAIRS = Counter("llm_response_repairs_total", "Unusable model replies by how they were fixed", ("endpoint", "kind"))
+LLM_QUEUE_WAIT_SECONDS = Histogram("llm_queue_wait_seconds", "Time model calls waited for a concurrency slot")
+QUOTA_REJECTIONS = Counter("quota_rejections_total", "Model calls refused for an exhausted user quota", ("kind",))
+SESSIONS_STARTED = Counter("sessions_started_total", "User sessions started")
+SEMANTIC_SEARCH_SECONDS = Histogram("semantic_search_duration_seconds", "Similar prompt lookup latency")
+SEMANTIC_LOOKUPS = Counter(
+	"semantic_lookups_total", "Code generation prompts checked for a near duplicate by outcome", ("outcome",)
+)
+SNIPPETS_TRANSFERRED = Counter(
+	"snippets_transferred_total", "Snippets exported or imported in bulk by direction", ("direction",)
+)
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "SQLite data access latency by function", ("query",))
+TEMPLATE_RENDER_SECONDS = Histogram(
+	"template_render_duration_seconds", "Jinja2 template render time", ("template",)
+)
+
+
+# Time every render of the environment's templates
+def instrument_templates(environment):
+	class TimedTemplate(environment.template_class):
+		def render(self, *args, **kwargs):
+			with timed(TEMPLATE_RENDER_SECONDS, f"render.{self.name}", template=self.name):
+				return super().render(*args, **kwargs)
+
+	environment.template_class = TimedTemplate
+
+
+# ASGI middleware recording latency and in-flight requests per route, and the request's trace.
+# Plain ASGI rather than BaseHTTPMiddleware so streamed responses are timed until their last byte
+class MetricsMiddleware:
+	def __init__(self, app):
+		self.app = app
+
+	async def __call__(self, scope, receive, send):
+		if scope["type"] != "http":
+			await self.app(scope, receive, send)
+			return
+
+		status = 500
+
+		async def send_with_status(message):
+			nonlocal status
+			if message["type"] == "http.response.start":
+				status = message["status"]
+			await send(message)
+
+		finish = tracing.start(f"{scope['method']} {scope['path']}") if tracing.enabled() else None
+		started = time.perf_counter()
+		HTTP_IN_FLIGHT.inc()
+		try:
+			await self.app(scope, receive, send_with_status)
+		finally:
+			HTTP_IN_FLIGHT.dec()
+			# Label by the route's path template so snippet ids do not create a series each
+			route = scope.get("route")
+			path = getattr(route, "path", "unmatched")
+			HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method=scope["method"], route=path, status=status)
+			if finish is not None:
+				finish(method=scope["method"], route=path, status=status)
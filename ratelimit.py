@@ -0,0 +1,74 @@
+import time
+import asyncio
+from collections import OrderedDict
+
+# Token bucket rate limiter: holds up to burst tokens and refills at rate tokens per second
+
+
+class TokenBucket:
+	def __init__(self, rate, burst):
+		self.rate = rate
+		self.burst = burst
+		self.tokens = burst
+		self.updated = time.monotonic()
+
+	def _refill(self):
+		now = time.monotonic()
+		self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	# Take tokens if there are enough, otherwise return the seconds until there will be
+	def try_acquire(self, amount=1):
+		self._refill()
+		if self.tokens >= amount:
+			self.tokens -= amount
+			return 0
+		return (amount - self.tokens) / self.rate
+
+	# Wait until the tokens are available and take them
+	async def acquire(self, amount=1):
+		while True:
+			wait = self.try_acquire(amount)
+			if not wait:
+				return
+			await asyncio.sleep(wait)
+
+	# Take tokens for something already done, going into debt when there are not enough
+	def spend(self, amount):
+		self._refill()
+		self.tokens -= amount
+
+	def available(self):
+		self._refill()
+		return self.tokens
+
+	# Seconds until the bucket holds a token again, 0 when it has some left
+	def debt_seconds(self):
+		self._refill()
+		return 0 if self.tokens > 0 else (1 - self.tokens) / self.rate
+
+
+# Per key token buckets, created on first use, for the most recently seen max_keys keys.
+# A rate of 0 turns the limit off
+class KeyedBuckets:
+	def __init__(self, rate, burst, max_keys=10000):
+		self.rate = rate
+		self.burst = burst
+		self.max_keys = max_keys
+		self.buckets = OrderedDict()
+
+	def enabled(self):
+		return self.rate > 0
+
+	def get(self, key):
+		bucket = self.buckets.get(key)
+		if bucket is None:
+			bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+			if len(self.buckets) > self.max_keys:
+				self.buckets.popitem(last=False)
+		else:
+			self.buckets.move_to_end(key)
+		return bucket
+
+	def __len__(self):
+		return len(self.buckets)
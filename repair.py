@@ -0,0 +1,140 @@
+import time
+import asyncio
+from fastapi import HTTPException
+
+import db
+import llm
+import services
+
+# Server side generate -> test -> regenerate loop.
+# The snippet is read once and every step works on the copy in memory; only the final code,
+# tests and languages are written back, together with the last local test run and the history
+# of every step, in a single transaction once the loop stops.
+
+# Most failing tests described to the model when asking it to regenerate the code
+MAX_REPORTED_FAILURES = 10
+
+
+# Describe what failed in a local test run so the regenerated code can address it
+def failure_report(test_run):
+	if test_run is None:
+		return ""
+	lines = [f"{test['name']}: {test['error']}" for test in test_run["tests"] if not test["passed"]]
+	lines = lines[:MAX_REPORTED_FAILURES]
+	if test_run["error"]:
+		lines.append(test_run["error"])
+	if not lines:
+		return ""
+	return "Failing tests:\n" + "\n".join(lines)
+
+
+# Stops the loop once the token or time budget is spent
+class Budget:
+	def __init__(self, max_tokens, max_seconds):
+		self.max_tokens = max_tokens
+		self.started = time.perf_counter()
+		self.deadline = self.started + max_seconds
+		self.usage = {}
+
+	def tokens(self):
+		return self.usage.get("total_tokens", 0)
+
+	def elapsed_ms(self):
+		return (time.perf_counter() - self.started) * 1000
+
+	# The reason the budget is spent, or None while there is some left
+	def exhausted(self):
+		if self.tokens() >= self.max_tokens:
+			return "max_tokens"
+		if time.perf_counter() >= self.deadline:
+			return "max_seconds"
+		return None
+
+	# Await a step, giving up with asyncio.TimeoutError once the time budget runs out
+	async def run(self, step):
+		return await asyncio.wait_for(step, max(self.deadline - time.perf_counter(), 0))
+
+
+# Generate tests when the snippet has none, then alternate running them and regenerating the code
+# until they pass, max_iterations test runs are done or the budget is spent
+async def repair(snippet_id, max_iterations, max_tokens, max_seconds):
+	snippet = dict(db.get_snippet(snippet_id))
+	if not snippet["code"]:
+		raise HTTPException(status_code=422, detail="Snippet has no code to repair")
+
+	budget = Budget(max_tokens, max_seconds)
+	changed = {}
+	history = []
+	status = False
+	test_run = None
+	iterations = 0
+	stop_reason = "max_iterations"
+	error = None
+
+	def apply(step, fields, **details):
+		snippet.update(fields)
+		changed.update(fields)
+		history.append(
+			{"iteration": iterations, "step": step, "tokens": budget.tokens(), "elapsed_ms": budget.elapsed_ms(), **details}
+		)
+
+	try:
+		if not snippet["tests"]:
+			data = await budget.run(
+				llm.chat_json("generate_test_cases", services.generate_tests_messages(snippet), usage=budget.usage)
+			)
+			apply("generate_tests", services.tests_fields(data))
+
+		while iterations < max_iterations:
+			stop_reason = budget.exhausted()
+			if stop_reason:
+				break
+			iterations += 1
+			status, test_run, fields = await budget.run(services.check_tests(snippet, budget.usage))
+			apply(
+				"test",
+				fields,
+				passed=status,
+				tests_passed=test_run and test_run["passed"],
+				tests_failed=test_run and test_run["failed"],
+				error=test_run and test_run["error"],
+			)
+			if status:
+				stop_reason = "passed"
+				break
+			if iterations == max_iterations:
+				stop_reason = "max_iterations"
+				break
+
+			stop_reason = budget.exhausted()
+			if stop_reason:
+				break
+			messages = services.regenerate_code_messages(snippet, failure_report(test_run))
+			data = await budget.run(llm.chat_json("regenerate_code", messages, usage=budget.usage))
+			fields = services.code_fields(data)
+			# The same code would fail the same way, so there is nothing left to try
+			if fields["code"] == snippet["code"]:
+				stop_reason = "no_progress"
+				break
+			# Results of the previous code no longer apply
+			test_run = None
+			apply("regenerate", fields)
+	except asyncio.TimeoutError:
+		stop_reason = "max_seconds"
+	except HTTPException as failure:
+		stop_reason, error = "error", failure.detail
+	except (ValueError, KeyError) as failure:
+		stop_reason, error = "error", f"Invalid model response: {failure}"
+
+	result = {
+		"status": status and stop_reason == "passed",
+		"stop_reason": stop_reason,
+		"error": error,
+		"iterations": iterations,
+		"duration_ms": budget.elapsed_ms(),
+		"usage": budget.usage,
+		"history": history,
+	}
+	db.record_repair_run(snippet_id, changed, test_run, result)
+	result["test_run"] = test_run
+	return result
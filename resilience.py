@@ -0,0 +1,108 @@
+import re
+import json
+import time
+import random
+from fastapi import HTTPException
+
+# Building blocks of the resilient model client in llm.py: jittered backoff, a circuit breaker
+# that fails fast while the upstream is down, and validation and local repair of JSON replies.
+
+
+# Full jitter exponential backoff, or the server's Retry-After when it asked for longer
+def backoff(attempt, base, ceiling, retry_after=None):
+	delay = random.uniform(0, min(ceiling, base * 2 ** attempt))
+	if retry_after is not None:
+		delay = max(delay, min(retry_after, ceiling))
+	return delay
+
+
+# Opens after threshold consecutive upstream failures and rejects calls for cooldown seconds,
+# then lets one trial call through per cooldown: success closes it again, failure re-opens it
+class CircuitBreaker:
+	def __init__(self, threshold, cooldown):
+		self.threshold = threshold
+		self.cooldown = cooldown
+		self.failures = 0
+		self.opened_at = None
+		self.trial_at = None
+
+	def state(self):
+		if self.opened_at is None:
+			return "closed"
+		if time.monotonic() - self.opened_at < self.cooldown:
+			return "open"
+		return "half_open"
+
+	# Raise 503 instead of calling an upstream that is known to be down
+	def check(self):
+		state = self.state()
+		if state == "closed":
+			return
+		now = time.monotonic()
+		# A trial that never reported back, say because it was cancelled, does not block the next one
+		if state == "half_open" and (self.trial_at is None or now - self.trial_at >= self.cooldown):
+			self.trial_at = now
+			return
+		wait = self.cooldown - (now - (self.opened_at if state == "open" else self.trial_at))
+		raise HTTPException(
+			status_code=503,
+			detail="Generation service is unavailable, please retry shortly",
+			headers={"Retry-After": str(max(1, int(wait)))},
+		)
+
+	def success(self):
+		self.failures = 0
+		self.opened_at = None
+		self.trial_at = None
+
+	def failure(self):
+		self.failures += 1
+		if self.opened_at is not None or self.failures >= self.threshold:
+			self.opened_at = time.monotonic()
+		self.trial_at = None
+
+
+FENCE = re.compile(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", re.DOTALL)
+
+
+# Recover the JSON object from a reply that does not parse as is, fixing the cheap cases
+# locally: code fences and text around the object
+def extract_json(content):
+	text = content or ""
+	fenced = FENCE.match(text)
+	if fenced:
+		text = fenced.group(1)
+	start, end = text.find("{"), text.rfind("}")
+	if start == -1 or end < start:
+		raise ValueError("reply is not a JSON object")
+	return json.loads(text[start:end + 1])
+
+
+# The model reports Status as a boolean or as the strings True/False
+def passed(status):
+	if isinstance(status, str):
+		return status.strip().lower() == "true"
+	return bool(status)
+
+
+# Check the reply has every key the action stores, with usable values.
+# A Status given as the string True or False is turned into the boolean
+def validate(data, keys):
+	if not isinstance(data, dict):
+		raise ValueError("reply is not a JSON object")
+	missing = [key for key in keys if key not in data]
+	if missing:
+		raise ValueError(f"missing keys {', '.join(missing)}")
+	for key in keys:
+		value = data[key]
+		if key == "Status":
+			if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+				data[key] = passed(value)
+			elif not isinstance(value, bool):
+				raise ValueError("Status is not a boolean")
+		elif key == "Tests":
+			if not isinstance(value, (str, list)):
+				raise ValueError("Tests is not a string or list")
+		elif not isinstance(value, str):
+			raise ValueError(f"{key} is not a string")
+	return data
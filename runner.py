@@ -0,0 +1,270 @@
+import os
+import sys
+import json
+import shutil
+import asyncio
+import logging
+import tempfile
+from collections import deque
+
+import settings
+
+logger = logging.getLogger("runner")
+
+SANDBOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox")
+
+# Host directories mounted read-only in the jail when they exist, besides the interpreters
+SYSTEM_DIRS = ("/usr", "/bin", "/sbin", "/lib", "/lib32", "/lib64")
+
+# Extra seconds the pool waits for a worker reply on top of the job's own wall clock limit
+REPLY_GRACE_SECONDS = 2
+
+# Largest single line a worker may send back
+MAX_REPLY_BYTES = 16 * 1024 * 1024
+
+
+# Map the model reported coding language onto a language the local runner supports
+def detect_language(coding_language):
+	value = (coding_language or "").strip().lower()
+	if "python" in value or value == "py":
+		return "python"
+	if "javascript" in value or value in ("js", "node", "nodejs", "node.js"):
+		return "javascript"
+	return None
+
+
+# The bubblewrap command every worker runs under: new user, PID, network, IPC and UTS namespaces,
+# no capabilities, RUNNER_UID inside, and a read-only view of only the system directories, the
+# interpreters and the worker scripts, with a private /tmp. None when bwrap is not installed
+def jail_command(interpreters):
+	bwrap = shutil.which(settings.RUNNER_BWRAP)
+	if not bwrap:
+		return None
+	command = [
+		bwrap,
+		"--unshare-all",
+		"--unshare-user",
+		"--disable-userns",
+		"--die-with-parent",
+		"--new-session",
+		"--cap-drop",
+		"ALL",
+		"--uid",
+		str(settings.RUNNER_UID),
+		"--gid",
+		str(settings.RUNNER_GID),
+	]
+	for directory in SYSTEM_DIRS:
+		command += ["--ro-bind-try", directory, directory]
+	mounts = {sys.prefix, sys.base_prefix, sys.exec_prefix, SANDBOX_DIR}
+	mounts.update(os.path.dirname(os.path.realpath(path)) for path in interpreters)
+	for directory in sorted(os.path.realpath(mount) for mount in mounts):
+		command += ["--ro-bind", directory, directory]
+	return command + ["--tmpfs", "/tmp", "--dev", "/dev", "--proc", "/proc", "--chdir", "/tmp", "--"]
+
+
+# Workers of a server running as root are started as RUNNER_UID, so nothing in the jail runs as root
+def _credentials():
+	if os.getuid() != 0:
+		return {}
+	return {"user": settings.RUNNER_UID, "group": settings.RUNNER_GID, "extra_groups": []}
+
+
+# Start an interpreter in the jail once; returns why the jail cannot be used, or None
+async def _check_jail(prefix):
+	try:
+		process = await asyncio.create_subprocess_exec(
+			*prefix,
+			sys.executable,
+			"-I",
+			"-c",
+			"pass",
+			stdout=asyncio.subprocess.DEVNULL,
+			stderr=asyncio.subprocess.PIPE,
+			cwd=tempfile.gettempdir(),
+			start_new_session=True,
+			**_credentials(),
+		)
+		_, error = await process.communicate()
+	except OSError as exception:
+		return str(exception)
+	if process.returncode != 0:
+		return error.decode("utf-8", "replace").strip() or f"exit code {process.returncode}"
+	return None
+
+
+def _limits():
+	return {
+		"cpu_seconds": settings.RUNNER_CPU_SECONDS,
+		"wall_seconds": settings.RUNNER_WALL_SECONDS,
+		"memory_mb": settings.RUNNER_MEMORY_MB,
+		"file_size_mb": settings.RUNNER_FILE_SIZE_MB,
+	}
+
+
+def _failure(error, timed_out=False):
+	return {"tests": [], "error": error, "timed_out": timed_out, "duration_ms": 0, "stdout": "", "stderr": ""}
+
+
+# Pool of warm worker processes for one language, each handling one job at a time
+class WorkerPool:
+	def __init__(self, language, command, size):
+		self.language = language
+		self.command = command
+		self.size = size
+		self.idle = []
+		self.waiters = deque()
+		self.workers = set()
+		self.restocking = set()
+
+	async def start(self):
+		for _ in range(self.size):
+			self.idle.append(await self._spawn())
+
+	async def stop(self):
+		for restock in list(self.restocking):
+			restock.cancel()
+		for worker in list(self.workers):
+			self._kill(worker)
+			await worker.wait()
+
+	async def run(self, job, timeout):
+		worker = await self._acquire()
+		try:
+			worker.stdin.write((json.dumps(job) + "\n").encode("utf-8"))
+			await worker.stdin.drain()
+			line = await asyncio.wait_for(worker.stdout.readline(), timeout)
+			if not line:
+				raise ConnectionError("worker exited")
+			result = json.loads(line)
+		except asyncio.TimeoutError:
+			worker = await self._replace(worker)
+			return _failure("Timed out: wall clock limit exceeded", timed_out=True)
+		except (ConnectionError, ValueError) as error:
+			# A worker that died mid job (e.g. out of memory) is replaced before anyone else uses it
+			worker = await self._replace(worker)
+			return _failure(f"Sandbox process terminated: {error}")
+		except asyncio.CancelledError:
+			# The abandoned job's reply would reach the next caller, so the worker is replaced in the background
+			self._kill(worker)
+			worker = None
+			restock = asyncio.get_running_loop().create_task(self._restock())
+			self.restocking.add(restock)
+			restock.add_done_callback(self.restocking.discard)
+			raise
+		finally:
+			if worker is not None:
+				self._release(worker)
+		return result
+
+	# Hand out idle workers strictly in arrival order so a caller that just finished a job
+	# cannot take a worker ahead of callers that are already waiting
+	async def _acquire(self):
+		if self.idle and not self.waiters:
+			return self.idle.pop()
+		waiter = asyncio.get_running_loop().create_future()
+		self.waiters.append(waiter)
+		try:
+			return await waiter
+		except asyncio.CancelledError:
+			if waiter.done() and not waiter.cancelled():
+				self._release(waiter.result())
+			else:
+				self.waiters.remove(waiter)
+			raise
+
+	def _release(self, worker):
+		while self.waiters:
+			waiter = self.waiters.popleft()
+			if not waiter.done():
+				waiter.set_result(worker)
+				return
+		self.idle.append(worker)
+
+	async def _spawn(self):
+		worker = await asyncio.create_subprocess_exec(
+			*self.command,
+			stdin=asyncio.subprocess.PIPE,
+			stdout=asyncio.subprocess.PIPE,
+			stderr=asyncio.subprocess.DEVNULL,
+			cwd=tempfile.gettempdir(),
+			# Workers never see the application's environment, so no API keys leak into snippets
+			env={"PATH": os.environ.get("PATH", ""), "LANG": "C.UTF-8", "HOME": "/tmp"},
+			start_new_session=True,
+			limit=MAX_REPLY_BYTES,
+			**_credentials(),
+		)
+		self.workers.add(worker)
+		return worker
+
+	async def _restock(self):
+		self._release(await self._spawn())
+
+	async def _replace(self, worker):
+		self._kill(worker)
+		return await self._spawn()
+
+	def _kill(self, worker):
+		self.workers.discard(worker)
+		if worker.returncode is None:
+			worker.kill()
+
+
+# Local sandboxed test execution engine with one warm pool per supported language
+class TestRunner:
+	def __init__(self):
+		self.pools = {}
+
+	def commands(self):
+		commands = {"python": [sys.executable, "-I", os.path.join(SANDBOX_DIR, "python_worker.py"), "--jailed"]}
+		node = shutil.which(settings.RUNNER_NODE)
+		if node:
+			commands["javascript"] = [
+				node,
+				f"--max-old-space-size={settings.RUNNER_MEMORY_MB}",
+				"--disallow-code-generation-from-strings",
+				os.path.join(SANDBOX_DIR, "js_worker.js"),
+			]
+		return commands
+
+	# Start the worker pools, or none when the jail cannot be set up: snippets never run unconfined,
+	# and every language is then judged by the model
+	async def start(self):
+		commands = self.commands()
+		prefix = jail_command([command[0] for command in commands.values()])
+		if prefix is None:
+			logger.warning("%s not found, tests are judged by the model instead of run locally", settings.RUNNER_BWRAP)
+			return
+		error = await _check_jail(prefix)
+		if error:
+			logger.warning("sandbox jail unavailable, tests are judged by the model instead of run locally: %s", error)
+			return
+		for language, command in commands.items():
+			pool = WorkerPool(language, prefix + command, settings.RUNNER_WORKERS)
+			await pool.start()
+			self.pools[language] = pool
+
+	async def stop(self):
+		for pool in self.pools.values():
+			await pool.stop()
+		self.pools = {}
+
+	def supports(self, language):
+		return language in self.pools
+
+	# Run the tests against the code and return per test results plus an overall status
+	async def run(self, language, code, tests):
+		limits = _limits()
+		job = {"code": code, "tests": tests, "limits": limits}
+		result = await self.pools[language].run(job, limits["wall_seconds"] + REPLY_GRACE_SECONDS)
+
+		result["language"] = language
+		result["passed"] = sum(1 for test in result["tests"] if test["passed"])
+		result["failed"] = len(result["tests"]) - result["passed"]
+		if result["error"] is None and not result["tests"]:
+			result["error"] = "No test cases found"
+		result["status"] = result["error"] is None and result["failed"] == 0
+		return result
+
+
+test_runner = TestRunner()
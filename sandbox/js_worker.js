@@ -0,0 +1,613 @@
+"use strict";
+
+// Warm worker for running JavaScript snippets against their tests.
+// The runner starts this script once with a capped heap, inside the same jail as the Python
+// worker, and sends one JSON job per line on stdin. Each job runs in a fresh vm context that only
+// exposes a console, an assert module and a minimal jest style API, all built inside that context,
+// so snippets have no access to the network, the file system, the process or the worker's own
+// objects. The JSON result is written back as a single line on stdout.
+
+const fs = require("fs");
+const os = require("os");
+const path = require("path");
+const vm = require("vm");
+const readline = require("readline");
+
+const SETUP_PATTERN = /^(const|let|var|function|async\s+function|class|import|module\.exports|exports\.|["']use strict["'])\b/;
+
+// Errors may come from the job's context, so only strings are taken from them
+function formatError(error) {
+	try {
+		if (error && error.name && error.message !== undefined) {
+			return `${String(error.name)}: ${String(error.message)}`;
+		}
+		return String(error);
+	} catch (exception) {
+		return "Unprintable error";
+	}
+}
+
+// Split test source into top level statements, tracking brackets, strings and comments
+function splitStatements(source) {
+	const statements = [];
+	let depth = 0;
+	let current = "";
+	let quote = null;
+	let lineComment = false;
+	let blockComment = false;
+
+	for (let index = 0; index < source.length; index++) {
+		const char = source[index];
+		const next = source[index + 1];
+		current += char;
+
+		if (lineComment) {
+			if (char === "\n") {
+				lineComment = false;
+			} else {
+				continue;
+			}
+		} else if (blockComment) {
+			if (char === "*" && next === "/") {
+				current += next;
+				index++;
+				blockComment = false;
+			}
+			continue;
+		} else if (quote) {
+			if (char === "\\") {
+				current += next || "";
+				index++;
+			} else if (char === quote) {
+				quote = null;
+			}
+			continue;
+		} else if (char === "/" && next === "/") {
+			lineComment = true;
+			continue;
+		} else if (char === "/" && next === "*") {
+			blockComment = true;
+			continue;
+		} else if (char === "'" || char === '"' || char === "`") {
+			quote = char;
+			continue;
+		} else if ("([{".includes(char)) {
+			depth++;
+		} else if (")]}".includes(char)) {
+			depth--;
+		}
+
+		if (depth === 0 && (char === ";" || char === "\n")) {
+			const rest = source.slice(index + 1).trimStart();
+			const trimmed = current.trim();
+			// Keep going when the statement clearly continues on the next line
+			if (char === "\n" && (/[,.+\-*/=&|?:(]$/.test(trimmed) || /^[.?:]/.test(rest))) {
+				continue;
+			}
+			if (trimmed && trimmed !== ";" && !/^\/\//.test(trimmed)) {
+				statements.push(trimmed);
+			}
+			current = "";
+		}
+	}
+	if (current.trim()) {
+		statements.push(current.trim());
+	}
+	return statements;
+}
+
+// Rewrite ES module syntax into something a classic vm script can run
+function toScript(source) {
+	return source
+		.replace(/^\s*import\s+(\w+)\s+from\s+(['"][^'"]+['"]);?/gm, "const $1 = require($2);")
+		.replace(/^\s*import\s+\*\s+as\s+(\w+)\s+from\s+(['"][^'"]+['"]);?/gm, "const $1 = require($2);")
+		.replace(/^\s*import\s+\{([^}]+)\}\s+from\s+(['"][^'"]+['"]);?/gm, (match, names, module) =>
+			`const {${names.replace(/\s+as\s+/g, ": ")}} = require(${module});`)
+		.replace(/^(\s*)export\s+default\s+/gm, "$1module.exports.default = ")
+		.replace(/^(\s*)export\s+(?=(async\s+)?(function|class|const|let|var)\b)/gm, "$1");
+}
+
+// Names declared at the top level of the snippet, so they can be handed to the tests
+function topLevelNames(source) {
+	const names = new Set();
+	for (const statement of splitStatements(source)) {
+		const match = statement.match(/^(?:async\s+)?(?:function\*?|class|const|let|var)\s+([A-Za-z_$][\w$]*)/);
+		if (match) {
+			names.add(match[1]);
+		}
+	}
+	return [...names];
+}
+
+// The test API of a job, run inside the job's own context so every object a snippet can reach
+// belongs to that context: console, expect, an assert module, require, describe/it/test and the
+// case runner. Only strings cross back to the worker, so nothing a snippet changes outlives its job.
+// Self-contained, as it is turned into source and compiled in the context
+function sandboxApi() {
+	"use strict";
+
+	// Records without a prototype, so a snippet changing Object.prototype cannot alter their JSON
+	const output = Object.assign(Object.create(null), { stdout: "", stderr: "" });
+	let buffers = output;
+	let current = null;
+	const module = { exports: {} };
+	const registered = [];
+	const prefixes = [];
+	// Kept from before the snippet runs, which may replace the global one
+	const stringify = JSON.stringify;
+
+	const formatValue = (value) => {
+		try {
+			return typeof value === "string" ? value : stringify(value);
+		} catch (error) {
+			return String(value);
+		}
+	};
+	const formatError = (error) => {
+		try {
+			if (error && error.name && error.message !== undefined) {
+				return `${error.name}: ${error.message}`;
+			}
+			return String(error);
+		} catch (exception) {
+			return "Unprintable error";
+		}
+	};
+
+	class AssertionError extends Error {
+		constructor(options = {}) {
+			super(typeof options === "string" ? options : options.message);
+			this.name = "AssertionError";
+			this.actual = options.actual;
+			this.expected = options.expected;
+			this.operator = options.operator;
+		}
+	}
+
+	// Node's deep equality: strict compares primitives with Object.is and requires the same prototypes
+	const deepEqual = (actual, expected, strict, seen = new Map()) => {
+		if (strict ? Object.is(actual, expected) : actual == expected || (actual !== actual && expected !== expected)) {
+			return true;
+		}
+		if (typeof actual !== "object" || typeof expected !== "object" || actual === null || expected === null) {
+			return false;
+		}
+		if (strict && Object.getPrototypeOf(actual) !== Object.getPrototypeOf(expected)) {
+			return false;
+		}
+		if (seen.get(actual) === expected) {
+			return true;
+		}
+		seen.set(actual, expected);
+		if (Array.isArray(actual) !== Array.isArray(expected)) {
+			return false;
+		}
+		if (actual instanceof Date || expected instanceof Date) {
+			return actual instanceof Date && expected instanceof Date && actual.getTime() === expected.getTime();
+		}
+		if (actual instanceof RegExp || expected instanceof RegExp) {
+			return String(actual) === String(expected);
+		}
+		if (actual instanceof Error && (actual.name !== expected.name || actual.message !== expected.message)) {
+			return false;
+		}
+		if (actual instanceof Map || expected instanceof Map) {
+			if (!(actual instanceof Map && expected instanceof Map) || actual.size !== expected.size) {
+				return false;
+			}
+			for (const [key, value] of actual) {
+				if (!expected.has(key) || !deepEqual(value, expected.get(key), strict, seen)) {
+					return false;
+				}
+			}
+			return true;
+		}
+		if (actual instanceof Set || expected instanceof Set) {
+			if (!(actual instanceof Set && expected instanceof Set) || actual.size !== expected.size) {
+				return false;
+			}
+			for (const value of actual) {
+				if (!expected.has(value) && ![...expected].some((other) => deepEqual(value, other, strict, new Map(seen)))) {
+					return false;
+				}
+			}
+			return true;
+		}
+		const keys = Object.keys(actual);
+		if (keys.length !== Object.keys(expected).length) {
+			return false;
+		}
+		return keys.every(
+			(key) => Object.prototype.hasOwnProperty.call(expected, key) && deepEqual(actual[key], expected[key], strict, seen),
+		);
+	};
+
+	const fail = (message, actual, expected, operator) => {
+		throw new AssertionError({ message, actual, expected, operator });
+	};
+	const compare = (passed, actual, expected, operator, message, description) => {
+		if (!passed) {
+			if (message instanceof Error) {
+				throw message;
+			}
+			fail(message || `${description}: ${formatValue(actual)} ${operator} ${formatValue(expected)}`, actual, expected, operator);
+		}
+	};
+	// Whether a thrown error matches what assert.throws or expect().toThrow was given
+	const matches = (error, expected) => {
+		if (expected === undefined) {
+			return true;
+		}
+		if (expected instanceof RegExp) {
+			return expected.test(error && error.message !== undefined ? error.message : String(error));
+		}
+		if (typeof expected === "function") {
+			if (expected.prototype !== undefined && error instanceof expected) {
+				return true;
+			}
+			return Error.isPrototypeOf(expected) || expected === Error ? false : expected.call({}, error) === true;
+		}
+		if (typeof expected === "object" && expected !== null) {
+			return Object.keys(expected).every((key) =>
+				expected[key] instanceof RegExp && typeof error[key] === "string"
+					? expected[key].test(error[key])
+					: deepEqual(error[key], expected[key], true),
+			);
+		}
+		return false;
+	};
+	const thrownBy = (block) => {
+		try {
+			block();
+		} catch (error) {
+			return { error };
+		}
+		return null;
+	};
+	const rejectionOf = async (promise) => {
+		try {
+			await (typeof promise === "function" ? promise() : promise);
+		} catch (error) {
+			return { error };
+		}
+		return null;
+	};
+
+	const assert = (value, message) => assert.ok(value, message);
+	Object.assign(assert, {
+		AssertionError,
+		ok: (value, message) => compare(Boolean(value), value, true, "==", message, "The expression evaluated to a falsy value"),
+		equal: (actual, expected, message) => {
+			const equal = actual == expected || (actual !== actual && expected !== expected);
+			compare(equal, actual, expected, "==", message, "Expected values to be loosely equal");
+		},
+		notEqual: (actual, expected, message) =>
+			compare(actual != expected, actual, expected, "!=", message, "Expected values to be loosely unequal"),
+		strictEqual: (actual, expected, message) =>
+			compare(Object.is(actual, expected), actual, expected, "!==", message, "Expected values to be strictly equal"),
+		notStrictEqual: (actual, expected, message) =>
+			compare(!Object.is(actual, expected), actual, expected, "===", message, "Expected values to be strictly unequal"),
+		deepEqual: (actual, expected, message) =>
+			compare(deepEqual(actual, expected, false), actual, expected, "!=", message, "Expected values to be loosely deep-equal"),
+		notDeepEqual: (actual, expected, message) =>
+			compare(!deepEqual(actual, expected, false), actual, expected, "==", message, "Expected values not to be loosely deep-equal"),
+		deepStrictEqual: (actual, expected, message) =>
+			compare(deepEqual(actual, expected, true), actual, expected, "!==", message, "Expected values to be strictly deep-equal"),
+		notDeepStrictEqual: (actual, expected, message) =>
+			compare(!deepEqual(actual, expected, true), actual, expected, "===", message, "Expected values not to be strictly deep-equal"),
+		match: (value, pattern, message) =>
+			compare(pattern.test(value), value, pattern, "does not match", message, "The input did not match the regular expression"),
+		doesNotMatch: (value, pattern, message) =>
+			compare(!pattern.test(value), value, pattern, "matches", message, "The input was expected to not match the regular expression"),
+		throws: (block, expected, message) => {
+			if (typeof expected === "string") {
+				[expected, message] = [undefined, expected];
+			}
+			const thrown = thrownBy(block);
+			if (thrown === null) {
+				fail(message || "Missing expected exception.", undefined, expected, "throws");
+			}
+			if (!matches(thrown.error, expected)) {
+				throw thrown.error;
+			}
+		},
+		doesNotThrow: (block, message) => {
+			const thrown = thrownBy(block);
+			if (thrown !== null) {
+				fail(message || `Got unwanted exception: ${formatError(thrown.error)}`, thrown.error, undefined, "doesNotThrow");
+			}
+		},
+		rejects: async (promise, expected, message) => {
+			if (typeof expected === "string") {
+				[expected, message] = [undefined, expected];
+			}
+			const rejected = await rejectionOf(promise);
+			if (rejected === null) {
+				fail(message || "Missing expected rejection.", undefined, expected, "rejects");
+			}
+			if (!matches(rejected.error, expected)) {
+				throw rejected.error;
+			}
+		},
+		doesNotReject: async (promise, message) => {
+			const rejected = await rejectionOf(promise);
+			if (rejected !== null) {
+				fail(message || `Got unwanted rejection: ${formatError(rejected.error)}`, rejected.error, undefined, "doesNotReject");
+			}
+		},
+		fail: (message = "Failed") => {
+			if (message instanceof Error) {
+				throw message;
+			}
+			fail(message, undefined, undefined, "fail");
+		},
+	});
+	const strict = (value, message) => assert.ok(value, message);
+	Object.assign(strict, assert, {
+		equal: assert.strictEqual,
+		notEqual: assert.notStrictEqual,
+		deepEqual: assert.deepStrictEqual,
+		notDeepEqual: assert.notDeepStrictEqual,
+	});
+	assert.strict = strict;
+	strict.strict = strict;
+
+	const makeExpect = (actual, negate = false) => {
+		const check = (passed, message) => {
+			if (passed === negate) {
+				throw new AssertionError({ message: negate ? `Expected not: ${message}` : message });
+			}
+		};
+		const matchers = {
+			toBe: (expected) => check(Object.is(actual, expected), `${formatValue(actual)} to be ${formatValue(expected)}`),
+			toEqual: (expected) => check(deepEqual(actual, expected, true), `${formatValue(actual)} to equal ${formatValue(expected)}`),
+			toStrictEqual: (expected) => check(deepEqual(actual, expected, true), `${formatValue(actual)} to equal ${formatValue(expected)}`),
+			toBeTruthy: () => check(Boolean(actual), `${formatValue(actual)} to be truthy`),
+			toBeFalsy: () => check(!actual, `${formatValue(actual)} to be falsy`),
+			toBeNull: () => check(actual === null, `${formatValue(actual)} to be null`),
+			toBeUndefined: () => check(actual === undefined, `${formatValue(actual)} to be undefined`),
+			toBeDefined: () => check(actual !== undefined, `${formatValue(actual)} to be defined`),
+			toBeNaN: () => check(Number.isNaN(actual), `${formatValue(actual)} to be NaN`),
+			toBeGreaterThan: (expected) => check(actual > expected, `${formatValue(actual)} > ${formatValue(expected)}`),
+			toBeGreaterThanOrEqual: (expected) => check(actual >= expected, `${formatValue(actual)} >= ${formatValue(expected)}`),
+			toBeLessThan: (expected) => check(actual < expected, `${formatValue(actual)} < ${formatValue(expected)}`),
+			toBeLessThanOrEqual: (expected) => check(actual <= expected, `${formatValue(actual)} <= ${formatValue(expected)}`),
+			toBeCloseTo: (expected, digits = 2) =>
+				check(Math.abs(actual - expected) < Math.pow(10, -digits) / 2, `${formatValue(actual)} to be close to ${formatValue(expected)}`),
+			toContain: (expected) => check(actual != null && actual.includes(expected), `${formatValue(actual)} to contain ${formatValue(expected)}`),
+			toHaveLength: (expected) => check(actual != null && actual.length === expected, `${formatValue(actual)} to have length ${expected}`),
+			toBeInstanceOf: (expected) => check(actual instanceof expected, `${formatValue(actual)} to be an instance of ${expected.name}`),
+			toMatch: (expected) => check(new RegExp(expected).test(actual), `${formatValue(actual)} to match ${expected}`),
+			toThrow: (expected) => {
+				const thrown = thrownBy(actual);
+				let passed = thrown !== null;
+				if (passed && expected !== undefined) {
+					const message = thrown.error && thrown.error.message !== undefined ? thrown.error.message : String(thrown.error);
+					passed = typeof expected === "function" ? thrown.error instanceof expected : new RegExp(expected).test(message);
+				}
+				check(passed, `function to throw${expected !== undefined ? ` ${formatValue(expected)}` : ""}`);
+			},
+		};
+		if (!negate) {
+			matchers.not = makeExpect(actual, true);
+		}
+		return matchers;
+	};
+
+	const write = (stream) => (...args) => {
+		buffers[stream] += args.map(formatValue).join(" ") + "\n";
+	};
+	const require = (name) => {
+		if (["assert", "node:assert", "assert/strict", "node:assert/strict"].includes(name)) {
+			return name.endsWith("strict") ? strict : assert;
+		}
+		if (name.startsWith(".")) {
+			return module.exports;
+		}
+		throw new Error(`Module ${name} is not available in the sandbox`);
+	};
+	const it = (name, body) => registered.push({ name: [...prefixes, name].join(" "), body });
+
+	const globals = {
+		console: {
+			log: write("stdout"),
+			info: write("stdout"),
+			debug: write("stdout"),
+			warn: write("stderr"),
+			error: write("stderr"),
+			assert: (condition, ...message) => {
+				if (!condition) {
+					throw new AssertionError({ message: message.length ? message.map(formatValue).join(" ") : "console.assert" });
+				}
+			},
+		},
+		module,
+		exports: module.exports,
+		require,
+		expect: (actual) => makeExpect(actual),
+		describe: (name, body) => {
+			prefixes.push(name);
+			try {
+				body();
+			} finally {
+				prefixes.pop();
+			}
+		},
+		it,
+		test: it,
+		beforeEach: () => {},
+		afterEach: () => {},
+	};
+	for (const [name, value] of Object.entries(globals)) {
+		globalThis[name] = value;
+	}
+
+	// Run one test case, keeping its output apart; the worker reads the outcome with take()
+	const run = async (name, body) => {
+		const record = Object.assign(Object.create(null), { name: String(name), error: null, done: false, stdout: "", stderr: "" });
+		current = record;
+		buffers = record;
+		try {
+			await body();
+		} catch (exception) {
+			record.error = formatError(exception);
+		}
+		record.done = true;
+		if (buffers === record) {
+			buffers = output;
+		}
+	};
+
+	Object.defineProperty(globalThis, "__sandbox", {
+		value: Object.freeze({
+			// Hand the snippet's top level and exported names to the tests as plain globals, so a
+			// test may also re-import them
+			load: (factory) => {
+				const declared = factory(module, module.exports, require);
+				for (const [name, value] of Object.entries({ ...declared, ...module.exports })) {
+					if (!(name in globalThis)) {
+						globalThis[name] = value;
+					}
+				}
+			},
+			run,
+			registered: () => registered.length,
+			runRegistered: (index) => run(registered[index].name, registered[index].body),
+			// The last case's outcome as JSON, or null when none ran
+			take: () => {
+				const record = current;
+				current = null;
+				buffers = output;
+				return record === null ? null : stringify(record);
+			},
+			output: () => stringify(output),
+		}),
+		writable: false,
+		configurable: false,
+		enumerable: false,
+	});
+}
+
+const PRELUDE = `(${sandboxApi})();`;
+
+// A string handed back by the job's context; anything else means the job tampered with its API
+function fromContext(value) {
+	if (typeof value !== "string") {
+		throw new Error("The sandbox API was tampered with");
+	}
+	return JSON.parse(value);
+}
+
+// Source running one test statement as a case, returning the statement's value so a promise it
+// evaluates to is awaited; statements that are not expressions run as a block
+function caseSource(statement) {
+	const name = JSON.stringify(statement);
+	const expression = statement.replace(/;\s*$/, "");
+	const source = `__sandbox.run(${name}, () => (\n${expression}\n));`;
+	try {
+		new vm.Script(source);
+		return source;
+	} catch (error) {
+		return `__sandbox.run(${name}, () => {\n${statement}\n});`;
+	}
+}
+
+async function runJob(job) {
+	const limits = job.limits;
+	const timeout = limits.cpu_seconds * 1000;
+	const workdir = fs.mkdtempSync(path.join(os.tmpdir(), "snippet-"));
+
+	const result = { tests: [], error: null, timed_out: false };
+	const started = process.hrtime.bigint();
+	// A new context per job, on a prototype-less global so no object of the worker is reachable
+	// from it. Its promise jobs run at the end of each evaluation, within the evaluation's timeout
+	const context = vm.createContext(Object.create(null), {
+		codeGeneration: { strings: false, wasm: false },
+		microtaskMode: "afterEvaluate",
+	});
+	const execute = (source, filename) => new vm.Script(source, { filename }).runInContext(context, { timeout });
+	const runCase = (source) => {
+		const caseStarted = process.hrtime.bigint();
+		let error = null;
+		try {
+			execute(source, "tests.js");
+		} catch (exception) {
+			error = formatError(exception);
+		}
+		const record = fromContext(execute("__sandbox.take()", "sandbox.js") ?? "null");
+		if (record === null) {
+			return;
+		}
+		if (error === null && record.error === null && !record.done) {
+			error = "Timed out: the test's promise never settled";
+		}
+		error = error ?? record.error;
+		result.tests.push({
+			name: String(record.name),
+			passed: error === null,
+			error: error === null ? null : String(error),
+			duration_ms: Number(process.hrtime.bigint() - caseStarted) / 1e6,
+			stdout: String(record.stdout),
+			stderr: String(record.stderr),
+		});
+	};
+
+	try {
+		fs.writeFileSync(path.join(workdir, "solution.js"), job.code);
+		execute(PRELUDE, "sandbox.js");
+
+		// Run the snippet in its own scope like a CommonJS module
+		const code = toScript(job.code);
+		const names = topLevelNames(code);
+		execute(
+			`__sandbox.load(function (module, exports, require) {\n${code}\n;return {${names.map((name) => `${name}: ${name}`).join(", ")}};\n});`,
+			"solution.js",
+		);
+
+		for (const statement of splitStatements(toScript(job.tests))) {
+			const script = new vm.Script(statement, { filename: "tests.js" });
+			if (SETUP_PATTERN.test(statement) || /^(describe|it|test)\s*\(/.test(statement)) {
+				script.runInContext(context, { timeout });
+			} else {
+				runCase(caseSource(statement));
+			}
+		}
+		const count = execute("__sandbox.registered()", "sandbox.js");
+		if (typeof count !== "number") {
+			throw new Error("The sandbox API was tampered with");
+		}
+		for (let index = 0; index < count; index++) {
+			runCase(`__sandbox.runRegistered(${index});`);
+		}
+	} catch (exception) {
+		result.error = formatError(exception);
+		result.timed_out = /timed out/i.test(result.error);
+	} finally {
+		fs.rmSync(workdir, { recursive: true, force: true });
+	}
+
+	let output = { stdout: "", stderr: "" };
+	try {
+		output = fromContext(execute("__sandbox.output()", "sandbox.js"));
+	} catch (exception) {
+		// Output is only lost, the results above stand
+	}
+	result.stdout = String(output.stdout).slice(-10000);
+	result.stderr = String(output.stderr).slice(-10000);
+	result.duration_ms = Number(process.hrtime.bigint() - started) / 1e6;
+	return result;
+}
+
+const lines = readline.createInterface({ input: process.stdin });
+let queue = Promise.resolve();
+lines.on("line", (line) => {
+	queue = queue.then(async () => {
+		let result;
+		try {
+			result = await runJob(JSON.parse(line));
+		} catch (exception) {
+			result = { tests: [], error: `Sandbox failure: ${formatError(exception)}`, timed_out: false, duration_ms: 0 };
+		}
+		process.stdout.write(JSON.stringify(result) + "\n");
+	});
+});
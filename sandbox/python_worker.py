@@ -0,0 +1,289 @@
+import io
+import os
+import sys
+import ast
+import json
+import time
+import ctypes
+import select
+import shutil
+import signal
+import resource
+import tempfile
+import unittest
+import traceback
+import contextlib
+
+# Warm worker for running Python snippets against their tests.
+# The runner starts this script once, inside a bubblewrap jail with its own user, PID and network
+# namespaces and a read-only file system, and sends one JSON job per line on stdin. Each job is
+# executed in a forked child so the interpreter start-up cost is paid only once per worker, while
+# every job still gets a fresh process with its own resource limits and temp directory. The JSON
+# result is written back as a single line on stdout. Started with --jailed, the worker also kills
+# every process a job left behind and empties /tmp after each job, so nothing carries over.
+
+JAILED = "--jailed" in sys.argv[1:]
+
+PR_SET_DUMPABLE = 4
+
+# Audit events a snippet is stopped at early. Only a first line of defence, as ctypes and the
+# like get around audit hooks; the jail is what contains a snippet
+BLOCKED_EVENTS = {
+	"socket.connect",
+	"socket.bind",
+	"socket.getaddrinfo",
+	"socket.sendto",
+	"subprocess.Popen",
+	"os.system",
+	"os.exec",
+	"os.posix_spawn",
+	"os.fork",
+	"os.forkpty",
+	"os.kill",
+}
+
+# Statement types treated as test setup rather than as a test case of their own
+SETUP_STATEMENTS = (
+	ast.Import,
+	ast.ImportFrom,
+	ast.FunctionDef,
+	ast.AsyncFunctionDef,
+	ast.ClassDef,
+	ast.Assign,
+	ast.AnnAssign,
+	ast.AugAssign,
+)
+
+
+# Directories a snippet may open files from: its working directory and the Python installation
+READABLE_PREFIXES = tuple(
+	{os.path.realpath(prefix) + os.sep for prefix in (sys.prefix, sys.base_prefix, sys.exec_prefix)}
+)
+
+
+def make_audit_hook(workdir):
+	allowed = READABLE_PREFIXES + (os.path.realpath(workdir) + os.sep, "/dev/null", "/dev/urandom")
+
+	def audit(event, args):
+		if event in BLOCKED_EVENTS:
+			raise PermissionError(f"{event} is not allowed in the sandbox")
+		if event == "open" and isinstance(args[0], (str, bytes)):
+			path = os.path.realpath(os.fsdecode(args[0]))
+			if not path.startswith(allowed) and path not in allowed:
+				raise PermissionError(f"Access to {path} is not allowed in the sandbox")
+
+	return audit
+
+
+def apply_limits(limits):
+	cpu = limits["cpu_seconds"]
+	memory = limits["memory_mb"] * 1024 * 1024
+	resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu + 1))
+	resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+	resource.setrlimit(resource.RLIMIT_FSIZE, (limits["file_size_mb"] * 1024 * 1024,) * 2)
+	resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+
+
+# Failure reported by a unittest case, carrying the already formatted error line
+class CaseFailure(Exception):
+	pass
+
+
+# Run a callable while capturing its output, returning a result entry for one test case
+def run_case(name, function):
+	stdout = io.StringIO()
+	stderr = io.StringIO()
+	started = time.perf_counter()
+	error = None
+	try:
+		with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+			function()
+	except CaseFailure as exception:
+		error = str(exception)
+	except AssertionError as exception:
+		error = f"AssertionError: {exception}" if str(exception) else "AssertionError"
+	except Exception as exception:
+		error = f"{type(exception).__name__}: {exception}"
+	return {
+		"name": name,
+		"passed": error is None,
+		"error": error,
+		"duration_ms": round((time.perf_counter() - started) * 1000, 3),
+		"stdout": stdout.getvalue(),
+		"stderr": stderr.getvalue(),
+	}
+
+
+def run_unittest_case(case):
+	result = unittest.TestResult()
+	case.run(result)
+	problems = result.failures + result.errors
+	if problems:
+		raise CaseFailure(problems[0][1].strip().splitlines()[-1])
+	if result.skipped:
+		raise CaseFailure(f"Skipped: {result.skipped[0][1]}")
+
+
+# Execute the code and split the tests into individually reported cases
+def run_tests(code, tests):
+	namespace = {"__name__": "__sandbox__"}
+	exec(compile(code, "solution.py", "exec"), namespace)
+
+	tree = ast.parse(tests, "tests.py")
+	results = []
+	for statement in tree.body:
+		source = ast.get_source_segment(tests, statement) or ast.unparse(statement)
+		module = ast.Module(body=[statement], type_ignores=[])
+		compiled = compile(module, "tests.py", "exec")
+		if isinstance(statement, SETUP_STATEMENTS) or _is_main_guard(statement):
+			exec(compiled, namespace)
+		else:
+			results.append(run_case(source.strip(), lambda compiled=compiled: exec(compiled, namespace)))
+
+	# Test functions and unittest cases defined by the tests are each reported on their own
+	for name, value in list(namespace.items()):
+		if isinstance(value, type) and issubclass(value, unittest.TestCase) and value is not unittest.TestCase:
+			for method in unittest.TestLoader().getTestCaseNames(value):
+				case = value(method)
+				results.append(run_case(f"{name}.{method}", lambda case=case: run_unittest_case(case)))
+		elif name.startswith("test") and callable(value) and not isinstance(value, type):
+			if not any(result["name"].startswith(f"{name}(") for result in results):
+				results.append(run_case(name, value))
+	return results
+
+
+# An "if __name__ == '__main__':" block usually just calls the tests that are collected anyway
+def _is_main_guard(statement):
+	return (
+		isinstance(statement, ast.If)
+		and isinstance(statement.test, ast.Compare)
+		and isinstance(statement.test.left, ast.Name)
+		and statement.test.left.id == "__name__"
+	)
+
+
+def child(job, workdir, write_fd):
+	os.chdir(workdir)
+	with open("solution.py", "w") as handle:
+		handle.write(job["code"])
+	sys.path.insert(0, workdir)
+
+	apply_limits(job["limits"])
+	sys.addaudithook(make_audit_hook(workdir))
+
+	stdout = io.StringIO()
+	stderr = io.StringIO()
+	payload = {"tests": [], "error": None}
+	try:
+		with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+			payload["tests"] = run_tests(job["code"], job["tests"])
+	except MemoryError:
+		payload["error"] = "MemoryError: memory limit exceeded"
+	except BaseException as exception:
+		payload["error"] = "".join(traceback.format_exception_only(type(exception), exception)).strip()
+	payload["stdout"] = stdout.getvalue()[-10000:]
+	payload["stderr"] = stderr.getvalue()[-10000:]
+
+	data = json.dumps(payload).encode("utf-8")
+	while data:
+		written = os.write(write_fd, data)
+		data = data[written:]
+	os._exit(0)
+
+
+def run_job(job):
+	workdir = tempfile.mkdtemp(prefix="snippet-")
+	try:
+		return supervise(job, workdir)
+	finally:
+		shutil.rmtree(workdir, ignore_errors=True)
+		if JAILED:
+			clean_up()
+
+
+# Kill whatever a job left running and remove what it left in /tmp. Only done in the jail, where
+# the worker's PID namespace holds nothing but the jail's init, the worker and a job's processes
+def clean_up():
+	try:
+		os.kill(-1, signal.SIGKILL)
+	except ProcessLookupError:
+		pass
+	for entry in os.scandir(tempfile.gettempdir()):
+		if entry.is_dir(follow_symlinks=False):
+			shutil.rmtree(entry.path, ignore_errors=True)
+		else:
+			with contextlib.suppress(OSError):
+				os.unlink(entry.path)
+
+
+# Jobs run as the worker's own user, so the worker makes itself non-dumpable to keep them from
+# tracing it or writing to its memory through /proc
+def protect():
+	libc = ctypes.CDLL(None, use_errno=True)
+	if libc.prctl(PR_SET_DUMPABLE, 0, 0, 0, 0) != 0:
+		error = ctypes.get_errno()
+		raise OSError(error, os.strerror(error))
+
+
+# Fork the child for one job and collect its report within the wall clock limit
+def supervise(job, workdir):
+	read_fd, write_fd = os.pipe()
+	started = time.perf_counter()
+	pid = os.fork()
+	if pid == 0:
+		os.close(read_fd)
+		try:
+			child(job, workdir, write_fd)
+		finally:
+			os._exit(1)
+	os.close(write_fd)
+
+	chunks = []
+	timed_out = False
+	deadline = started + job["limits"]["wall_seconds"]
+	while True:
+		remaining = deadline - time.perf_counter()
+		if remaining <= 0:
+			timed_out = True
+			os.kill(pid, signal.SIGKILL)
+			break
+		ready, _, _ = select.select([read_fd], [], [], remaining)
+		if ready:
+			chunk = os.read(read_fd, 65536)
+			if not chunk:
+				break
+			chunks.append(chunk)
+	os.close(read_fd)
+	_, status = os.waitpid(pid, 0)
+	elapsed = round((time.perf_counter() - started) * 1000, 3)
+
+	if timed_out:
+		return {"tests": [], "error": "Timed out: wall clock limit exceeded", "timed_out": True, "duration_ms": elapsed}
+	try:
+		payload = json.loads(b"".join(chunks))
+	except ValueError:
+		# The child died before reporting, usually from the CPU or memory limit
+		reason = f"signal {os.WTERMSIG(status)}" if os.WIFSIGNALED(status) else f"exit code {os.WEXITSTATUS(status)}"
+		if os.WIFSIGNALED(status) and os.WTERMSIG(status) in (signal.SIGXCPU, signal.SIGKILL):
+			reason = "CPU time limit exceeded"
+		payload = {"tests": [], "error": f"Sandbox process terminated: {reason}"}
+	payload["timed_out"] = False
+	payload["duration_ms"] = elapsed
+	return payload
+
+
+def main():
+	if JAILED:
+		protect()
+	for line in sys.stdin:
+		job = json.loads(line)
+		try:
+			result = run_job(job)
+		except Exception as exception:
+			result = {"tests": [], "error": f"Sandbox failure: {exception}", "timed_out": False, "duration_ms": 0}
+		sys.stdout.write(json.dumps(result) + "\n")
+		sys.stdout.flush()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,230 @@
+import re
+import math
+import zlib
+import numpy as np
+
+import settings
+
+# In-memory index of past code generation prompts for finding paraphrases of a new one.
+# A prompt is embedded as hashed features, its words, pairs of neighbouring words and the character
+# trigrams of each word so "reversing" still meets "reverse", weighted by TF-IDF and normalised, so
+# the dot product of two rows is their cosine similarity. Prompts naming different programming
+# languages or numbers never match, however close the rest of their wording is. A search can also
+# ask for prompts with the same key words, so a long prompt that differs in one word such as "odd"
+# for "even" is not taken for a rewording of the other.
+
+# Buckets the features are hashed into
+DIMENSIONS = 512
+
+# Share of a word's weight spread over its character trigrams, the rest stays on the whole word
+TRIGRAM_WEIGHT = 0.5
+
+# Weight of each pair of neighbouring words, relative to a single word
+BIGRAM_WEIGHT = 0.5
+
+# Candidates checked for compatible languages and numbers after the similarity ranking
+CANDIDATES = 20
+
+# The document frequencies are only recomputed once the index has grown by this fraction
+REBUILD_GROWTH = 0.25
+
+WORD = re.compile(r"[a-z0-9+#]+")
+# The verb of a request such as "write a python function to", which unlike "write a csv file"
+# says nothing about the code itself
+REQUEST = re.compile(
+	r"\b(?:write|create|make|generate|implement|build|give)\b(?=(?:\s+\S+){0,3}?\s+(?:function|program|script|snippet|method|class|code)\b)"
+)
+
+# Words that say nothing about the code asked for
+STOP_WORDS = {
+	"a", "an", "the", "in", "on", "to", "of", "for", "that", "which", "with", "and", "or", "is", "it",
+	"me", "my", "i", "please", "can", "you", "using", "use", "create", "make", "give",
+	"implement", "build", "function", "code", "program", "snippet", "method", "some", "given", "how",
+	"do", "does", "would", "should", "want", "need", "like", "from", "into", "by", "as", "be",
+}
+
+# Programming languages a prompt may ask for; two prompts naming different ones never match
+LANGUAGES = {
+	"python", "javascript", "js", "typescript", "ts", "java", "go", "golang", "rust", "ruby", "php",
+	"c", "c++", "cpp", "c#", "csharp", "kotlin", "swift", "scala", "sql", "bash", "shell", "haskell",
+}
+LANGUAGE_ALIASES = {"js": "javascript", "ts": "typescript", "golang": "go", "cpp": "c++", "csharp": "c#"}
+
+# Endings dropped from key words, so "reversing" and "reverse" are the same key word
+SUFFIXES = ("ing", "es", "ed", "s", "e")
+
+
+def _stem(word):
+	for suffix in SUFFIXES:
+		if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+			return word[:-len(suffix)]
+	return word
+
+
+# Hashed feature counts of a prompt, the languages and numbers it names and its key words
+def features(text):
+	counts = {}
+	guards = set()
+	words = set()
+	previous = None
+
+	def count(feature, weight):
+		bucket = zlib.crc32(feature.encode("utf-8")) % DIMENSIONS
+		counts[bucket] = counts.get(bucket, 0) + weight
+
+	for word in WORD.findall(REQUEST.sub(" ", text.lower())):
+		if word in STOP_WORDS:
+			continue
+		if word in LANGUAGES or word.isdigit():
+			guards.add(LANGUAGE_ALIASES.get(word, word))
+		else:
+			words.add(_stem(word))
+			# Pairs of neighbouring words tell "celsius to fahrenheit" from "fahrenheit to celsius"
+			if previous:
+				count(f"{previous} {word}", BIGRAM_WEIGHT)
+			previous = word
+		count(word, 1.0)
+		padded = f"#{word}#"
+		trigrams = [padded[index:index + 3] for index in range(len(padded) - 2)]
+		for trigram in trigrams:
+			count(trigram, TRIGRAM_WEIGHT / len(trigrams))
+	buckets = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+	weights = np.fromiter((math.log1p(value) for value in counts.values()), dtype=np.float32, count=len(counts))
+	return buckets, weights, frozenset(guards), frozenset(words)
+
+
+class PromptIndex:
+	def __init__(self, max_entries):
+		self.max_entries = max_entries
+		# While a replacement index is built, the prompts added and the snippets removed meanwhile,
+		# to replay on it
+		self.changes = None
+		self.clear()
+
+	def clear(self):
+		self.ids = []
+		self.entries = []
+		self.rows = {}
+		self.matrix = np.zeros((0, DIMENSIONS), dtype=np.float32)
+		self.document_frequency = np.zeros(DIMENSIONS, dtype=np.float32)
+		self.idf = np.ones(DIMENSIONS, dtype=np.float32)
+		self.built = 0
+
+	def __len__(self):
+		return len(self.ids)
+
+	# Replace the index with (snippet_id, prompt) pairs, oldest first
+	def load(self, prompts):
+		self.clear()
+		for snippet_id, prompt in prompts[-self.max_entries:]:
+			self._append(snippet_id, features(prompt))
+		self._rebuild()
+
+	def add(self, snippet_id, prompt):
+		if self.changes is not None:
+			self.changes.append((snippet_id, prompt))
+		entry = features(prompt)
+		row = self.rows.get(snippet_id)
+		if row is not None:
+			# A snippet generated again keeps its row with the new prompt
+			self.document_frequency[self.entries[row][0]] -= 1
+			self.document_frequency[entry[0]] += 1
+			self.entries[row] = entry
+			self.matrix[row] = self._vector(entry)
+			return
+
+		self._append(snippet_id, entry)
+		if len(self.ids) > self.max_entries:
+			# Evict the oldest tenth at once rather than one prompt per addition
+			self._evict(len(self.ids) - self.max_entries * 9 // 10)
+			self._rebuild()
+		elif len(self.ids) > self.built * (1 + REBUILD_GROWTH):
+			self._rebuild()
+		else:
+			self._grow()
+			self.matrix[len(self.ids) - 1] = self._vector(self.entries[-1])
+
+	def remove(self, snippet_id):
+		if self.changes is not None:
+			self.changes.append((snippet_id, None))
+		row = self.rows.pop(snippet_id, None)
+		if row is not None:
+			self.document_frequency[self.entries[row][0]] -= 1
+			del self.ids[row]
+			del self.entries[row]
+			self.matrix = np.delete(self.matrix, row, axis=0)
+			for position, moved in enumerate(self.ids[row:], start=row):
+				self.rows[moved] = position
+
+	# Apply the changes recorded on another index, adding prompts and removing snippets
+	def replay(self, changes):
+		for snippet_id, prompt in changes:
+			if prompt is None:
+				self.remove(snippet_id)
+			else:
+				self.add(snippet_id, prompt)
+
+	# Snippet ids of the prompts most similar to this one, with their cosine similarity, best first.
+	# Only prompts naming the same languages and numbers are considered, and with same_words only
+	# those with the same key words too
+	def search(self, prompt, limit=5, exclude=None, same_words=False):
+		if not self.ids:
+			return []
+		entry = features(prompt)
+		scores = self.matrix[:len(self.ids)] @ self._vector(entry)
+		count = min(CANDIDATES, len(scores))
+		candidates = np.argpartition(-scores, count - 1)[:count]
+		matches = []
+		for row in candidates[np.argsort(-scores[candidates])]:
+			candidate = self.entries[row]
+			if self.ids[row] != exclude and candidate[2] == entry[2] and (not same_words or candidate[3] == entry[3]):
+				matches.append((self.ids[row], float(scores[row])))
+				if len(matches) == limit:
+					break
+		return matches
+
+	# Whether the snippet's prompt has the same key words as this one
+	def same_words(self, snippet_id, prompt):
+		row = self.rows.get(snippet_id)
+		return row is not None and self.entries[row][3] == features(prompt)[3]
+
+	def _append(self, snippet_id, entry):
+		self.rows[snippet_id] = len(self.ids)
+		self.ids.append(snippet_id)
+		self.entries.append(entry)
+		self.document_frequency[entry[0]] += 1
+
+	# Forget the oldest prompts; the matrix is left stale until the caller rebuilds it
+	def _evict(self, count):
+		for entry in self.entries[:count]:
+			self.document_frequency[entry[0]] -= 1
+		del self.ids[:count]
+		del self.entries[:count]
+		self.rows = {snippet_id: row for row, snippet_id in enumerate(self.ids)}
+
+	# Normalised TF-IDF vector of an entry
+	def _vector(self, entry):
+		vector = np.zeros(DIMENSIONS, dtype=np.float32)
+		vector[entry[0]] = entry[1] * self.idf[entry[0]]
+		norm = np.linalg.norm(vector)
+		return vector / norm if norm else vector
+
+	# Room for one more row, doubling the matrix when it is full
+	def _grow(self):
+		if len(self.ids) > len(self.matrix):
+			grown = np.zeros((max(16, 2 * len(self.matrix)), DIMENSIONS), dtype=np.float32)
+			grown[:len(self.matrix)] = self.matrix
+			self.matrix = grown
+
+	# Recompute the IDF weights from the current document frequencies and every row with them
+	def _rebuild(self):
+		count = len(self.ids)
+		self.idf = (np.log((1 + count) / (1 + self.document_frequency)) + 1).astype(np.float32)
+		self.matrix = np.zeros((max(16, count), DIMENSIONS), dtype=np.float32)
+		for row, entry in enumerate(self.entries):
+			self.matrix[row] = self._vector(entry)
+		self.built = count
+
+
+# Prompts of the stored snippets, loaded at startup and kept up to date as code is generated
+prompt_index = PromptIndex(settings.SEMANTIC_INDEX_SIZE)
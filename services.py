@@ -0,0 +1,229 @@
+import db
+import llm
+import users
+import runner
+import metrics
+import prompts
+import semantic
+import settings
+import jsonstream
+import resilience
+
+
+# Define the messages for each action from the stored snippet and the user's input
+def generate_code_messages(snippet, code_generation):
+	return prompts.messages("generate_code", request=code_generation)
+
+
+def improve_code_messages(snippet, code_feedback):
+	return prompts.messages("improve_code", code=prompts.code_text(snippet), feedback=code_feedback)
+
+
+def generate_tests_messages(snippet):
+	return prompts.messages("generate_test_cases", code=prompts.code_text(snippet))
+
+
+def improve_tests_messages(snippet, tests_feedback):
+	return prompts.messages(
+		"improve_test_cases",
+		code=prompts.code_text(snippet),
+		tests=prompts.tests_text(snippet),
+		feedback=tests_feedback,
+	)
+
+
+def run_tests_messages(snippet):
+	return prompts.messages("run_test_code", code=prompts.code_text(snippet), tests=prompts.tests_text(snippet))
+
+
+def regenerate_code_messages(snippet, failures=""):
+	return prompts.messages(
+		"regenerate_code", code=prompts.code_text(snippet), tests=prompts.tests_text(snippet), failures=failures
+	)
+
+
+# Define the snippet columns each action updates from the model's parsed response
+def generated_code_fields(data):
+	return {
+		"name": data["ShortCodeName"],
+		"coding_language": data["CodingLanguage"],
+		"communication_language": data["CommunicationLanguage"],
+		"code": data["Code"],
+	}
+
+
+def code_fields(data):
+	return {
+		"coding_language": data["CodingLanguage"],
+		"communication_language": data["CommunicationLanguage"],
+		"code": data["Code"],
+	}
+
+
+def tests_fields(data):
+	bot_tests = data["Tests"]
+
+	if isinstance(bot_tests, list):
+		tests = "\n".join(bot_tests)
+	else:
+		tests = bot_tests
+
+	return {
+		"coding_language": data["CodingLanguage"],
+		"communication_language": data["CommunicationLanguage"],
+		"tests": tests,
+	}
+
+
+def languages_fields(data):
+	return {
+		"coding_language": data["CodingLanguage"],
+		"communication_language": data["CommunicationLanguage"],
+	}
+
+
+# Model backed actions by endpoint name: how to build the messages and which columns the result updates
+ACTIONS = {
+	"generate_code": (generate_code_messages, generated_code_fields),
+	"improve_code": (improve_code_messages, code_fields),
+	"generate_test_cases": (generate_tests_messages, tests_fields),
+	"improve_test_cases": (improve_tests_messages, tests_fields),
+	"regenerate_code": (regenerate_code_messages, code_fields),
+}
+
+# The user input each action takes, by its form field name, or None for actions without input
+ACTION_INPUTS = {
+	"generate_code": "code_generation",
+	"improve_code": "code_feedback",
+	"generate_test_cases": None,
+	"improve_test_cases": "tests_feedback",
+	"regenerate_code": None,
+}
+
+
+# An earlier snippet with code whose prompt is a rewording of this one, or None. Its code is used
+# without asking the model, so the prompts must share their key words as well as score highly;
+# closer calls are only offered through similar_snippets
+def reusable_snippet(snippet_id, prompt):
+	with metrics.timed(metrics.SEMANTIC_SEARCH_SECONDS, "semantic.search"):
+		matches = semantic.prompt_index.search(prompt, exclude=snippet_id, same_words=True)
+	for source_id, score in matches:
+		if score < settings.SEMANTIC_REUSE_THRESHOLD:
+			break
+		source = db.get_snippet(source_id)
+		if source is not None and source["code"] and users.can_access(source):
+			metrics.SEMANTIC_LOOKUPS.inc(outcome="reused")
+			return source
+	metrics.SEMANTIC_LOOKUPS.inc(outcome="miss")
+	return None
+
+
+# Earlier snippets with code whose prompts are similar to this one, as (snippet row, score) pairs
+def similar_snippets(prompt, limit=5):
+	with metrics.timed(metrics.SEMANTIC_SEARCH_SECONDS, "semantic.search"):
+		matches = semantic.prompt_index.search(prompt, limit=limit)
+	similar = []
+	for snippet_id, score in matches:
+		if score < settings.SEMANTIC_SUGGEST_THRESHOLD:
+			break
+		snippet = db.get_snippet(snippet_id)
+		if snippet is not None and snippet["code"] and users.can_access(snippet):
+			similar.append((snippet, score))
+	return similar
+
+
+def reused_fields(source):
+	return {
+		"name": source["name"],
+		"coding_language": source["coding_language"],
+		"communication_language": source["communication_language"],
+		"code": source["code"],
+	}
+
+
+# Keep the prompts code was generated from so later near duplicates can reuse it
+def remember_prompts(rows):
+	db.save_prompts(rows)
+	for snippet_id, prompt in rows:
+		semantic.prompt_index.add(snippet_id, prompt)
+
+
+# Delete a snippet and drop its prompt from the index
+def delete_snippet(snippet_id):
+	db.delete_snippet(snippet_id)
+	semantic.prompt_index.remove(snippet_id)
+
+
+# Run a model backed action for a snippet and return the updated snippet row.
+# Code generation for a near duplicate of an earlier prompt copies that snippet instead
+async def run_action(action, snippet_id, *inputs):
+	build_messages, fields = ACTIONS[action]
+	if action == "generate_code":
+		source = reusable_snippet(snippet_id, inputs[0])
+		if source is not None:
+			db.save_revision(snippet_id, reused_fields(source), f"reuse:{source['id']}")
+			return db.get_snippet(snippet_id)
+
+	snippet = db.get_snippet(snippet_id)
+	usage = {}
+	data = await llm.chat_json(action, build_messages(snippet, *inputs), usage=usage)
+	db.save_revision(snippet_id, fields(data), action, usage)
+	if action == "generate_code":
+		remember_prompts([(snippet_id, inputs[0])])
+	return db.get_snippet(snippet_id)
+
+
+# Stream a model backed action as ("delta", key, text) events while the model writes,
+# committing the complete response once and finishing with ("done", snippet_row)
+async def stream_action(action, snippet_id, *inputs):
+	build_messages, fields = ACTIONS[action]
+	if action == "generate_code":
+		source = reusable_snippet(snippet_id, inputs[0])
+		if source is not None:
+			db.save_revision(snippet_id, reused_fields(source), f"reuse:{source['id']}")
+			yield "delta", "Code", source["code"]
+			yield "done", None, db.get_snippet(snippet_id)
+			return
+
+	snippet = db.get_snippet(snippet_id)
+	parser = jsonstream.PartialJSONParser()
+	messages = build_messages(snippet, *inputs)
+	usage = {}
+	async for chunk in llm.stream_json(action, messages, usage=usage):
+		for key, text in parser.feed(chunk):
+			yield "delta", key, text
+
+	# An unusable reply is fixed with a follow up call rather than thrown away
+	data = await llm.check_reply(action, messages, "".join(parser.text), usage=usage)
+	db.save_revision(snippet_id, fields(data), action, usage)
+	if action == "generate_code":
+		remember_prompts([(snippet_id, inputs[0])])
+	yield "done", None, db.get_snippet(snippet_id)
+
+
+# Test a snippet's code against its tests without storing anything: locally when the language is
+# supported, otherwise by asking the model. Returns the pass or fail status, the local test run
+# (None for the model) and the snippet columns the model's answer updates
+async def check_tests(snippet, usage=None):
+	# Python and JavaScript run in the local sandbox, other languages are still judged by the model
+	language = runner.detect_language(snippet["coding_language"])
+	if runner.test_runner.supports(language):
+		test_run = await runner.test_runner.run(language, snippet["code"], snippet["tests"])
+		return test_run["status"], test_run, {}
+
+	# Replies cached before Status was checked can still hold it as a string
+	data = await llm.chat_json("run_test_code", run_tests_messages(snippet), usage=usage)
+	return resilience.passed(data["Status"]), None, languages_fields(data)
+
+
+# Run the snippet's tests and store the outcome.
+# Returns the snippet row, the pass or fail status and the local test run (None for the model)
+async def run_tests(snippet_id):
+	snippet = db.get_snippet(snippet_id)
+	status, test_run, fields = await check_tests(snippet)
+	if test_run is not None:
+		db.record_test_run(snippet_id, test_run)
+		return snippet, status, test_run
+
+	db.update_snippet(snippet_id, **fields)
+	return db.get_snippet(snippet_id), status, None
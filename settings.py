@@ -0,0 +1,151 @@
+import os
+from dotenv import load_dotenv
+
+# Load variables from the .env file before any module reads its configuration
+load_dotenv()
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
+# Maximum number of model calls allowed to run at the same time
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+# Maximum number of model calls allowed to wait for a free slot before new ones are rejected
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+# Seconds a queued model call may wait for a free slot before it is rejected
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+
+# Path of the SQLite database holding the snippets
+DATABASE_PATH = os.getenv("DATABASE_PATH", "snippet.db")
+# Number of snippets per sidebar page
+SNIPPETS_PAGE_SIZE = int(os.getenv("SNIPPETS_PAGE_SIZE", "50"))
+
+# Model response cache: in-memory LRU size, entry lifetime in seconds and an optional SQLite file tier
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "")
+LLM_CACHE_DISK_SIZE = int(os.getenv("LLM_CACHE_DISK_SIZE", "10000"))
+# Endpoints that always go to the model, by handler name
+LLM_CACHE_BYPASS = {
+	endpoint.strip()
+	for endpoint in os.getenv("LLM_CACHE_BYPASS", "improve_code,improve_test_cases").split(",")
+	if endpoint.strip()
+}
+
+# Local sandboxed test runner: warm workers per language and the limits applied to every run
+RUNNER_WORKERS = int(os.getenv("RUNNER_WORKERS", "2"))
+RUNNER_CPU_SECONDS = int(os.getenv("RUNNER_CPU_SECONDS", "5"))
+RUNNER_WALL_SECONDS = float(os.getenv("RUNNER_WALL_SECONDS", "10"))
+RUNNER_MEMORY_MB = int(os.getenv("RUNNER_MEMORY_MB", "256"))
+RUNNER_FILE_SIZE_MB = int(os.getenv("RUNNER_FILE_SIZE_MB", "10"))
+RUNNER_NODE = os.getenv("RUNNER_NODE", "node")
+# bubblewrap jail the workers run in, and the user and group they run as
+RUNNER_BWRAP = os.getenv("RUNNER_BWRAP", "bwrap")
+RUNNER_UID = int(os.getenv("RUNNER_UID", "65534"))
+RUNNER_GID = int(os.getenv("RUNNER_GID", "65534"))
+
+# Background job workers for the model backed actions
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "4"))
+# Seconds a process's claim on a running job lasts unless renewed, and between looks for jobs queued elsewhere
+JOBS_LEASE_SECONDS = float(os.getenv("JOBS_LEASE_SECONDS", "30"))
+JOBS_POLL_SECONDS = float(os.getenv("JOBS_POLL_SECONDS", "1"))
+
+# Default limits of the generate, test and regenerate repair loop
+REPAIR_MAX_ITERATIONS = int(os.getenv("REPAIR_MAX_ITERATIONS", "3"))
+REPAIR_MAX_TOKENS = int(os.getenv("REPAIR_MAX_TOKENS", "20000"))
+REPAIR_MAX_SECONDS = float(os.getenv("REPAIR_MAX_SECONDS", "120"))
+
+# Prompt registry version and the token budgets stored code and tests are cut down to in prompts
+PROMPT_VERSION = os.getenv("PROMPT_VERSION", "v2")
+PROMPT_CODE_TOKENS = int(os.getenv("PROMPT_CODE_TOKENS", "4000"))
+PROMPT_TESTS_TOKENS = int(os.getenv("PROMPT_TESTS_TOKENS", "2000"))
+
+# Level of the application log, which includes the token usage of every model call
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+
+# File the per-request trace spans are written to as JSON lines; empty disables tracing
+TRACE_LOG = os.getenv("TRACE_LOG", "")
+
+# Snippet versions stored in full every this many versions, the rest as deltas
+VERSIONS_SNAPSHOT_EVERY = int(os.getenv("VERSIONS_SNAPSHOT_EVERY", "20"))
+
+# Batch generation: concurrent model calls, model calls started per second (0 for no limit),
+# most prompts per batch and results committed together
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_RATE_PER_SECOND = float(os.getenv("BATCH_RATE_PER_SECOND", "0"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+BATCH_COMMIT_SIZE = int(os.getenv("BATCH_COMMIT_SIZE", "25"))
+
+# Model call deadlines: seconds one attempt may take (or a stream may stay silent) and seconds
+# a call may take overall, retries included
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "150"))
+# Retries of rate limited, failed or timed out model calls, with jittered exponential backoff
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "10"))
+# Follow up calls asking the model to fix a reply that is not JSON or lacks a key
+LLM_REPAIR_RETRIES = int(os.getenv("LLM_REPAIR_RETRIES", "1"))
+# Consecutive upstream failures that open the circuit breaker and seconds it stays open
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+# Seconds after which a slow model call is duplicated and the first reply wins; 0 disables hedging
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))
+
+# Model backend: "openai" for the OpenAI API or any compatible server at LLM_BASE_URL, or "fake"
+# for the deterministic in-process stand-in, which replies after LLM_FAKE_DELAY seconds
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+LLM_BASE_URL = os.getenv("LLM_BASE_URL") or None
+LLM_FAKE_DELAY = float(os.getenv("LLM_FAKE_DELAY", "0"))
+# Default model and sampling options; an empty temperature or 0 max tokens leaves the API default
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE")) if os.getenv("LLM_TEMPERATURE") else None
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "0"))
+
+
+# Per endpoint overrides of those options, e.g. LLM_MODEL_RUN_TEST_CODE=gpt-4o-mini
+def _routes():
+	routes = {}
+	for prefix, option, convert in (
+		("LLM_MODEL_", "model", str),
+		("LLM_TEMPERATURE_", "temperature", float),
+		("LLM_MAX_TOKENS_", "max_tokens", int),
+	):
+		for name, value in os.environ.items():
+			if name.startswith(prefix) and value:
+				routes.setdefault(name[len(prefix):].lower(), {})[option] = convert(value)
+	return routes
+
+
+LLM_ROUTES = _routes()
+
+# Check template files for changes on every render, for editing them while the server runs
+TEMPLATES_AUTO_RELOAD = os.getenv("TEMPLATES_AUTO_RELOAD", "false").lower() in ("1", "true", "yes")
+
+# Semantic prompt reuse: a code generation prompt at least SEMANTIC_REUSE_THRESHOLD similar to an
+# earlier one gets that snippet's code without a model call (above 1 turns reuse off), prompts at
+# least SEMANTIC_SUGGEST_THRESHOLD similar are offered as suggestions, and the SEMANTIC_INDEX_SIZE
+# most recent prompts are kept in the in-memory index
+SEMANTIC_REUSE_THRESHOLD = float(os.getenv("SEMANTIC_REUSE_THRESHOLD", "0.95"))
+SEMANTIC_SUGGEST_THRESHOLD = float(os.getenv("SEMANTIC_SUGGEST_THRESHOLD", "0.5"))
+SEMANTIC_INDEX_SIZE = int(os.getenv("SEMANTIC_INDEX_SIZE", "10000"))
+
+# Per user quotas: USER_REQUESTS_PER_MINUTE model calls with bursts of USER_REQUESTS_BURST, and
+# USER_TOKENS_PER_HOUR model tokens with bursts of USER_TOKENS_BURST; a rate of 0 turns a quota off
+USER_REQUESTS_PER_MINUTE = float(os.getenv("USER_REQUESTS_PER_MINUTE", "30"))
+USER_REQUESTS_BURST = int(os.getenv("USER_REQUESTS_BURST", "10"))
+USER_TOKENS_PER_HOUR = float(os.getenv("USER_TOKENS_PER_HOUR", "200000"))
+USER_TOKENS_BURST = int(os.getenv("USER_TOKENS_BURST", "50000"))
+# Days a session lasts, and sessions one client address may start per hour (0 for no limit)
+SESSION_DAYS = float(os.getenv("SESSION_DAYS", "30"))
+SESSIONS_PER_HOUR = float(os.getenv("SESSIONS_PER_HOUR", "20"))
+# Hand free model slots to the queued user with the fewest running calls instead of first come first served
+LLM_FAIR_SHARE = os.getenv("LLM_FAIR_SHARE", "true").lower() in ("1", "true", "yes")
+
+# Bulk export and import: snippets read per query and written per transaction
+TRANSFER_CHUNK_SIZE = int(os.getenv("TRANSFER_CHUNK_SIZE", "500"))
+# Online backups are written to BACKUP_DIR, keeping the newest BACKUP_KEEP (0 keeps them all); an
+# empty BACKUP_DIR turns backups off
+BACKUP_DIR = os.getenv("BACKUP_DIR", "")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+# Token admin routes such as backups expect in their X-Admin-Token header; empty turns them off
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
@@ -0,0 +1,15 @@
+import json
+from fastapi.responses import StreamingResponse
+
+# Helpers for the Server-Sent Events endpoints
+
+
+# Format one Server-Sent Events frame
+def sse_event(event, data):
+	return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def event_stream(events):
+	return StreamingResponse(
+		events, media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+	)
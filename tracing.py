@@ -0,0 +1,90 @@
+import json
+import time
+import uuid
+import logging
+import contextlib
+import contextvars
+
+import settings
+
+# Optional per-request trace spans. When TRACE_LOG is set, every HTTP request collects the
+# spans opened while it is handled (db queries, model calls, template renders, nested in the
+# order they ran) and writes them as one JSON line to that file once the response is sent.
+
+logger = logging.getLogger("trace")
+logger.propagate = False
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+	def __init__(self, name):
+		self.id = uuid.uuid4().hex
+		self.name = name
+		self.started = time.perf_counter()
+		self.spans = []
+		self.stack = []
+
+
+def enabled():
+	return bool(settings.TRACE_LOG)
+
+
+def configure():
+	if enabled() and not logger.handlers:
+		handler = logging.FileHandler(settings.TRACE_LOG)
+		handler.setFormatter(logging.Formatter("%(message)s"))
+		logger.addHandler(handler)
+		logger.setLevel(logging.INFO)
+
+
+# Whether the current request is being traced
+def active():
+	return _current.get() is not None
+
+
+# Collect the spans of one request; returns a callback that writes the trace with extra attributes
+def start(name):
+	trace = Trace(name)
+	token = _current.set(trace)
+
+	def finish(**attributes):
+		_current.reset(token)
+		record = {
+			"trace_id": trace.id,
+			"name": trace.name,
+			"duration_ms": round((time.perf_counter() - trace.started) * 1000, 3),
+			**attributes,
+			"spans": trace.spans,
+		}
+		logger.info(json.dumps(record))
+
+	return finish
+
+
+# Time a block as a span of the current request's trace; does nothing outside a traced request
+@contextlib.contextmanager
+def span(name, **attributes):
+	trace = _current.get()
+	if trace is None:
+		yield
+		return
+
+	record = {
+		"id": len(trace.spans) + 1,
+		"parent": trace.stack[-1]["id"] if trace.stack else None,
+		"name": name,
+		"start_ms": round((time.perf_counter() - trace.started) * 1000, 3),
+		**attributes,
+	}
+	trace.spans.append(record)
+	trace.stack.append(record)
+	started = time.perf_counter()
+	try:
+		yield
+	except BaseException as error:
+		record["error"] = type(error).__name__
+		raise
+	finally:
+		record["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+		trace.stack.remove(record)
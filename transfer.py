@@ -0,0 +1,321 @@
+import os
+import re
+import json
+import time
+import uuid
+import asyncio
+from fastapi import HTTPException
+
+import db
+import metrics
+import semantic
+import settings
+import versions
+import zipstream
+
+# Moving the snippet library in and out in bulk. Exports stream every snippet a user can see, as
+# JSONL with its prompt and code and tests history or as a zip of code and tests files, from a
+# generator reading TRANSFER_CHUNK_SIZE snippets at a time. Imports read JSONL in the export's
+# format as it arrives and insert TRANSFER_CHUNK_SIZE snippets per transaction. Backups copy the
+# database file with SQLite's online backup API.
+
+# Bytes gathered before an export yields, so a large export is not one thread hop per snippet
+YIELD_BYTES = 1 << 16
+
+# Failed lines reported back by an import; the rest are only counted
+MAX_IMPORT_ERRORS = 100
+
+DEFAULT_NAME = "Imported Snippet"
+
+# File extension of each coding language in the zip layout
+EXTENSIONS = {
+	"python": "py", "javascript": "js", "typescript": "ts", "java": "java", "go": "go", "rust": "rs",
+	"ruby": "rb", "php": "php", "c": "c", "c++": "cpp", "c#": "cs", "kotlin": "kt", "swift": "swift",
+	"scala": "scala", "sql": "sql", "bash": "sh", "shell": "sh", "haskell": "hs",
+}
+
+SLUG = re.compile(r"[^a-z0-9]+")
+
+# Only one backup runs at a time
+backup_lock = asyncio.Lock()
+# Only one import rebuilds the prompt index at a time, as the live index records one set of changes
+reindex_lock = asyncio.Lock()
+
+
+# One JSONL record: the snippet's fields and prompt, and the texts of each of its versions
+def snippet_record(row, history):
+	record = {
+		"id": row["id"],
+		"name": row["name"],
+		"coding_language": row["coding_language"],
+		"communication_language": row["communication_language"],
+		"code": row["code"],
+		"tests": row["tests"],
+		"prompt": row["prompt"],
+	}
+	if history:
+		texts = versions.replay((version["full"], version["body"]) for version in history)
+		record["versions"] = [
+			{
+				"version": version["version"],
+				"created_at": version["created_at"],
+				"source": version["source"],
+				"prompt_tokens": version["prompt_tokens"],
+				"completion_tokens": version["completion_tokens"],
+				**version_texts,
+			}
+			for version, version_texts in zip(history, texts)
+		]
+	return record
+
+
+# Yield the export as JSONL bytes, one snippet per line
+def export_jsonl(owner, with_versions=True):
+	pending = []
+	size = 0
+	count = 0
+	for row, history in db.export_snippets(owner, with_versions):
+		line = json.dumps(snippet_record(row, history), ensure_ascii=False).encode("utf-8") + b"\n"
+		pending.append(line)
+		size += len(line)
+		count += 1
+		if size >= YIELD_BYTES:
+			yield b"".join(pending)
+			pending, size = [], 0
+	yield b"".join(pending)
+	metrics.SNIPPETS_TRANSFERRED.inc(count, direction="export")
+
+
+# Folder of a snippet in the zip layout: its name made safe for a path, then its id
+def folder(row):
+	slug = SLUG.sub("-", row["name"].lower()).strip("-")[:40] or "snippet"
+	return f"{slug}-{row['id']}"
+
+
+# Yield the export as a zip holding a folder per snippet with its code and tests files
+def export_zip(owner):
+	archive = zipstream.ZipStream()
+	pending = []
+	size = 0
+	count = 0
+	try:
+		for row, _ in db.export_snippets(owner, with_versions=False):
+			extension = EXTENSIONS.get(row["coding_language"].strip().lower(), "txt")
+			for column in versions.COLUMNS:
+				if row[column]:
+					entry = archive.add(f"{folder(row)}/{column}.{extension}", row[column].encode("utf-8"))
+					pending.append(entry)
+					size += len(entry)
+			count += 1
+			if size >= YIELD_BYTES:
+				yield b"".join(pending)
+				pending, size = [], 0
+		yield b"".join(pending)
+		yield from archive.finish()
+	finally:
+		archive.close()
+	metrics.SNIPPETS_TRANSFERRED.inc(count, direction="export")
+
+
+def _text(value, key):
+	text = value.get(key) or ""
+	if not isinstance(text, str):
+		raise ValueError(f"{key} must be a string")
+	return text
+
+
+def _number(value, key, default):
+	number = value.get(key)
+	if number is None:
+		return default
+	if isinstance(number, bool) or not isinstance(number, (int, float)):
+		raise ValueError(f"{key} must be a number")
+	return number
+
+
+# Parse one line of an export into the (snippet row, version rows, prompt) triple db.import_snippets
+# takes. The snippet keeps its id when it has one, and its versions are stored again from their texts
+def import_item(line, owner):
+	value = json.loads(line)
+	if not isinstance(value, dict):
+		raise ValueError("Expected a JSON object")
+	snippet_id = value.get("id") or str(uuid.uuid4())
+	if not isinstance(snippet_id, str):
+		raise ValueError("id must be a string")
+	history = value.get("versions") or []
+	if not isinstance(history, list) or not all(isinstance(version, dict) for version in history):
+		raise ValueError("versions must be a list of objects")
+	prompt = value.get("prompt")
+	if prompt is not None and not isinstance(prompt, str):
+		raise ValueError("prompt must be a string")
+
+	texts = [{column: _text(version, column) for column in versions.COLUMNS} for version in history]
+	now = time.time()
+	rows = [
+		(
+			snippet_id,
+			number,
+			_number(version, "created_at", now),
+			_text(version, "source") or "import",
+			int(_number(version, "prompt_tokens", 0)),
+			int(_number(version, "completion_tokens", 0)),
+			int(full),
+			body,
+		)
+		for number, (version, (full, body)) in enumerate(
+			zip(history, versions.encode(texts, settings.VERSIONS_SNAPSHOT_EVERY)), start=1
+		)
+	]
+	snippet = (
+		snippet_id,
+		_text(value, "name") or DEFAULT_NAME,
+		_text(value, "code"),
+		_text(value, "tests"),
+		_text(value, "coding_language"),
+		_text(value, "communication_language"),
+		owner,
+	)
+	return snippet, rows, prompt or None
+
+
+# Parse and insert one chunk of (line number, line) pairs. Returns the inserted triples, how many
+# were skipped as already present, and the failed lines with their errors
+def _import_chunk(lines, owner):
+	items = {}
+	failed = []
+	skipped = 0
+	for number, line in lines:
+		try:
+			item = import_item(line, owner)
+		except (ValueError, TypeError) as error:
+			failed.append({"line": number, "error": str(error)})
+			continue
+		if item[0][0] in items:
+			skipped += 1
+		else:
+			items[item[0][0]] = item
+	inserted = db.import_snippets(list(items.values())) if items else []
+	return inserted, skipped + len(items) - len(inserted), failed
+
+
+# Split a stream of byte chunks into lines
+async def lines(chunks):
+	pending = b""
+	async for chunk in chunks:
+		pending += chunk
+		*complete, pending = pending.split(b"\n")
+		for line in complete:
+			yield line
+	if pending:
+		yield pending
+
+
+# The chunks of an uploaded file
+async def upload_chunks(upload):
+	while chunk := await upload.read(YIELD_BYTES):
+		yield chunk
+
+
+def _reload_prompt_index():
+	index = semantic.PromptIndex(settings.SEMANTIC_INDEX_SIZE)
+	index.load(db.list_prompts(settings.SEMANTIC_INDEX_SIZE))
+	return index
+
+
+# Replace the prompt index with one rebuilt from the database on a worker thread. Prompts added and
+# snippets deleted while it is built are replayed on it, as its read may have missed them
+async def _rebuild_prompt_index():
+	async with reindex_lock:
+		live = semantic.prompt_index
+		live.changes = []
+		try:
+			index = await asyncio.to_thread(_reload_prompt_index)
+		finally:
+			changes, live.changes = live.changes, None
+		index.replay(changes)
+		semantic.prompt_index = index
+
+
+# Import JSONL lines for the owner, parsing and inserting each chunk on a worker thread while the
+# next one is read. Returns how many snippets were imported, skipped because their id was taken,
+# and failed, with the first MAX_IMPORT_ERRORS failures
+async def import_lines(source, owner):
+	started = time.perf_counter()
+	summary = {"imported": 0, "skipped": 0, "failed": 0, "errors": []}
+	prompts = False
+	chunk = []
+	running = None
+
+	async def finish(task):
+		nonlocal prompts
+		inserted, skipped, failed = await task
+		summary["imported"] += len(inserted)
+		summary["skipped"] += skipped
+		summary["failed"] += len(failed)
+		summary["errors"].extend(failed[:MAX_IMPORT_ERRORS - len(summary["errors"])])
+		prompts = prompts or any(prompt for _, _, prompt in inserted)
+		metrics.SNIPPETS_TRANSFERRED.inc(len(inserted), direction="import")
+
+	try:
+		number = 0
+		async for line in source:
+			number += 1
+			if line.strip():
+				chunk.append((number, line))
+			if len(chunk) >= settings.TRANSFER_CHUNK_SIZE:
+				if running is not None:
+					await finish(running)
+				running = asyncio.ensure_future(asyncio.to_thread(_import_chunk, chunk, owner))
+				chunk = []
+		if running is not None:
+			await finish(running)
+			running = None
+		if chunk:
+			await finish(asyncio.to_thread(_import_chunk, chunk, owner))
+	finally:
+		if running is not None:
+			# Let a chunk already being written finish rather than abandon its transaction
+			await asyncio.gather(running, return_exceptions=True)
+
+	if prompts:
+		# Index the imported prompts too
+		await _rebuild_prompt_index()
+	summary["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+	return summary
+
+
+def _prune_backups(keep):
+	names = sorted(
+		name for name in os.listdir(settings.BACKUP_DIR) if name.startswith("snippets-") and name.endswith(".db")
+	)
+	for name in names[:-keep] if keep > 0 else ():
+		os.remove(os.path.join(settings.BACKUP_DIR, name))
+
+
+# Write a backup of the database to BACKUP_DIR on a worker thread and keep the newest BACKUP_KEEP
+async def backup():
+	if not settings.BACKUP_DIR:
+		raise HTTPException(status_code=404, detail="Backups are not enabled")
+	if backup_lock.locked():
+		raise HTTPException(status_code=409, detail="A backup is already running")
+
+	async with backup_lock:
+		started = time.perf_counter()
+		os.makedirs(settings.BACKUP_DIR, exist_ok=True)
+		now = time.time()
+		name = f"snippets-{time.strftime('%Y%m%d-%H%M%S', time.gmtime(now))}-{int(now * 1000) % 1000:03d}.db"
+		path = os.path.join(settings.BACKUP_DIR, name)
+		# Written under another name first, so a backup file is always complete
+		partial = f"{path}.partial"
+		try:
+			await asyncio.to_thread(db.backup, partial)
+			os.replace(partial, path)
+		finally:
+			if os.path.exists(partial):
+				os.remove(partial)
+		_prune_backups(settings.BACKUP_KEEP)
+		return {
+			"name": name,
+			"bytes": os.path.getsize(path),
+			"duration_ms": round((time.perf_counter() - started) * 1000, 3),
+		}
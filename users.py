@@ -0,0 +1,174 @@
+import time
+import uuid
+import hashlib
+import secrets
+import contextvars
+from http.cookies import SimpleCookie
+from fastapi import HTTPException
+
+import db
+import metrics
+import settings
+import ratelimit
+
+# Users, their sessions and their quotas. Every request runs as a user: the one whose session token
+# it carries in an Authorization bearer header or the session cookie, or else one standing for its
+# client address. Opening the page starts a session for a browser without one. Snippets belong to
+# the user that created them, and each user's model calls are limited by a request and a token
+# quota. Quotas and the session start limit are kept in memory, so they apply per worker process.
+
+COOKIE = "session"
+
+# The user the current request or job runs as; empty outside of one, where nothing is checked
+current_user = contextvars.ContextVar("user", default="")
+
+
+def current():
+	return current_user.get()
+
+
+# Whether the current user may see a snippet; snippets from before users existed have no owner
+def can_access(snippet):
+	return snippet["owner"] in ("", current())
+
+
+def _hash(token):
+	return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+session_starts = ratelimit.KeyedBuckets(settings.SESSIONS_PER_HOUR / 3600, max(1, int(settings.SESSIONS_PER_HOUR)))
+
+
+# Create a user and a session for it; returns the session token and the user id
+def start_session(address, name="Anonymous"):
+	if session_starts.enabled():
+		wait = session_starts.get(address).try_acquire()
+		if wait:
+			raise HTTPException(
+				status_code=429,
+				detail="Too many sessions started, please retry later",
+				headers={"Retry-After": str(int(wait) + 1)},
+			)
+	token = secrets.token_urlsafe(32)
+	user_id = str(uuid.uuid4())
+	db.create_session(_hash(token), user_id, name, time.time() + settings.SESSION_DAYS * 86400)
+	metrics.SESSIONS_STARTED.inc()
+	return token, user_id
+
+
+# The user id of a valid session token, or None
+def resolve(token):
+	row = db.get_session(_hash(token)) if token else None
+	return row["id"] if row is not None else None
+
+
+def end_session(token):
+	db.delete_session(_hash(token))
+
+
+def cookie_header(token):
+	return f"{COOKIE}={token}; Path=/; Max-Age={int(settings.SESSION_DAYS * 86400)}; HttpOnly; SameSite=Lax"
+
+
+# The session token a request carries, preferring the Authorization header over the cookie
+def request_token(headers):
+	authorization = headers.get("authorization", "")
+	if authorization.lower().startswith("bearer "):
+		return authorization[len("bearer "):].strip()
+	cookie = SimpleCookie(headers.get("cookie", ""))
+	return cookie[COOKIE].value if COOKIE in cookie else None
+
+
+# Reject a request unless its X-Admin-Token header holds ADMIN_TOKEN; with no ADMIN_TOKEN set,
+# every request is rejected
+def require_admin(headers):
+	token = headers.get("x-admin-token", "").encode("utf-8")
+	if not settings.ADMIN_TOKEN or not secrets.compare_digest(token, settings.ADMIN_TOKEN.encode("utf-8")):
+		raise HTTPException(status_code=403, detail="This needs the admin token")
+
+
+# ASGI middleware running each request as the user of its session, starting one for a browser
+# opening the page without one. Plain ASGI so the user is still set while a response streams
+class SessionMiddleware:
+	def __init__(self, app):
+		self.app = app
+
+	async def __call__(self, scope, receive, send):
+		if scope["type"] != "http":
+			await self.app(scope, receive, send)
+			return
+
+		headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]}
+		address = scope["client"][0] if scope.get("client") else "unknown"
+		user = resolve(request_token(headers))
+		new_token = None
+		if user is None and scope["method"] == "GET" and scope["path"] == "/":
+			try:
+				new_token, user = start_session(address)
+			except HTTPException:
+				pass
+		if user is None:
+			user = f"address:{address}"
+
+		async def send_with_cookie(message):
+			if message["type"] == "http.response.start" and new_token is not None:
+				message["headers"] = [*message.get("headers", []), (b"set-cookie", cookie_header(new_token).encode("latin-1"))]
+			await send(message)
+
+		token = current_user.set(user)
+		try:
+			await self.app(scope, receive, send_with_cookie)
+		finally:
+			current_user.reset(token)
+
+
+# Per user model call and token quotas. A call is refused while the user's request bucket is empty
+# or their token bucket is in debt; tokens are only known once a reply arrives, so they are charged
+# afterwards and a large reply can take the bucket below zero
+class Quotas:
+	def __init__(self):
+		self.requests = ratelimit.KeyedBuckets(settings.USER_REQUESTS_PER_MINUTE / 60, settings.USER_REQUESTS_BURST)
+		self.tokens = ratelimit.KeyedBuckets(settings.USER_TOKENS_PER_HOUR / 3600, settings.USER_TOKENS_BURST)
+
+	def _reject(self, kind, wait):
+		metrics.QUOTA_REJECTIONS.inc(kind=kind)
+		raise HTTPException(
+			status_code=429,
+			detail=f"Model {kind} quota used up, please retry later",
+			headers={"Retry-After": str(int(wait) + 1)},
+		)
+
+	# Take one model call from the user's quota or raise a 429
+	def charge_request(self, user):
+		if not user:
+			return
+		if self.tokens.enabled():
+			wait = self.tokens.get(user).debt_seconds()
+			if wait:
+				self._reject("tokens", wait)
+		if self.requests.enabled():
+			wait = self.requests.get(user).try_acquire()
+			if wait:
+				self._reject("requests", wait)
+
+	def charge_tokens(self, user, count):
+		if user and count and self.tokens.enabled():
+			self.tokens.get(user).spend(count)
+
+	# What is left of the user's quotas, None for those turned off
+	def status(self, user):
+		return {
+			"requests_remaining": int(self.requests.get(user).available()) if self.requests.enabled() else None,
+			"requests_per_minute": settings.USER_REQUESTS_PER_MINUTE or None,
+			"tokens_remaining": int(self.tokens.get(user).available()) if self.tokens.enabled() else None,
+			"tokens_per_hour": settings.USER_TOKENS_PER_HOUR or None,
+		}
+
+
+quotas = Quotas()
+
+metrics.Gauge(
+	"quota_tracked_users",
+	"Users with a quota bucket in memory",
+	function=lambda: {(): max(len(quotas.requests), len(quotas.tokens))},
+)
@@ -0,0 +1,101 @@
+import zlib
+import json
+import difflib
+
+# Line based deltas between snippet revisions and their compressed storage format.
+# A delta is a list of operations applied to the previous text's lines: a [start, end] pair
+# copies that range of old lines, a list of strings inserts new lines. Each stored body is the
+# JSON of {"code": ..., "tests": ...} compressed with zlib, holding either the full texts or
+# one delta per column.
+
+# Columns whose revisions are kept
+COLUMNS = ("code", "tests")
+
+
+def diff(old, new):
+	old_lines = old.split("\n")
+	new_lines = new.split("\n")
+	operations = []
+	matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+	for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+		if tag == "equal":
+			operations.append([old_start, old_end])
+		elif tag in ("replace", "insert"):
+			operations.append(new_lines[new_start:new_end])
+	return operations
+
+
+def patch(old, operations):
+	old_lines = old.split("\n")
+	lines = []
+	for operation in operations:
+		if operation and isinstance(operation[0], int):
+			lines.extend(old_lines[operation[0]:operation[1]])
+		else:
+			lines.extend(operation)
+	return "\n".join(lines)
+
+
+def pack(value):
+	return zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"))
+
+
+def unpack(body):
+	return json.loads(zlib.decompress(body))
+
+
+# Body storing the complete texts
+def full_body(texts):
+	return pack({column: texts[column] for column in COLUMNS})
+
+
+# Body storing how to get from the previous texts to the new ones
+def delta_body(previous, texts):
+	return pack({column: diff(previous[column], texts[column]) for column in COLUMNS})
+
+
+# Yield the texts of each version of a chain of (is_full, body) pairs that starts with a full body
+def replay(chain):
+	texts = None
+	for is_full, body in chain:
+		value = unpack(body)
+		if is_full:
+			texts = value
+		else:
+			texts = {column: patch(texts[column], value[column]) for column in COLUMNS}
+		yield texts
+
+
+# Rebuild the texts of a version from its chain: the nearest full body and the deltas after it
+def rebuild(chain):
+	texts = None
+	for texts in replay(chain):
+		pass
+	return texts
+
+
+# The (is_full, body) pairs storing a sequence of version texts, a full body every snapshot_every versions
+def encode(history, snapshot_every):
+	previous = None
+	for number, texts in enumerate(history, start=1):
+		if previous is None or (number - 1) % snapshot_every == 0:
+			yield True, full_body(texts)
+		else:
+			yield False, delta_body(previous, texts)
+		previous = texts
+
+
+# Unified diffs of every column between two versions' texts
+def unified(old, new, old_label, new_label):
+	return {
+		column: "\n".join(
+			difflib.unified_diff(
+				old[column].splitlines(),
+				new[column].splitlines(),
+				fromfile=f"{column}@{old_label}",
+				tofile=f"{column}@{new_label}",
+				lineterm="",
+			)
+		)
+		for column in COLUMNS
+	}
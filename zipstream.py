@@ -0,0 +1,107 @@
+import time
+import zlib
+import struct
+import tempfile
+
+# Streaming zip writer. Each file is compressed and returned as soon as it is added, and its central
+# directory record is spooled to a temporary file until the end, so memory stays flat however many
+# files the archive holds (zipfile keeps about half a kilobyte per file for its directory).
+# Zip64 end records are written once there are more than 65535 files or 4 GB of data.
+
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+ZIP64_OFFSET = struct.Struct("<HHQ")
+ZIP64_END = struct.Struct("<IQHHIIQQQQ")
+ZIP64_LOCATOR = struct.Struct("<IIQI")
+END = struct.Struct("<IHHHHIIH")
+
+# Names are UTF-8, entries deflated, made on Unix with rw-r--r-- permissions
+UTF8_FLAG = 0x800
+DEFLATED = 8
+VERSION = 20
+ZIP64_VERSION = 45
+MADE_BY_UNIX = 3 << 8
+FILE_ATTRIBUTES = 0o100644 << 16
+
+LIMIT_16 = 0xFFFF
+LIMIT_32 = 0xFFFFFFFF
+
+# Bytes of the spooled directory read back per chunk
+CHUNK_BYTES = 1 << 16
+
+
+class ZipStream:
+	def __init__(self, level=6):
+		self.level = level
+		self.offset = 0
+		self.count = 0
+		self.directory = tempfile.TemporaryFile()
+		now = time.localtime()
+		self.time = now.tm_hour << 11 | now.tm_min << 5 | now.tm_sec // 2
+		self.date = (now.tm_year - 1980) << 9 | now.tm_mon << 5 | now.tm_mday
+
+	# The bytes of a file entry: its local header and compressed data
+	def add(self, name, data):
+		name = name.encode("utf-8")
+		crc = zlib.crc32(data)
+		compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+		compressed = compressor.compress(data) + compressor.flush()
+		header = LOCAL_HEADER.pack(
+			0x04034B50, VERSION, UTF8_FLAG, DEFLATED, self.time, self.date, crc, len(compressed), len(data), len(name), 0
+		)
+
+		extra = b""
+		offset = self.offset
+		if offset >= LIMIT_32:
+			extra = ZIP64_OFFSET.pack(0x0001, 8, offset)
+			offset = LIMIT_32
+		self.directory.write(
+			CENTRAL_HEADER.pack(
+				0x02014B50,
+				MADE_BY_UNIX | (ZIP64_VERSION if extra else VERSION),
+				ZIP64_VERSION if extra else VERSION,
+				UTF8_FLAG,
+				DEFLATED,
+				self.time,
+				self.date,
+				crc,
+				len(compressed),
+				len(data),
+				len(name),
+				len(extra),
+				0,
+				0,
+				0,
+				FILE_ATTRIBUTES,
+				offset,
+			)
+			+ name
+			+ extra
+		)
+		self.count += 1
+		self.offset += len(header) + len(name) + len(compressed)
+		return header + name + compressed
+
+	# Yield the central directory and end records, then drop the spooled directory
+	def finish(self):
+		try:
+			start = self.offset
+			size = self.directory.tell()
+			self.directory.seek(0)
+			while chunk := self.directory.read(CHUNK_BYTES):
+				yield chunk
+
+			if self.count >= LIMIT_16 or start >= LIMIT_32 or size >= LIMIT_32:
+				end64 = start + size
+				yield ZIP64_END.pack(
+					0x06064B50, ZIP64_END.size - 12, ZIP64_VERSION, ZIP64_VERSION, 0, 0, self.count, self.count, size, start
+				)
+				yield ZIP64_LOCATOR.pack(0x07064B50, 0, end64, 1)
+			yield END.pack(
+				0x06054B50, 0, 0, min(self.count, LIMIT_16), min(self.count, LIMIT_16), min(size, LIMIT_32), min(start, LIMIT_32), 0
+			)
+		finally:
+			self.close()
+
+	def close(self):
+		self.directory.close()